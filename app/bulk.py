@@ -0,0 +1,56 @@
+from typing import Any, AsyncIterator, Optional, Tuple
+
+import orjson
+
+from fastapi import HTTPException, Request, status
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson")
+
+
+def is_ndjson(request: Request) -> bool:
+    content_type = request.headers.get("content-type", "")
+    return content_type.split(";")[0].strip().lower() in NDJSON_MEDIA_TYPES
+
+
+def _parse_line(line: bytes) -> Tuple[Any, Optional[str]]:
+    try:
+        return orjson.loads(line), None
+    except orjson.JSONDecodeError as e:
+        return None, f"Invalid JSON: {e}"
+
+
+async def iter_json_items(
+    request: Request,
+) -> AsyncIterator[Tuple[Any, Optional[str]]]:
+    """Yield `(item, error)` for every item of a bulk request body.
+
+    The body is either a JSON array or, with an NDJSON content type, one
+    JSON document per line. NDJSON is parsed while it streams in, and a
+    malformed line only fails that item.
+    """
+    if not is_ndjson(request):
+        try:
+            items = orjson.loads(await request.body())
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid JSON: {e}",
+            ) from None
+        if not isinstance(items, list):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Expected a JSON array or an NDJSON body.",
+            )
+        for item in items:
+            yield item, None
+        return
+
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_line(line)
+    if buffer.strip():
+        yield _parse_line(buffer)
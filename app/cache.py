@@ -0,0 +1,150 @@
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Set, Tuple
+
+from app.settings import settings
+
+MISSING = object()
+
+
+class TTLCache:
+    """In-process LRU cache whose entries also expire after `ttl` seconds.
+
+    Entries carry tags so that a write can drop exactly the entries that
+    depend on the rows it touched. Each invalidation bumps `version`; a
+    reader that captured the version before going to the database passes
+    it to `set`, and the value is discarded if a write happened meanwhile.
+    Values read from a lagging replica can also be discarded for
+    `settle_time` seconds after the last invalidation.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.version = 0
+        self.invalidated_at = float("-inf")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, Set[str]]]"
+        self._entries = OrderedDict()
+        self._tags: Dict[str, Set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value, _ = entry
+        if expires_at <= self.clock():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        tags: Iterable[str] = (),
+        version: int = -1,
+        settle_time: float = 0.0,
+    ) -> None:
+        if self.maxsize <= 0 or (version != -1 and version != self.version):
+            return
+        if settle_time and self.clock() - self.invalidated_at < settle_time:
+            return
+        if key in self._entries:
+            self._remove(key)
+        tag_set = set(tags)
+        self._entries[key] = (self.clock() + self.ttl, value, tag_set)
+        for tag in tag_set:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        self._bump()
+        for key in keys:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tags(self, *tags: str) -> None:
+        self._bump()
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        self._bump()
+        self._entries.clear()
+        self._tags.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _bump(self) -> None:
+        self.version += 1
+        self.invalidated_at = self.clock()
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+def product_tag(product_id: int) -> str:
+    return f"product:{product_id}"
+
+
+def category_tag(category_id: int) -> str:
+    return f"category:{category_id}"
+
+
+def product_filter_tag(column: str) -> str:
+    """Tag of the product listings filtered on `column`.
+
+    A write that changes the column can move any product into or out of
+    them, not only the products they show.
+    """
+    return f"products:filter:{column}"
+
+
+product_cache = TTLCache(
+    maxsize=settings.PRODUCT_CACHE_SIZE,
+    ttl=settings.PRODUCT_CACHE_TTL,
+)
@@ -15,3 +15,12 @@ class OrderStatus(str, Enum):
     DECLINED = "declined"
     REFUNDED = "refunded"
     MANUAL_VERIFICATION_REQUIRED = "manual_verification_required"
+
+
+class BulkRowStatus(str, Enum):
+    CREATED = "created"
+    # The same name appeared earlier in the payload.
+    DUPLICATE = "duplicate"
+    # A row with the same name is already stored.
+    EXISTS = "exists"
+    INVALID = "invalid"
@@ -1,17 +1,167 @@
-from fastapi import Depends
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import time
+
+from typing import Any, Callable, Dict, List, Sequence, Union
+
+from fastapi import Depends, Request
+from sqlalchemy import event, exc
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from app.metrics import instrument_engine
 from app.settings import settings
 
-engine = create_async_engine(
-    url=settings.SQLALCHEMY_DATABASE_URI,
-    echo=True,
-    future=True,
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that keeps track of how long checkouts had to wait."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkout_count: int = 0
+        self.wait_time_total: float = 0.0
+        self.wait_time_max: float = 0.0
+        self.timeout_count: int = 0
+
+    def _do_get(self) -> Any:
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeout_count += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started_at
+            self.checkout_count += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "checkouts": self.checkout_count,
+            "timeouts": self.timeout_count,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_avg": (
+                self.wait_time_total / self.checkout_count
+                if self.checkout_count
+                else 0.0
+            ),
+            "wait_time_max": self.wait_time_max,
+        }
+
+
+def configure_sqlite(sync_engine: Engine) -> None:
+    """Give SQLite connections real transactions and enforced foreign keys.
+
+    The sqlite3 driver only opens a transaction before data changes and
+    never around reads or savepoints, so it is switched to autocommit and
+    every transaction is opened here instead. The `sqlite_begin`
+    execution option picks the kind: `IMMEDIATE` takes the write lock
+    up front, which stands in for the row locks SQLite does not have.
+    """
+
+    @event.listens_for(sync_engine, "connect")
+    def connect(dbapi_connection: Any, connection_record: Any) -> None:
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.close()
+
+    @event.listens_for(sync_engine, "begin")
+    def begin(conn: Connection) -> None:
+        mode = conn.get_execution_options().get("sqlite_begin", "DEFERRED")
+        # Straight on the driver, so it is not counted as a query.
+        cursor = conn.connection.cursor()
+        cursor.execute(f"BEGIN {mode}")
+        cursor.close()
+
+
+def build_engine(url: str) -> AsyncEngine:
+    if make_url(url).get_backend_name() == "sqlite":
+        connect_args: Dict[str, Any] = {
+            "timeout": settings.SQLITE_BUSY_TIMEOUT
+        }
+    else:
+        connect_args = {
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE
+        }
+    pool_size, max_overflow = settings.pool_limits()
+    async_engine = create_async_engine(
+        url=url,
+        echo=settings.DB_ECHO,
+        future=True,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    if async_engine.dialect.name == "sqlite":
+        configure_sqlite(async_engine.sync_engine)
+    if settings.METRICS_ENABLED:
+        instrument_engine(async_engine.sync_engine)
+    return async_engine
+
+
+class ReplicaSet:
+    """Picks the replica engine that serves the next read-only session.
+
+    `round_robin` takes the replicas in turn; `least_connections` takes
+    the one with the fewest checked out connections in this worker, and
+    rotates between replicas that are tied.
+    """
+
+    def __init__(
+        self, engines: Sequence[AsyncEngine], selection: str = "round_robin"
+    ) -> None:
+        self.engines = list(engines)
+        self.selection = selection
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def choose(self) -> AsyncEngine:
+        start = self._next % len(self.engines)
+        self._next += 1
+        if self.selection == "least_connections":
+            rotated = self.engines[start:] + self.engines[:start]
+            return min(rotated, key=lambda e: e.sync_engine.pool.checkedout())
+        return self.engines[start]
+
+
+engine = build_engine(settings.SQLALCHEMY_DATABASE_URI)
+
+replicas = ReplicaSet(
+    [build_engine(url) for url in settings.DB_REPLICA_URIS],
+    selection=settings.DB_REPLICA_SELECTION,
 )
 
+# A request carrying either of these reads from the primary. The cookie is
+# set on responses to writes; the header lets a client ask for it at will.
+READ_PRIMARY_HEADER = "X-Read-Primary"
+READ_PRIMARY_COOKIE = "read_primary"
+
+# Sessions that write take SQLite's write lock as soon as they begin, so
+# concurrent checkouts queue up instead of failing on a stale snapshot.
+# Postgres ignores the option.
+write_engine = engine.execution_options(sqlite_begin="IMMEDIATE")
+
 SessionLocal = sessionmaker(
-    bind=engine,
+    bind=write_engine,
     class_=AsyncSession,
     expire_on_commit=False,
     autocommit=False,
@@ -27,4 +177,63 @@ async def get_session() -> AsyncSession:
         raise e
 
 
+def reads_from_primary(request: Request) -> bool:
+    return (
+        not replicas
+        or READ_PRIMARY_HEADER in request.headers
+        or READ_PRIMARY_COOKIE in request.cookies
+    )
+
+
+async def get_read_session(request: Request) -> AsyncSession:
+    """Session for read-only handlers, bound to a replica when possible."""
+    if reads_from_primary(request):
+        async with SessionLocal(bind=engine) as session:
+            yield session
+        return
+
+    async with SessionLocal(bind=replicas.choose()) as session:
+        session.info["replica"] = True
+        yield session
+
+
+def is_replica_session(session: AsyncSession) -> bool:
+    return bool(session.info.get("replica", False))
+
+
+# Both support ON CONFLICT with the same interface.
+UpsertInsert = Union[postgresql.Insert, sqlite.Insert]
+
+
+def insert_for(session: AsyncSession) -> Callable[..., UpsertInsert]:
+    if session.bind.dialect.name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
+
+
+def _pool_stats(async_engine: AsyncEngine) -> Dict[str, Any]:
+    pool = async_engine.sync_engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.stats()
+    return {"status": pool.status()}  # pragma: no cover
+
+
+async def dispose_engines() -> None:
+    """Close the pooled connections of the primary and every replica.
+
+    aiosqlite runs each connection on a thread of its own that keeps the
+    process alive until the connection is closed.
+    """
+    for async_engine in (engine, *replicas.engines):
+        await async_engine.dispose()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    replica_stats: List[Dict[str, Any]] = [
+        _pool_stats(replica) for replica in replicas.engines
+    ]
+    return {**_pool_stats(engine), "replicas": replica_stats}
+
+
 ActiveSession = Depends(get_session)
+ReadSession = Depends(get_read_session)
@@ -0,0 +1,35 @@
+import hashlib
+
+from typing import Any, Iterable
+
+from fastapi import Request, Response, status
+
+
+def make_etag(versions: Iterable[Any]) -> str:
+    """Build a strong ETag from the row versions a representation uses."""
+    digest = hashlib.blake2b(digest_size=16)
+    for version in versions:
+        digest.update(repr(version).encode("utf-8"))
+        digest.update(b"\x00")
+    return '"' + digest.hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored.
+    candidates = {
+        candidate.strip().removeprefix("W/")
+        for candidate in if_none_match.split(",")
+    }
+    return etag in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag},
+    )
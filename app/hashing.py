@@ -0,0 +1,65 @@
+import asyncio
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+import helpers
+
+from app.settings import settings
+
+T = TypeVar("T")
+
+
+class PasswordHasher:
+    """Runs the PBKDF2 helpers in a bounded process pool.
+
+    Hashing a password takes ~100ms of pure CPU time, which would stall
+    every other request served by the worker if it ran on the event loop.
+    """
+
+    def __init__(self, max_workers: int, max_concurrency: int) -> None:
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # A semaphore is bound to the loop it is first awaited on.
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        async with self._get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), func, *args
+            )
+
+    async def hash(self, password: str) -> str:
+        return await self._run(helpers.hash_password, password)
+
+    async def verify(
+        self, stored_password: str, provided_password: str
+    ) -> bool:
+        return await self._run(
+            helpers.verify_password, stored_password, provided_password
+        )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    max_workers=settings.PASSWORD_HASHING_WORKERS,
+    max_concurrency=settings.PASSWORD_HASHING_CONCURRENCY,
+)
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional, Tuple
+from weakref import WeakValueDictionary
+
+from fastapi import Header, HTTPException, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import MISSING, TTLCache
+from app.db import insert_for
+from app.models.idempotency import IdempotencyKey
+from app.serialization import json_response
+from app.settings import settings
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+# Set on responses that were replayed rather than produced by the request.
+IDEMPOTENT_REPLAYED_HEADER = "Idempotent-Replayed"
+
+# (fingerprint, status code, JSON body)
+StoredResponse = Tuple[str, int, str]
+
+idempotency_cache = TTLCache(
+    maxsize=settings.IDEMPOTENCY_CACHE_SIZE,
+    ttl=settings.IDEMPOTENCY_CACHE_TTL,
+)
+
+# Requests of this worker that hold a key; duplicates queue up behind them.
+_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+
+def request_fingerprint(request: Request) -> str:
+    """Hash of what identifies a request besides its body.
+
+    The query is sorted, so a retry that orders its parameters differently
+    is still the same request.
+    """
+    query = sorted(request.query_params.multi_items())
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.url.path}".encode("utf-8"))
+    for name, value in query:
+        digest.update(f"\x00{name}={value}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Claim:
+    """A request's hold on its idempotency key.
+
+    `replay` is the stored response when the key was already used; the
+    handler returns it as is. Otherwise the handler does its work, passes
+    the result to `save` and commits.
+    """
+
+    def __init__(
+        self, session: AsyncSession, key: Optional[str], fingerprint: str
+    ) -> None:
+        self.session = session
+        self.key = key
+        self.fingerprint = fingerprint
+        self.replay: Optional[Response] = None
+        self.stored: Optional[StoredResponse] = None
+
+    async def save(self, status_code: int, content: Any) -> None:
+        """Store the response in the transaction the handler commits."""
+        if self.key is None:
+            return
+        body = JSONResponse(jsonable_encoder(content)).body.decode("utf-8")
+        await self.session.execute(
+            update(IdempotencyKey.__table__)
+            .where(IdempotencyKey.__table__.c.key == self.key)
+            .values(status_code=status_code, response=body)
+        )
+        self.stored = (self.fingerprint, status_code, body)
+
+
+def replay(stored: StoredResponse, fingerprint: str) -> Response:
+    stored_fingerprint, status_code, body = stored
+    if stored_fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{IDEMPOTENCY_KEY_HEADER} was used with another request.",
+        )
+    response = json_response(body.encode("utf-8"), status_code=status_code)
+    response.headers[IDEMPOTENT_REPLAYED_HEADER] = "true"
+    return response
+
+
+async def insert_or_fetch(
+    session: AsyncSession, key: str, fingerprint: str
+) -> Optional[StoredResponse]:
+    """Insert the key, or return the response stored for it.
+
+    On Postgres the insert waits for a transaction that holds the same key
+    uncommitted, so a duplicate from another worker only goes on once the
+    first request has committed its response, or rolled back and left the
+    key to this one. SQLite serializes the write transactions anyway.
+    """
+    table = IdempotencyKey.__table__
+    result = await session.execute(
+        insert_for(session)(table)
+        .values(key=key, fingerprint=fingerprint)
+        .on_conflict_do_nothing(index_elements=[table.c.key])
+    )
+    if result.rowcount:
+        return None
+    result = await session.execute(
+        select(
+            table.c.fingerprint, table.c.status_code, table.c.response
+        ).where(table.c.key == key)
+    )
+    stored_fingerprint, status_code, body = result.one()
+    if status_code is None:  # pragma: no cover
+        # Only stored with the response, so only seen if that is broken.
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"A request with this {IDEMPOTENCY_KEY_HEADER} "
+            "is in progress.",
+        )
+    return stored_fingerprint, status_code, body
+
+
+@asynccontextmanager
+async def claim(
+    session: AsyncSession, request: Request, key: Optional[str]
+) -> AsyncIterator[Claim]:
+    """Run the block at most once per idempotency key.
+
+    Without a key the block simply runs. With one, a duplicate gets the
+    stored response as `Claim.replay` instead: from this worker's cache,
+    or from the database. Duplicates in this worker wait on a lock for the
+    first request to finish. A block that raises rolls back, key
+    included, so failed requests are run again when retried.
+    """
+    fingerprint = request_fingerprint(request)
+    current = Claim(session, key, fingerprint)
+    if key is None:
+        yield current
+        return
+
+    stored = idempotency_cache.get(key)
+    if stored is MISSING:
+        lock = _locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            stored = idempotency_cache.get(key)
+            if stored is MISSING:
+                stored = await insert_or_fetch(session, key, fingerprint)
+            if stored is None:
+                try:
+                    yield current
+                except BaseException:
+                    await session.rollback()
+                    raise
+                if current.stored is not None:
+                    idempotency_cache.set(key, current.stored)
+                return
+            idempotency_cache.set(key, stored)
+
+    current.replay = replay(stored, fingerprint)
+    yield current
+
+
+IdempotencyKeyHeader = Header(
+    default=None, alias=IDEMPOTENCY_KEY_HEADER, min_length=1, max_length=255
+)
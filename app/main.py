@@ -1,15 +1,23 @@
+from typing import Any, Dict
+
 import better_exceptions
 
 from fastapi import FastAPI, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import RedirectResponse, Response
 
-from app.db import ActiveSession
+from app import metrics
+from app.cache import product_cache
+from app.db import ActiveSession, dispose_engines, get_pool_stats
+from app.hashing import password_hasher
+from app.idempotency import idempotency_cache
+from app.middleware import MetricsMiddleware, ReadYourWritesMiddleware
 from app.routers.cart import router as cart_router
 from app.routers.category import router as category_router
 from app.routers.order import router as order_router
 from app.routers.product import router as product_router
 from app.routers.user import router as user_router
+from app.settings import settings
 
 better_exceptions.MAX_LENGTH = None
 
@@ -33,6 +41,11 @@ app = FastAPI(
     redoc_url=None,
 )
 
+app.add_middleware(ReadYourWritesMiddleware)
+if settings.METRICS_ENABLED:
+    # Added last so that it wraps, and times, every other middleware.
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(user_router)
 app.include_router(category_router)
 app.include_router(product_router)
@@ -40,6 +53,16 @@ app.include_router(cart_router)
 app.include_router(order_router)
 
 
+@app.on_event("shutdown")
+def shutdown_password_hasher() -> None:
+    password_hasher.shutdown()
+
+
+@app.on_event("shutdown")
+async def shutdown_engines() -> None:
+    await dispose_engines()
+
+
 @app.get("/")
 async def root() -> RedirectResponse:
     return RedirectResponse(url="/docs")
@@ -61,7 +84,19 @@ async def check_db_readiness(
         )
 
 
-if __name__ == "__main__":  # pragma: no cover
-    import uvicorn
+@app.get("/db_pool")
+async def get_db_pool_stats() -> Dict[str, Any]:
+    return get_pool_stats()
+
+
+@app.get("/cache_stats")
+async def get_cache_stats() -> Dict[str, Any]:
+    return {
+        "products": product_cache.stats(),
+        "idempotency": idempotency_cache.stats(),
+    }
+
 
-    uvicorn.run(app, host="localhost", port=8000)
+@app.get("/metrics", response_class=Response)
+async def get_metrics() -> Response:
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,178 @@
+import time
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Route
+from starlette.types import Scope
+
+# Starlette appends the charset to text media types.
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1.0,
+    2.5,
+    5.0,
+    7.5,
+    10.0,
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = []
+    for i, name in enumerate(names):
+        value = (
+            values[i]
+            .replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"')
+        )
+        pairs.append(name + '="' + value + '"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Bucketed observations per label values, without locking.
+
+    Each label set keeps per-bucket counts; they are only made cumulative
+    when rendered, so observing is a bisect and two additions.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.bounds = (*(repr(bound) for bound in self.buckets), "+Inf")
+        # label values -> [count per bucket..., count above the last, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def clear(self) -> None:
+        self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        bucket_labels = (*self.label_names, "le")
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for i, bound in enumerate(self.bounds):
+                cumulative += series[i]
+                labels = _format_labels(bucket_labels, (*label_values, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling a request, by route template and status.",
+    ("method", "route", "status"),
+)
+request_db_queries = Histogram(
+    "http_request_db_queries",
+    "Database queries run while handling a request.",
+    ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+request_db_duration = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent waiting on database queries while handling a request.",
+    ("method", "route"),
+)
+REGISTRY = (request_duration, request_db_queries, request_db_duration)
+
+
+def render() -> bytes:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def reset() -> None:
+    for metric in REGISTRY:
+        metric.clear()
+
+
+class RequestDatabaseUsage:
+    __slots__ = ("queries", "duration")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.duration = 0.0
+
+
+# Set by the middleware for the duration of a request; queries run outside
+# of a request are not attributed to anything.
+current_usage: ContextVar[Optional[RequestDatabaseUsage]] = ContextVar(
+    "current_usage", default=None
+)
+
+
+def _before_cursor_execute(  # type: ignore
+    conn, cursor, statement, parameters, context, executemany
+) -> None:
+    context._query_started_at = time.perf_counter()
+
+
+def _after_cursor_execute(  # type: ignore
+    conn, cursor, statement, parameters, context, executemany
+) -> None:
+    usage = current_usage.get()
+    if usage is not None:
+        usage.queries += 1
+        usage.duration += time.perf_counter() - context._query_started_at
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Attribute the queries run through `engine` to the current request."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def route_template(scope: Scope) -> str:
+    """The path template of the route that handled the request.
+
+    Templates rather than raw paths keep the number of series bounded.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return str(route.path)
+    endpoint = scope.get("endpoint")
+    router = scope.get("router")
+    if endpoint is not None and router is not None:
+        for candidate in router.routes:
+            if isinstance(candidate, Route) and candidate.endpoint is endpoint:
+                return str(candidate.path)
+    return "unmatched"
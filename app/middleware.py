@@ -0,0 +1,95 @@
+import time
+
+from http.cookies import SimpleCookie
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import db, metrics
+from app.settings import settings
+
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+class ReadYourWritesMiddleware:
+    """Pin a client's reads to the primary for a while after it writes.
+
+    A successful request with an unsafe method gets a short-lived cookie
+    that `get_read_session` honours, so the replicas' lag never hides the
+    client's own changes. Nothing is set when no replicas are configured.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] in SAFE_METHODS
+            or not db.replicas
+            or not settings.DB_READ_YOUR_WRITES_SECONDS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start" and (
+                message["status"] < 400
+            ):
+                cookie: SimpleCookie = SimpleCookie()
+                cookie[db.READ_PRIMARY_COOKIE] = "1"
+                cookie[db.READ_PRIMARY_COOKIE]["path"] = "/"
+                cookie[db.READ_PRIMARY_COOKIE]["httponly"] = True
+                cookie[db.READ_PRIMARY_COOKIE]["samesite"] = "lax"
+                cookie[db.READ_PRIMARY_COOKIE][
+                    "max-age"
+                ] = settings.DB_READ_YOUR_WRITES_SECONDS
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (
+                        b"set-cookie",
+                        cookie.output(header="").strip().encode("latin-1"),
+                    ),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+class MetricsMiddleware:
+    """Record the latency and the database usage of every HTTP request."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        usage = metrics.RequestDatabaseUsage()
+        token = metrics.current_usage.set(usage)
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            metrics.current_usage.reset(token)
+            method = scope["method"]
+            route = metrics.route_template(scope)
+            metrics.request_duration.observe(
+                elapsed, method, route, str(status_code)
+            )
+            metrics.request_db_queries.observe(usage.queries, method, route)
+            metrics.request_db_duration.observe(usage.duration, method, route)
@@ -3,10 +3,16 @@ from typing import List
 
 import sqlalchemy
 
-from sqlalchemy import Column, DateTime, ForeignKey
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    UniqueConstraint,
+)
 from sqlmodel import Field, Relationship, SQLModel
 
-from app.models.product import Product
+from app.models.product import Product, ProductDisplay
 from app.models.user import User
 
 
@@ -18,9 +24,10 @@ class Cart(SQLModel, table=True):  # type: ignore
         sa_column_kwargs=dict(autoincrement=True),
     )
 
+    # One cart per user, which is what add_to_cart upserts on.
     user_id: int = Field(
         default=None,
-        sa_column=Column(ForeignKey(User.id, ondelete="CASCADE")),
+        sa_column=Column(ForeignKey(User.id, ondelete="CASCADE"), unique=True),
     )
 
     cart_items: List["CartItem"] = Relationship(
@@ -28,7 +35,8 @@ class Cart(SQLModel, table=True):  # type: ignore
         sa_relationship_kwargs=dict(
             cascade="all, delete-orphan",
             uselist=True,
-            lazy="selectin",
+            lazy="raise",
+            passive_deletes=True,
         ),
     )
 
@@ -36,6 +44,7 @@ class Cart(SQLModel, table=True):  # type: ignore
         back_populates="cart",
         sa_relationship_kwargs=dict(
             uselist=False,
+            lazy="raise",
         ),
     )
 
@@ -55,24 +64,35 @@ class Cart(SQLModel, table=True):  # type: ignore
 class CartItem(SQLModel, table=True):  # type: ignore
     __abstract__ = False
     __tablename__ = "cart_items"
+    __table_args__ = (
+        UniqueConstraint(
+            "cart_id", "product_id", name="cart_items_cart_id_product_id_key"
+        ),
+    )
 
     id: int = Field(
         primary_key=True,
         sa_column_kwargs=dict(autoincrement=True),
     )
+    # Lookups by cart use the unique key above.
     cart_id: int = Field(
-        index=True,
         sa_column=Column(ForeignKey("carts.id", ondelete="CASCADE")),
     )
     product_id: int = Field(
-        index=True,
-        sa_column=Column(ForeignKey("products.id", ondelete="CASCADE")),
+        sa_column=Column(
+            ForeignKey("products.id", ondelete="CASCADE"), index=True
+        ),
+    )
+    quantity: int = Field(
+        default=1,
+        sa_column=Column(Integer, nullable=False, server_default="1"),
     )
 
     cart: Cart = Relationship(
         back_populates="cart_items",
         sa_relationship_kwargs=dict(
             uselist=False,
+            lazy="raise",
         ),
     )
 
@@ -80,6 +100,7 @@ class CartItem(SQLModel, table=True):  # type: ignore
         back_populates="cart_items",
         sa_relationship_kwargs=dict(
             uselist=False,
+            lazy="raise",
         ),
     )
 
@@ -99,7 +120,8 @@ class CartItem(SQLModel, table=True):  # type: ignore
 class CartItemDisplay(SQLModel):
     __abstract__ = True
     id: int
-    product: Product
+    product: ProductDisplay
+    quantity: int
     created_date: datetime
 
     class Config:
@@ -1,5 +1,8 @@
+from datetime import datetime
 from typing import List
 
+from sqlalchemy import Column, DateTime
+from sqlalchemy.sql.functions import now
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -10,6 +13,7 @@ class CategoryBase(SQLModel, table=False):  # type: ignore
         default=None,
         min_length=3,
         max_length=50,
+        index=True,
     )
 
     class Config:
@@ -25,6 +29,10 @@ class CategoryCreate(CategoryBase, table=False):  # type: ignore
     pass
 
 
+class CategoryWithCount(CategoryDisplay, table=False):  # type: ignore
+    product_count: int
+
+
 class Category(CategoryCreate, table=True):  # type: ignore
     __abstract__ = False
     __tablename__ = "categories"
@@ -34,11 +42,24 @@ class Category(CategoryCreate, table=True):  # type: ignore
         sa_column_kwargs=dict(autoincrement=True),
     )
 
+    # Row version used for ETags, bumped by every ORM or Core update.
+    updated_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column=Column(
+            name="updated_at",
+            type_=DateTime(),
+            default=datetime.utcnow,
+            onupdate=datetime.utcnow,
+            server_default=now(),
+            nullable=False,
+        ),
+    )
+
     products: List["Product"] = Relationship(  # type: ignore # noqa
         back_populates="category",
         sa_relationship_kwargs=dict(
             uselist=True,
-            lazy="selectin",
+            lazy="raise",
         ),
     )
 
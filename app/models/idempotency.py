@@ -0,0 +1,47 @@
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy
+
+from sqlalchemy import Column, DateTime, Integer, String, Text
+from sqlmodel import Field, SQLModel
+
+
+class IdempotencyKey(SQLModel, table=True):  # type: ignore
+    """Response of a write sent with an `Idempotency-Key` header.
+
+    The row is inserted when the request starts and completed in the same
+    transaction as its writes, so it only ever becomes visible with the
+    stored response.
+    """
+
+    __abstract__ = False
+    __tablename__ = "idempotency_keys"
+    id: int = Field(
+        primary_key=True,
+        sa_column_kwargs=dict(autoincrement=True),
+    )
+    key: str = Field(
+        sa_column=Column(String(255), unique=True, nullable=False),
+    )
+    # Hash of the method, path and query the key was first used with.
+    fingerprint: str = Field(
+        sa_column=Column(String(64), nullable=False),
+    )
+    status_code: Optional[int] = Field(
+        default=None, sa_column=Column(Integer, nullable=True)
+    )
+    response: Optional[str] = Field(
+        default=None, sa_column=Column(Text, nullable=True)
+    )
+    created_date: datetime = Field(
+        sa_column=Column(
+            name="created_date",
+            type_=DateTime(),
+            server_default=sqlalchemy.sql.func.now(),
+        )
+    )
+
+    class Config:
+        orm_mode = True
+        arbitrary_types_allowed = True
@@ -1,8 +1,10 @@
 from datetime import datetime
-from typing import List
+from typing import Any, List
 
-from sqlalchemy import Column, DateTime, ForeignKey
-from sqlalchemy.sql.functions import now
+from sqlalchemy import Column, DateTime, ForeignKey, Index
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.functions import GenericFunction, now
 from sqlmodel import Field, Relationship, SQLModel
 
 from app.constants import OrderStatus
@@ -10,9 +12,30 @@ from app.models.product import ProductDisplay
 from app.models.user import User, UserDisplay
 
 
+class statement_timestamp(GenericFunction):  # type: ignore
+    """When the current statement started.
+
+    `now()` is when the transaction started on Postgres, which would give
+    every order placed in one transaction the same date.
+    """
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(statement_timestamp, "sqlite")
+def statement_timestamp_sqlite(
+    element: statement_timestamp, compiler: SQLCompiler, **kw: Any
+) -> str:
+    """The time in the microsecond format SQLAlchemy stores on SQLite."""
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
 class Order(SQLModel, table=True):  # type: ignore
     __abstract__ = False
     __tablename__ = "orders"
+    # Order history is read per customer, newest first.
+    __table_args__ = (Index("ix_orders_customer_id_id", "customer_id", "id"),)
 
     id: int = Field(
         default=None,
@@ -20,7 +43,15 @@ class Order(SQLModel, table=True):  # type: ignore
         sa_column_kwargs=dict(autoincrement=True),
     )
 
-    order_date: datetime = Field(default=datetime.now())
+    # Set by the database, so INSERT ... SELECT checkouts get it too.
+    order_date: datetime = Field(
+        sa_column=Column(
+            name="order_date",
+            type_=DateTime(),
+            server_default=statement_timestamp(),
+            nullable=False,
+        )
+    )
 
     order_amount: float = Field(default=0.0)
 
@@ -41,7 +72,7 @@ class Order(SQLModel, table=True):  # type: ignore
         back_populates="orders",
         sa_relationship_kwargs=dict(
             uselist=False,
-            lazy="selectin",
+            lazy="raise",
         ),
     )
 
@@ -49,7 +80,8 @@ class Order(SQLModel, table=True):  # type: ignore
         back_populates="order",
         sa_relationship_kwargs=dict(
             uselist=True,
-            lazy="selectin",
+            lazy="raise",
+            passive_deletes=True,
         ),
     )
 
@@ -65,7 +97,9 @@ class OrderDetails(SQLModel, table=True):  # type: ignore
     )
 
     order_id: int = Field(
-        sa_column=Column(ForeignKey("orders.id", ondelete="CASCADE")),
+        sa_column=Column(
+            ForeignKey("orders.id", ondelete="CASCADE"), index=True
+        ),
         nullable=False,
     )
 
@@ -73,7 +107,7 @@ class OrderDetails(SQLModel, table=True):  # type: ignore
         back_populates="order_details",
         sa_relationship_kwargs=dict(
             uselist=False,
-            lazy="selectin",
+            lazy="raise",
         ),
     )
 
@@ -86,7 +120,7 @@ class OrderDetails(SQLModel, table=True):  # type: ignore
         back_populates="order_details",
         sa_relationship_kwargs=dict(
             uselist=False,
-            lazy="selectin",
+            lazy="raise",
         ),
     )
 
@@ -94,6 +128,9 @@ class OrderDetails(SQLModel, table=True):  # type: ignore
         default=1,
     )
 
+    # Price of one unit when the order was placed.
+    unit_price: float = Field(default=0.0)
+
     created_date: datetime = Field(
         sa_column=Column(
             name="created_date",
@@ -109,6 +146,7 @@ class OrderDetailDisplay(SQLModel, table=False):  # type: ignore
     order_id: int
     product_id: int
     quantity: int
+    unit_price: float
     created_date: datetime
     # order: "OrderDisplay"
     product: ProductDisplay
@@ -124,3 +162,13 @@ class OrderDisplay(SQLModel, table=False):  # type: ignore
     customer_id: int
     order_details: List[OrderDetailDisplay]
     user_info: UserDisplay
+
+
+class OrderSummary(SQLModel, table=False):  # type: ignore
+    __abstract__ = True
+    id: int
+    order_date: datetime
+    order_amount: float
+    status: OrderStatus
+    # Units ordered, summed over the order lines.
+    item_count: int
@@ -1,14 +1,22 @@
-from typing import List, Optional
-
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Column, Computed, DateTime, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from sqlalchemy.sql.compiler import DDLCompiler
+from sqlalchemy.sql.functions import now
 from sqlmodel import Field, Relationship, SQLModel
 
-from app.models.category import Category
+from app.constants import BulkRowStatus
+from app.models.category import Category, CategoryDisplay
 
 
 class ProductBase(SQLModel, table=False):  # type: ignore
     __abstract__ = True
 
-    name: str = Field(default=None, max_length=50)
+    name: str = Field(default=None, max_length=50, index=True)
     quantity: int = Field(default=None)
     description: str = Field(default=None, max_length=255)
     price: float = Field(default=None)
@@ -20,7 +28,7 @@ class ProductBase(SQLModel, table=False):  # type: ignore
 class ProductDisplay(ProductBase):
     __abstract__ = True
     id: int
-    category: Optional[Category]
+    category: Optional[CategoryDisplay]
 
 
 class ProductCreate(ProductBase):
@@ -28,9 +36,44 @@ class ProductCreate(ProductBase):
     category_id: Optional[int]
 
 
+class ProductBulkRowResult(SQLModel, table=False):  # type: ignore
+    index: int
+    status: BulkRowStatus
+    name: Optional[str] = None
+    id: Optional[int] = None
+    errors: Optional[List[Dict[str, Any]]] = None
+
+
+class ProductBulkResult(SQLModel, table=False):  # type: ignore
+    received: int
+    created: int
+    skipped: int
+    invalid: int
+    elapsed: float
+    rows_per_second: float
+    results: List[ProductBulkRowResult]
+
+
+# Names outweigh descriptions when search results are ranked.
+SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
 class Product(ProductCreate, table=True):  # type: ignore
     __abstract__ = False
     __tablename__ = "products"
+    __table_args__ = (
+        Index(
+            "ix_products_search_vector",
+            "search_vector",
+            postgresql_using="gin",
+        ),
+    )
+    # Maintained by Postgres and only read by searches, so it is left out
+    # of the mapping instead of being loaded with every product.
+    __mapper_args__ = {"exclude_properties": ["search_vector"]}
     id: int = Field(
         default=None,
         primary_key=True,
@@ -38,14 +81,36 @@ class Product(ProductCreate, table=True):  # type: ignore
     )
 
     category_id: Optional[int] = Field(
-        default=None, foreign_key="categories.id"
+        default=None, foreign_key="categories.id", index=True
+    )
+
+    # Row version used for ETags, bumped by every ORM or Core update.
+    updated_at: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column=Column(
+            name="updated_at",
+            type_=DateTime(),
+            default=datetime.utcnow,
+            onupdate=datetime.utcnow,
+            server_default=now(),
+            nullable=False,
+        ),
+    )
+
+    search_vector: Optional[str] = Field(
+        default=None,
+        sa_column=Column(
+            "search_vector",
+            TSVECTOR(),
+            Computed(SEARCH_DOCUMENT, persisted=True),
+        ),
     )
 
     category: Optional[Category] = Relationship(
         back_populates="products",
         sa_relationship_kwargs=dict(
             uselist=False,
-            lazy="selectin",
+            lazy="raise",
         ),
     )
 
@@ -54,7 +119,8 @@ class Product(ProductCreate, table=True):  # type: ignore
         sa_relationship_kwargs=dict(
             cascade="all, delete-orphan",
             uselist=True,
-            lazy="selectin",
+            lazy="raise",
+            passive_deletes=True,
         ),
     )
 
@@ -63,9 +129,59 @@ class Product(ProductCreate, table=True):  # type: ignore
         sa_relationship_kwargs=dict(
             cascade="all, delete-orphan",
             uselist=True,
+            lazy="raise",
+            passive_deletes=True,
         ),
     )
 
     class Config:
         orm_mode = True
         arbitrary_types_allowed = True
+
+
+# Listing filters and sorts. Prices sort with NULLs last in both directions,
+# which a backward scan of a single index cannot provide.
+products_table = Product.__table__
+Index("ix_products_price_id", products_table.c.price, products_table.c.id)
+Index(
+    "ix_products_price_desc_id_desc",
+    products_table.c.price.desc().nulls_last(),
+    products_table.c.id.desc(),
+)
+Index(
+    "ix_products_category_id_price_id",
+    products_table.c.category_id,
+    products_table.c.price,
+    products_table.c.id,
+)
+Index(
+    "ix_products_in_stock_price_id",
+    products_table.c.price,
+    products_table.c.id,
+    postgresql_where=products_table.c.quantity > 0,
+    sqlite_where=products_table.c.quantity > 0,
+)
+
+
+@compiles(CreateColumn, "sqlite")
+def create_column_sqlite(
+    element: CreateColumn, compiler: DDLCompiler, **kw: Any
+) -> str:
+    """SQLite has no text search; its search vector stays an empty column.
+
+    Searches there do not read it, but keeping the column lets the table
+    and its indexes be created from the same metadata.
+    """
+    column = element.element
+    if column is products_table.c.search_vector:
+        return f"{compiler.preparer.format_column(column)} TEXT"
+    return compiler.visit_create_column(element, **kw)
+
+
+@compiles(CreateIndex, "sqlite")
+def create_index_sqlite(
+    element: CreateIndex, compiler: DDLCompiler, **kw: Any
+) -> str:
+    """SQLite indexes cannot say NULLS LAST, which is its DESC order anyway."""
+    ddl: str = compiler.visit_create_index(element, **kw)
+    return ddl.replace(" DESC NULLS LAST", " DESC")
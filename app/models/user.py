@@ -4,6 +4,7 @@ from pydantic import EmailStr, validator
 from sqlalchemy import Column, String
 from sqlmodel import Field, Relationship, SQLModel
 
+from app.hashing import password_hasher
 from helpers import hash_password, is_hash, verify_password
 
 
@@ -45,6 +46,8 @@ class User(UserCreate, table=True):  # type: ignore
         back_populates="user_cart",
         sa_relationship_kwargs=dict(
             uselist=False,
+            lazy="raise",
+            passive_deletes=True,
         ),
     )
 
@@ -52,7 +55,8 @@ class User(UserCreate, table=True):  # type: ignore
         back_populates="user_info",
         sa_relationship_kwargs=dict(
             uselist=True,
-            lazy="selectin",
+            lazy="raise",
+            passive_deletes=True,
         ),
     )
 
@@ -65,6 +69,9 @@ class User(UserCreate, table=True):  # type: ignore
     def check_password(self, password: str) -> bool:  # pragma: no cover
         return verify_password(self.password, password)
 
+    async def check_password_async(self, password: str) -> bool:
+        return await password_hasher.verify(self.password, password)
+
     class Config:
         orm_mode = True
         arbitrary_types_allowed = True
@@ -0,0 +1,195 @@
+import base64
+import json
+
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple, Type
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import DateTime, and_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+from sqlmodel import SQLModel
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(  # pragma: no cover
+        f"Cannot put a {type(value).__name__} in a cursor."
+    )
+
+
+def encode_cursor(sort: str, values: Sequence[Any]) -> str:
+    """Datetimes go in as ISO 8601; `KeysetPaginator` parses them back."""
+    payload = json.dumps(
+        {"s": sort, "v": list(values)},
+        separators=(",", ":"),
+        default=_encode_value,
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort: str) -> List[Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        values: List[Any] = payload["v"]
+        cursor_sort: str = payload["s"]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor.",
+        ) from None
+    if cursor_sort != sort:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cursor was issued for sort {cursor_sort!r}, "
+            f"not {sort!r}.",
+        )
+    return values
+
+
+class KeysetPaginator:
+    """Pages a model by `(sort column, id)` instead of OFFSET.
+
+    A page starts right after the last row of the previous one, so the
+    database seeks the index instead of scanning and discarding every
+    earlier row. `sort` is a column name, prefixed with `-` for descending
+    order; rows whose sort column is NULL come last. `fetch` reads those
+    in a second range once the non-NULL values run out.
+    """
+
+    def __init__(self, model: Type[SQLModel], sort_keys: Sequence[str]):
+        self.model = model
+        self.id_column = model.id  # type: ignore
+        self.sort_keys = tuple(sort_keys)
+
+    def _parse_sort(self, sort: str) -> Tuple[str, bool]:
+        descending = sort.startswith("-")
+        key = sort.lstrip("-")
+        if key not in self.sort_keys:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Cannot sort by {key!r}. "
+                f"Choose one of: {', '.join(self.sort_keys)}.",
+            )
+        return key, descending
+
+    def _seek(self, key: str, descending: bool, values: List[Any]) -> Any:
+        id_column = self.id_column
+        if key == "id":
+            (last_id,) = values
+            return id_column < last_id if descending else id_column > last_id
+
+        column = getattr(self.model, key)
+        last_value, last_id = values
+        if last_value is not None and isinstance(column.type, DateTime):
+            try:
+                last_value = datetime.fromisoformat(last_value)
+            except (TypeError, ValueError):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid cursor.",
+                ) from None
+        if last_value is None:
+            after_id = (
+                id_column < last_id if descending else id_column > last_id
+            )
+            return and_(column.is_(None), after_id)
+        # A single row comparison is a range of the (column, id) index.
+        row, last_row = tuple_(column, id_column), tuple_(last_value, last_id)
+        return row < last_row if descending else row > last_row
+
+    def _null_tail(
+        self,
+        statement: Select,
+        sort: str,
+        cursor: Optional[str],
+        fetched: int,
+        limit: int,
+    ) -> Optional[Select]:
+        """The rows to read after the seek, if it stopped before NULLs."""
+        key, descending = self._parse_sort(sort)
+        if cursor is None or key == "id" or fetched > limit:
+            return None
+        column = getattr(self.model, key)
+        last_value, _ = decode_cursor(cursor, sort)
+        if last_value is None or not column.nullable:
+            return None
+        id_column = self.id_column
+        return (
+            statement.where(column.is_(None))
+            .order_by(id_column.desc() if descending else id_column.asc())
+            .limit(limit + 1 - fetched)
+        )
+
+    def apply(
+        self,
+        statement: Select,
+        sort: str,
+        cursor: Optional[str],
+        offset: int,
+        limit: int,
+    ) -> Select:
+        """Orders and limits the statement; fetches one extra row."""
+        key, descending = self._parse_sort(sort)
+        id_column = self.id_column
+        order_by = [id_column.desc() if descending else id_column.asc()]
+        if key != "id":
+            column = getattr(self.model, key)
+            order_by.insert(
+                0, (column.desc() if descending else column.asc()).nulls_last()
+            )
+        statement = statement.order_by(*order_by)
+
+        if cursor is not None:
+            values = decode_cursor(cursor, sort)
+            expected = 1 if key == "id" else 2
+            if len(values) != expected:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid cursor.",
+                )
+            statement = statement.where(self._seek(key, descending, values))
+        elif offset:
+            statement = statement.offset(offset)
+        return statement.limit(limit + 1)
+
+    async def fetch(
+        self,
+        session: AsyncSession,
+        statement: Select,
+        sort: str,
+        cursor: Optional[str],
+        offset: int,
+        limit: int,
+        scalars: bool = True,
+    ) -> Tuple[List[Any], Optional[str]]:
+        """Runs the page query and returns the page and the next cursor."""
+        result = await session.execute(
+            self.apply(statement, sort, cursor, offset, limit)
+        )
+        rows = list(result.scalars().all() if scalars else result.all())
+        tail = self._null_tail(statement, sort, cursor, len(rows), limit)
+        if tail is not None:
+            result = await session.execute(tail)
+            rows.extend(result.scalars().all() if scalars else result.all())
+        return self.page(rows, sort, limit)
+
+    def page(
+        self, rows: Sequence[Any], sort: str, limit: int
+    ) -> Tuple[List[Any], Optional[str]]:
+        """Splits off the extra row and builds the cursor of the next page."""
+        page = list(rows[:limit])
+        if len(rows) <= limit or not page:
+            return page, None
+        key, _ = self._parse_sort(sort)
+        last = page[-1]
+        values = [last.id] if key == "id" else [getattr(last, key), last.id]
+        return page, encode_cursor(sort, values)
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -1,11 +1,13 @@
-from typing import Optional
+from typing import Dict, Optional, Union
 
-from fastapi import APIRouter, HTTPException, Query
-from sqlalchemy import select
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from sqlalchemy import Integer, exists, literal, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from starlette import status
 
-from app.db import ActiveSession
+from app.db import ActiveSession, UpsertInsert, insert_for
+from app.idempotency import IdempotencyKeyHeader, claim
 from app.models.cart import Cart, CartDisplay, CartItem
 from app.models.product import Product
 from app.models.user import User
@@ -16,72 +18,140 @@ router = APIRouter(
 )
 
 
+DEMO_USER_ID = 1
+
+
+def upsert_cart(
+    session: AsyncSession, user_id: int, product_id: int, quantity: int
+) -> UpsertInsert:
+    """Get-or-create the user's cart, provided the product is in stock.
+
+    Returns the cart id where the database supports RETURNING, or no row
+    when the product does not exist, has fewer than `quantity` in stock or
+    the user does not exist.
+    """
+    statement = insert_for(session)(Cart.__table__).from_select(
+        ["user_id"],
+        select(literal(user_id, Integer)).where(
+            Product.id == product_id,
+            Product.quantity >= quantity,
+            exists().where(User.id == user_id),
+        ),
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[Cart.__table__.c.user_id],
+        set_={"user_id": statement.excluded.user_id},
+    )
+    if session.bind.dialect.full_returning:
+        return statement.returning(Cart.__table__.c.id)
+    return statement
+
+
+async def get_or_create_cart(
+    session: AsyncSession, user_id: int, product_id: int, quantity: int
+) -> Optional[int]:
+    """Run `upsert_cart` and return the cart id, or None if it was refused.
+
+    Without RETURNING, as on SQLite, the id is read back separately.
+    """
+    result = await session.execute(
+        upsert_cart(session, user_id, product_id, quantity)
+    )
+    if session.bind.dialect.full_returning:
+        cart_id: Optional[int] = result.scalar_one_or_none()
+        return cart_id
+    if not result.rowcount:
+        return None
+    result = await session.execute(
+        select(Cart.id).where(Cart.user_id == user_id)
+    )
+    return result.scalar_one()
+
+
+def upsert_cart_item(
+    session: AsyncSession, cart_id: int, product_id: int, quantity: int
+) -> UpsertInsert:
+    """Add the product to the cart, or bump the quantity already there."""
+    statement = insert_for(session)(CartItem.__table__).values(
+        cart_id=cart_id,
+        product_id=product_id,
+        quantity=quantity,
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[
+            CartItem.__table__.c.cart_id,
+            CartItem.__table__.c.product_id,
+        ],
+        set_={
+            "quantity": CartItem.__table__.c.quantity
+            + statement.excluded.quantity
+        },
+    )
+
+
 @router.post(
     "/add",
     status_code=status.HTTP_201_CREATED,
 )
 async def add_to_cart(
+    request: Request,
     product_id: int = Query(..., gt=0),
+    quantity: int = Query(default=1, gt=0),
+    idempotency_key: Optional[str] = IdempotencyKeyHeader,
     session: AsyncSession = ActiveSession,
-) -> dict[str, str]:
-    result = await session.execute(
-        select(Product).where(Product.id == product_id)
-    )
-    product: Optional[Product] = result.scalars().first()
-    if product is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Product with id {product_id} does not exist.",
-        )
-    if product.quantity <= 0:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Product with id {product_id} is out of stock.",
-        )
+) -> Union[Dict[str, str], Response]:
+    async with claim(session, request, idempotency_key) as current:
+        if current.replay is not None:
+            return current.replay
 
-    demo_user = await session.execute(select(User).where(User.id == 1))
-    user: Optional[User] = demo_user.scalars().first()
-    if user is None:
-        user: User = User(  # type: ignore
-            id=1,
-            name="Demo User",
-            email="demo@demo.com",
-            is_active=True,
-            password="demo",  # pragma: allowlist secret
+        cart_id = await get_or_create_cart(
+            session, DEMO_USER_ID, product_id, quantity
         )
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
-
-        assert user is not None
-
-    result = await session.execute(select(Cart).where(Cart.user_id == user.id))
-    cart: Optional[Cart] = result.scalars().first()
-    if cart is None:
-        cart: Cart = Cart(  # type: ignore
-            user_id=user.id,
-            cart_items=[
-                CartItem(
-                    product_id=product.id,
-                    quantity=1,
+        if cart_id is None:
+            # Only reached for a missing or sold out product, or before the
+            # demo user exists; the usual add is the two upserts alone.
+            result = await session.execute(
+                select(Product.quantity).where(Product.id == product_id)
+            )
+            stock: Optional[int] = result.scalar_one_or_none()
+            if stock is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Product with id {product_id} does not exist.",
                 )
-            ],
-        )
-        session.add(cart)
-        await session.commit()
-        await session.refresh(cart)
-    else:
-        cart.cart_items.append(
-            CartItem(
-                cart_id=cart.id,
-                product_id=product.id,
-                quantity=1,
+            if stock < quantity:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Product with id {product_id} is out of stock.",
+                )
+
+            session.add(
+                User(
+                    id=DEMO_USER_ID,
+                    name="Demo User",
+                    email="demo@demo.com",
+                    is_active=True,
+                    password="demo",  # pragma: allowlist secret
+                )
+            )
+            await session.flush()
+            cart_id = await get_or_create_cart(
+                session, DEMO_USER_ID, product_id, quantity
             )
+            if cart_id is None:  # pragma: no cover
+                # Sold out between the stock check and the upsert.
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Product with id {product_id} is out of stock.",
+                )
+
+        await session.execute(
+            upsert_cart_item(session, cart_id, product_id, quantity)
         )
-        session.add(cart)
+        content = {"status": "Item added to cart"}
+        await current.save(status.HTTP_201_CREATED, content)
         await session.commit()
-        await session.refresh(cart)
-    return {"status": "Item added to cart"}
+    return content
 
 
 @router.get(
@@ -92,7 +162,9 @@ async def add_to_cart(
 async def get_all_cart_items(
     session: AsyncSession = ActiveSession,
 ) -> CartDisplay:
-    demo_user = await session.execute(select(User).where(User.id == 1))
+    demo_user = await session.execute(
+        select(User).where(User.id == DEMO_USER_ID)
+    )
     user: Optional[User] = demo_user.scalars().first()
     if user is None:  # pragma: no cover
         raise HTTPException(
@@ -100,7 +172,15 @@ async def get_all_cart_items(
             detail="User does not exist.",
         )
 
-    result = await session.execute(select(Cart).where(Cart.user_id == user.id))
+    result = await session.execute(
+        select(Cart)
+        .where(Cart.user_id == user.id)
+        .options(
+            selectinload(Cart.cart_items)
+            .joinedload(CartItem.product)
+            .joinedload(Product.category),
+        )
+    )
     cart: Optional[Cart] = result.scalar_one_or_none()
     return CartDisplay.from_orm(cart)
 
@@ -113,7 +193,9 @@ async def remove_cart_item_by_id(
     cart_item_id: int = Query(..., gt=0),
     session: AsyncSession = ActiveSession,
 ) -> None:
-    demo_user = await session.execute(select(User).where(User.id == 1))
+    demo_user = await session.execute(
+        select(User).where(User.id == DEMO_USER_ID)
+    )
     user: Optional[User] = demo_user.scalars().first()
     if user is None:  # pragma: no cover
         raise HTTPException(
@@ -121,7 +203,11 @@ async def remove_cart_item_by_id(
             detail="User does not exist.",
         )
 
-    result = await session.execute(select(Cart).where(Cart.user_id == user.id))
+    result = await session.execute(
+        select(Cart)
+        .where(Cart.user_id == user.id)
+        .options(selectinload(Cart.cart_items))
+    )
     cart: Optional[Cart] = result.scalar_one_or_none()
     if cart is None:  # pragma: no cover
         raise HTTPException(
@@ -1,33 +1,87 @@
-from typing import List, Optional
+from typing import List, Optional, Type, Union
 
-from fastapi import APIRouter, HTTPException, Query
-from sqlalchemy import select
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from app.db import ActiveSession
-from app.models.category import Category, CategoryCreate, CategoryDisplay
+from app.cache import category_tag, product_cache
+from app.db import ActiveSession, ReadSession
+from app.etag import etag_matches, make_etag, not_modified
+from app.models.category import (
+    Category,
+    CategoryCreate,
+    CategoryDisplay,
+    CategoryWithCount,
+)
+from app.models.product import Product
+from app.pagination import KeysetPaginator, set_next_cursor
+from app.serialization import encode, json_response
+from app.settings import settings
 
 router = APIRouter(
     tags=[Category.__tablename__.capitalize()],
     prefix=f"/products/{Category.__tablename__}",
 )
 
+paginator = KeysetPaginator(model=Category, sort_keys=("id", "name"))
+
 
 @router.get(
     path="/",
     status_code=status.HTTP_200_OK,
-    response_model=List[CategoryDisplay],
+    response_model=List[Union[CategoryWithCount, CategoryDisplay]],
 )
 async def get_all_categories(
-    session: AsyncSession = ActiveSession,
-    offset: int = 0,
-    limit: int = Query(default=50, lte=50),
-) -> List[CategoryDisplay]:
-    result = await session.execute(
-        select(Category).offset(offset).limit(limit)
+    request: Request,
+    response: Response,
+    session: AsyncSession = ReadSession,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=50),
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    with_counts: bool = False,
+) -> Union[List[CategoryDisplay], List[CategoryWithCount], Response]:
+    display_model: Type[CategoryDisplay] = CategoryDisplay
+    statement = select(Category)
+    if with_counts:
+        # One GROUP BY over the products.category_id index; the products
+        # themselves are never loaded.
+        display_model = CategoryWithCount
+        statement = (
+            select(
+                Category.id,
+                Category.name,
+                Category.updated_at,
+                func.count(Product.id).label("product_count"),
+            )
+            .outerjoin(Product, Product.category_id == Category.id)
+            .group_by(Category.id)
+        )
+    categories, next_cursor = await paginator.fetch(
+        session,
+        statement,
+        sort,
+        cursor,
+        offset,
+        limit,
+        scalars=not with_counts,
+    )
+    etag = make_etag(
+        [
+            next_cursor,
+            *(
+                (c.id, c.updated_at, getattr(c, "product_count", None))
+                for c in categories
+            ),
+        ]
     )
-    categories: List[CategoryDisplay] = result.scalars().all()
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    set_next_cursor(response, next_cursor)
+    if settings.FAST_JSON_RESPONSES:
+        return json_response(encode(categories, display_model), response)
     return categories
 
 
@@ -37,9 +91,11 @@ async def get_all_categories(
     response_model=CategoryDisplay,
 )
 async def get_category(
-    session: AsyncSession = ActiveSession,
+    request: Request,
+    response: Response,
+    session: AsyncSession = ReadSession,
     category_id: int = Query(..., gt=0),
-) -> CategoryDisplay:
+) -> Union[CategoryDisplay, Response]:
     result = await session.execute(
         select(Category).where(Category.id == category_id)
     )
@@ -49,6 +105,12 @@ async def get_category(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Category with id {category_id} does not exist.",
         )
+    etag = make_etag([category.id, category.updated_at])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    if settings.FAST_JSON_RESPONSES:
+        return json_response(encode(category, CategoryDisplay), response)
     return CategoryDisplay(**category.dict())
 
 
@@ -82,17 +144,23 @@ async def delete_category(
     session: AsyncSession = ActiveSession,
     category_id: int = Query(..., gt=0),
 ) -> None:
+    # One statement clears the category of all its products instead of
+    # loading them and updating them row by row.
+    await session.execute(
+        update(Product)
+        .where(Product.category_id == category_id)
+        .values(category_id=None)
+    )
     result = await session.execute(
-        select(Category).where(Category.id == category_id)
+        delete(Category).where(Category.id == category_id)
     )
-    category: Optional[CategoryDisplay] = result.scalars().first()
-    if category is None:  # pragma: no cover
+    if result.rowcount == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Category with id {category_id} does not exist.",
         )
-    await session.delete(category)
     await session.commit()
+    product_cache.invalidate_tags(category_tag(category_id))
 
 
 @router.put(
@@ -117,6 +185,7 @@ async def update_category(
     category.name = category_update_payload.name
     session.add(category)
     await session.commit()
+    product_cache.invalidate_tags(category_tag(category_id))
     result = await session.execute(
         select(Category).where(Category.id == category_id)
     )
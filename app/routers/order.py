@@ -1,90 +1,254 @@
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional, Union
 
-from fastapi import APIRouter, HTTPException
-from sqlalchemy import select
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import (
+    Integer,
+    case,
+    column,
+    delete,
+    func,
+    insert,
+    literal,
+    select,
+    update,
+    values,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from starlette import status
 
+from app.cache import product_cache, product_filter_tag, product_tag
+from app.constants import OrderStatus
 from app.db import ActiveSession
-from app.models.cart import Cart
-from app.models.order import Order, OrderDetails, OrderDisplay
+from app.idempotency import IdempotencyKeyHeader, claim
+from app.models.cart import Cart, CartItem
+from app.models.order import (
+    Order,
+    OrderDetails,
+    OrderDisplay,
+    OrderSummary,
+)
+from app.models.product import Product
 from app.models.user import User
+from app.pagination import KeysetPaginator, set_next_cursor
+from app.routers.cart import DEMO_USER_ID
+from app.serialization import encode, json_response, ndjson_response
+from app.settings import settings
 
 router = APIRouter(
     tags=[Order.__tablename__.capitalize()],
     prefix=f"/{Order.__tablename__}",
 )
 
+SHIPPING_ADDRESS = "123 Main St, Anytown, CA 12345"
 
-@router.post(
-    "/",
-    response_model=OrderDisplay,
-    status_code=status.HTTP_201_CREATED,
+paginator = KeysetPaginator(model=Order, sort_keys=("id", "order_date"))
+
+# Everything OrderDisplay renders, loaded in one query per level.
+order_display_options = (
+    joinedload(Order.user_info),
+    selectinload(Order.order_details)
+    .joinedload(OrderDetails.product)
+    .joinedload(Product.category),
 )
-async def initiate_order_processing(
-    session: AsyncSession = ActiveSession,
-) -> OrderDisplay:
-    user_result = await session.execute(select(User).where(User.id == 1))
-    user: Optional[User] = user_result.scalar_one_or_none()
-    if user is None:  # pragma: no cover
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User does not exist.",
-        )
 
+
+async def checkout_cart(session: AsyncSession, user_id: int) -> int:
+    """Turn the user's cart into an order in the session's transaction.
+
+    Returns the id of the new order. The caller commits, and then drops
+    the cached stock of the ordered products with `invalidate_stock`.
+
+    The cart row is locked first, so concurrent checkouts of one cart run
+    one after the other. The products are then locked in id order, so
+    checkouts that share products cannot deadlock. Stock is decremented
+    only where enough is left, and nothing is written if any item is short.
+    SQLite ignores the row locks; there the write lock that the session
+    takes when it begins serializes checkouts instead.
+    """
     cart_result = await session.execute(
-        select(Cart).where(Cart.user_id == user.id)
+        select(Cart.id).where(Cart.user_id == user_id).with_for_update()
     )
-    cart: Optional[Cart] = cart_result.scalar_one_or_none()
-    if cart is None:  # pragma: no cover
+    cart_id: Optional[int] = cart_result.scalar_one_or_none()
+    if cart_id is None:  # pragma: no cover
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Cart does not exist.",
         )
 
-    if len(cart.cart_items) == 0:  # pragma: no cover
+    items_result = await session.execute(
+        select(CartItem.product_id, CartItem.quantity)
+        .where(CartItem.cart_id == cart_id)
+        .order_by(CartItem.product_id)
+    )
+    wanted: Dict[int, int] = dict(items_result.all())
+    if not wanted:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Cart is empty.",
         )
 
-    total_amount: float = 0
-    for cart_item in cart.cart_items:
-        total_amount += cart_item.product.price
-
-    new_order: Order = Order(
-        customer_id=user.id,
-        order_amount=total_amount,
-        shipping_address="123 Main St, Anytown, CA 12345",
-        order_details=[
-            OrderDetails(
-                product_id=cart_item.product.id,
+    stock_result = await session.execute(
+        select(Product.id, Product.quantity)
+        .where(Product.id.in_(wanted))
+        .order_by(Product.id)
+        .with_for_update()
+    )
+    stock: Dict[int, int] = dict(stock_result.all())
+    out_of_stock = [
+        product_id
+        for product_id, quantity in wanted.items()
+        if stock.get(product_id, 0) < quantity
+    ]
+    if out_of_stock:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Products with ids {out_of_stock} are out of stock.",
+        )
+
+    products = Product.__table__
+    returning = session.bind.dialect.full_returning
+    if returning:
+        wanted_values = values(
+            column("id", Integer), column("quantity", Integer), name="wanted"
+        ).data(list(wanted.items()))
+        decrement_result = await session.execute(
+            update(products)
+            .where(
+                products.c.id == wanted_values.c.id,
+                products.c.quantity >= wanted_values.c.quantity,
+            )
+            .values(quantity=products.c.quantity - wanted_values.c.quantity)
+            .returning(products.c.id)
+        )
+        decremented = len(decrement_result.all())
+    else:
+        # SQLite has neither RETURNING nor named VALUES lists, so the
+        # quantities go in a CASE and the row count is checked instead.
+        wanted_quantity = case(wanted, value=products.c.id)
+        decrement_result = await session.execute(
+            update(products)
+            .where(
+                products.c.id.in_(wanted),
+                products.c.quantity >= wanted_quantity,
             )
-            for cart_item in cart.cart_items
-        ],
+            .values(quantity=products.c.quantity - wanted_quantity)
+        )
+        decremented = decrement_result.rowcount
+    if decremented != len(wanted):  # pragma: no cover
+        # The rows are locked, so this only guards against a broken plan.
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Stock changed during checkout.",
+        )
+
+    # The total and the line prices come straight from the cart joined
+    # with the locked products; the lines keep the price they sold at.
+    cart_items = CartItem.__table__
+    cart_lines = (
+        select()
+        .select_from(
+            cart_items.join(products, products.c.id == cart_items.c.product_id)
+        )
+        .where(cart_items.c.cart_id == cart_id)
+    )
+    orders = Order.__table__
+    insert_order = insert(orders).from_select(
+        ["customer_id", "order_amount", "shipping_address"],
+        cart_lines.add_columns(
+            literal(user_id, Integer),
+            func.sum(products.c.price * cart_items.c.quantity),
+            literal(SHIPPING_ADDRESS),
+        ),
+    )
+    if returning:
+        order_result = await session.execute(
+            insert_order.returning(orders.c.id)
+        )
+        order_id: int = order_result.scalar_one()
+    else:
+        order_result = await session.execute(insert_order)
+        order_id = order_result.lastrowid
+    await session.execute(
+        insert(OrderDetails.__table__).from_select(
+            ["order_id", "product_id", "quantity", "unit_price"],
+            cart_lines.add_columns(
+                literal(order_id, Integer),
+                cart_items.c.product_id,
+                cart_items.c.quantity,
+                products.c.price,
+            ),
+        )
     )
+    await session.execute(delete(CartItem).where(CartItem.cart_id == cart_id))
+    return order_id
 
-    session.add(new_order)
-    await session.commit()
-    await session.refresh(new_order)
 
-    cart.cart_items = []
-    session.add(cart)
-    await session.commit()
-    await session.refresh(cart)
+def invalidate_stock(order: OrderDisplay) -> None:
+    product_cache.invalidate_tags(
+        product_filter_tag("quantity"),
+        *(product_tag(detail.product_id) for detail in order.order_details),
+    )
 
-    return OrderDisplay.from_orm(new_order)
+
+@router.post(
+    "/",
+    response_model=OrderDisplay,
+    status_code=status.HTTP_201_CREATED,
+)
+async def initiate_order_processing(
+    request: Request,
+    idempotency_key: Optional[str] = IdempotencyKeyHeader,
+    session: AsyncSession = ActiveSession,
+) -> Union[OrderDisplay, Response]:
+    async with claim(session, request, idempotency_key) as current:
+        if current.replay is not None:
+            return current.replay
+
+        user_result = await session.execute(
+            select(User).where(User.id == DEMO_USER_ID)
+        )
+        user: Optional[User] = user_result.scalar_one_or_none()
+        if user is None:  # pragma: no cover
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User does not exist.",
+            )
+
+        order_id = await checkout_cart(session, user.id)
+        # Read back before the commit, so that the stored response is
+        # committed with the order.
+        order_result = await session.execute(
+            select(Order)
+            .where(Order.id == order_id)
+            .options(*order_display_options)
+            .execution_options(populate_existing=True)
+        )
+        order = OrderDisplay.from_orm(order_result.scalar_one())
+        await current.save(status.HTTP_201_CREATED, order)
+        await session.commit()
+    invalidate_stock(order)
+    return order
 
 
 @router.get(
     "/",
     status_code=status.HTTP_200_OK,
-    response_model=List[OrderDisplay],
+    response_model=List[OrderSummary],
 )
 async def get_all_orders(
+    response: Response,
     session: AsyncSession = ActiveSession,
-) -> List[OrderDisplay]:
-    user_result = await session.execute(select(User).where(User.id == 1))
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=50),
+    cursor: Optional[str] = None,
+    sort: str = "-id",
+) -> Union[List[OrderSummary], Response]:
+    user_result = await session.execute(
+        select(User).where(User.id == DEMO_USER_ID)
+    )
     user: Optional[User] = user_result.scalar_one_or_none()
     if user is None:  # pragma: no cover
         raise HTTPException(
@@ -92,8 +256,84 @@ async def get_all_orders(
             detail="User does not exist.",
         )
 
+    orders, next_cursor = await paginator.fetch(
+        session,
+        select(
+            Order.id,
+            Order.order_date,
+            Order.order_amount,
+            Order.status,
+            func.coalesce(func.sum(OrderDetails.quantity), 0).label(
+                "item_count"
+            ),
+        )
+        .outerjoin(OrderDetails, OrderDetails.order_id == Order.id)
+        .where(Order.customer_id == user.id)
+        .group_by(Order.id),
+        sort,
+        cursor,
+        offset,
+        limit,
+        scalars=False,
+    )
+    set_next_cursor(response, next_cursor)
+    if settings.FAST_JSON_RESPONSES:
+        return json_response(encode(orders, OrderSummary), response)
+    return [OrderSummary.from_orm(order) for order in orders]
+
+
+@router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+)
+async def export_orders(
+    session: AsyncSession = ActiveSession,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    order_status: Optional[OrderStatus] = Query(default=None, alias="status"),
+) -> Response:
+    """Stream every order as NDJSON, optionally filtered by date and status.
+
+    `since` is inclusive and `until` exclusive.
+    """
+    statement = select(
+        Order.id,
+        Order.order_date,
+        Order.order_amount,
+        Order.status,
+        Order.shipping_address,
+        Order.customer_id,
+    ).order_by(Order.id)
+    if since is not None:
+        statement = statement.where(Order.order_date >= since)
+    if until is not None:
+        statement = statement.where(Order.order_date < until)
+    if order_status is not None:
+        statement = statement.where(Order.status == order_status)
+    return ndjson_response(session, statement)
+
+
+@router.get(
+    "/{order_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=OrderDisplay,
+)
+async def get_order(
+    order_id: int = Query(..., gt=0),
+    session: AsyncSession = ActiveSession,
+) -> Union[OrderDisplay, Response]:
     result = await session.execute(
-        select(Order).where(Order.customer_id == user.id)
+        select(Order)
+        .where(Order.id == order_id, Order.customer_id == DEMO_USER_ID)
+        .options(*order_display_options)
     )
-    orders: List[Order] = result.scalars().all()
-    return [OrderDisplay.from_orm(order) for order in orders]
+    order: Optional[Order] = result.scalar_one_or_none()
+    if order is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Order with id {order_id} does not exist.",
+        )
+    if settings.FAST_JSON_RESPONSES:
+        return json_response(encode(order, OrderDisplay))
+    return OrderDisplay.from_orm(order)
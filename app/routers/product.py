@@ -1,18 +1,151 @@
-from typing import List, Optional
+import time
 
-from fastapi import APIRouter, HTTPException, Query
-from sqlalchemy import select
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import and_, func, literal, literal_column, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql import Select
 from starlette import status
 
-from app.db import ActiveSession
-from app.models.product import Product, ProductCreate, ProductDisplay
+from app.bulk import iter_json_items
+from app.cache import (
+    MISSING,
+    category_tag,
+    product_cache,
+    product_filter_tag,
+    product_tag,
+)
+from app.constants import BulkRowStatus
+from app.db import ActiveSession, ReadSession, is_replica_session
+from app.etag import etag_matches, make_etag, not_modified
+from app.models.category import Category
+from app.models.product import (
+    Product,
+    ProductBulkResult,
+    ProductBulkRowResult,
+    ProductCreate,
+    ProductDisplay,
+)
+from app.pagination import (
+    KeysetPaginator,
+    decode_cursor,
+    encode_cursor,
+    set_next_cursor,
+)
+from app.serialization import encode, ndjson_response, respond
+from app.settings import settings
 
 router = APIRouter(
     tags=[Product.__tablename__.capitalize()],
     prefix=f"/{Product.__tablename__}",
 )
 
+paginator = KeysetPaginator(model=Product, sort_keys=("id", "name", "price"))
+
+# Cached listings are tagged with the products and categories they render
+# and with what decides their page boundaries:
+# - the last page of an id-ordered listing grows when a product is added,
+# - OFFSET pages shift when a product is deleted,
+# - listings in any other order can change anywhere,
+# - filtered listings gain products whose filtered columns change.
+LISTING_TAIL_TAG = "products:tail"
+LISTING_OFFSET_TAG = "products:offset"
+
+
+def replica_settle_time(session: AsyncSession) -> float:
+    """How long after a write a replica read may still be stale."""
+    if is_replica_session(session):
+        return float(settings.DB_READ_YOUR_WRITES_SECONDS)
+    return 0.0
+
+
+def listing_sort_tag(sort: str) -> str:
+    return f"products:sort:{sort}"
+
+
+def sort_tags(keys: Iterable[str]) -> List[str]:
+    return [
+        listing_sort_tag(f"{prefix}{key}")
+        for key in keys
+        for prefix in ("", "-")
+        if f"{prefix}{key}" != "id"
+    ]
+
+
+def row_versions(product: Product) -> Tuple[Any, ...]:
+    category = product.category
+    return (
+        product.id,
+        product.updated_at,
+        category.id if category else None,
+        category.updated_at if category else None,
+    )
+
+
+def filter_products(
+    statement: Select,
+    category_id: Optional[int] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock: Optional[bool] = None,
+) -> Select:
+    if category_id is not None:
+        statement = statement.where(Product.category_id == category_id)
+    if min_price is not None:
+        statement = statement.where(Product.price >= min_price)
+    if max_price is not None:
+        statement = statement.where(Product.price <= max_price)
+    if in_stock is not None:
+        statement = statement.where(
+            Product.quantity > 0 if in_stock else Product.quantity <= 0
+        )
+    return statement
+
+
+def filtered_columns(
+    category_id: Optional[int],
+    min_price: Optional[float],
+    max_price: Optional[float],
+    in_stock: Optional[bool],
+) -> List[str]:
+    columns = []
+    if category_id is not None:
+        columns.append("category_id")
+    if min_price is not None or max_price is not None:
+        columns.append("price")
+    if in_stock is not None:
+        columns.append("quantity")
+    return columns
+
+
+def listing_tags(
+    products: List[Product],
+    next_cursor: Optional[str],
+    offset: int,
+    cursor: Optional[str],
+    sort: str,
+    filters: Iterable[str] = (),
+) -> Set[str]:
+    tags = {product_tag(product.id) for product in products}
+    tags.update(
+        category_tag(product.category_id)
+        for product in products
+        if product.category_id is not None
+    )
+    if next_cursor is None:
+        tags.add(LISTING_TAIL_TAG)
+    if cursor is None and offset:
+        tags.add(LISTING_OFFSET_TAG)
+    if sort != "id":
+        tags.add(listing_sort_tag(sort))
+    tags.update(product_filter_tag(column) for column in filters)
+    return tags
+
 
 @router.get(
     path="/",
@@ -20,13 +153,183 @@ router = APIRouter(
     response_model=List[ProductDisplay],
 )
 async def get_all_products(
-    session: AsyncSession = ActiveSession,
-    offset: int = 0,
-    limit: int = Query(default=50, lte=50),
-) -> List[ProductDisplay]:
-    result = await session.execute(select(Product).offset(offset).limit(limit))
-    products: List[ProductDisplay] = result.scalars().all()
-    return products
+    request: Request,
+    response: Response,
+    session: AsyncSession = ReadSession,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=50),
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    category_id: Optional[int] = None,
+    min_price: Optional[float] = Query(default=None, ge=0),
+    max_price: Optional[float] = Query(default=None, ge=0),
+    in_stock: Optional[bool] = None,
+) -> Union[List[ProductDisplay], Response]:
+    """List products, optionally filtered.
+
+    `sort` is `id`, `name` or `price`, prefixed with `-` for descending
+    order. `min_price` and `max_price` are inclusive; `in_stock` keeps only
+    products with or without stock left.
+    """
+    filters = (category_id, min_price, max_price, in_stock)
+    cache_key = ("products", offset, limit, cursor, sort, filters)
+    cache_version = product_cache.version
+    cached = product_cache.get(cache_key)
+    if cached is not MISSING:
+        products, next_cursor, etag = cached
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+        set_next_cursor(response, next_cursor)
+        return respond(products, response)
+
+    rows, next_cursor = await paginator.fetch(
+        session,
+        filter_products(
+            select(Product).options(joinedload(Product.category)),
+            *filters,
+        ),
+        sort,
+        cursor,
+        offset,
+        limit,
+    )
+    etag = make_etag([next_cursor, *(row_versions(row) for row in rows)])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    products: Union[List[ProductDisplay], bytes]
+    if settings.FAST_JSON_RESPONSES:
+        products = encode(rows, ProductDisplay)
+    else:
+        products = [ProductDisplay.from_orm(row) for row in rows]
+    product_cache.set(
+        cache_key,
+        (products, next_cursor, etag),
+        tags=listing_tags(
+            rows,
+            next_cursor,
+            offset,
+            cursor,
+            sort,
+            filtered_columns(*filters),
+        ),
+        version=cache_version,
+        settle_time=replica_settle_time(session),
+    )
+    response.headers["ETag"] = etag
+    set_next_cursor(response, next_cursor)
+    return respond(products, response)
+
+
+@router.get(
+    path="/export",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+)
+async def export_products(
+    session: AsyncSession = ReadSession,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    in_stock: Optional[bool] = None,
+) -> Response:
+    """Stream every product as NDJSON.
+
+    `since` (inclusive) and `until` (exclusive) filter on `updated_at`;
+    `in_stock` keeps only products with or without stock left.
+    """
+    statement = select(
+        Product.id,
+        Product.name,
+        Product.description,
+        Product.price,
+        Product.quantity,
+        Product.category_id,
+        Product.updated_at,
+    ).order_by(Product.id)
+    if since is not None:
+        statement = statement.where(Product.updated_at >= since)
+    if until is not None:
+        statement = statement.where(Product.updated_at < until)
+    return ndjson_response(
+        session, filter_products(statement, in_stock=in_stock)
+    )
+
+
+def search_rank(session: AsyncSession, q: str) -> Tuple[Any, Any]:
+    """The filter and rank of a product search on this session's database.
+
+    Postgres matches `q` as a web search against the GIN-indexed
+    `search_vector`. Other databases fall back to a case-insensitive
+    `LIKE` on the name and description that ranks every match the same.
+    """
+    if session.bind.dialect.name == "postgresql":
+        search_vector = Product.__table__.c.search_vector
+        query = func.websearch_to_tsquery(literal_column("'english'"), q)
+        rank = func.ts_rank_cd(search_vector, query)
+        return search_vector.op("@@")(query), rank
+
+    term = q.lower()
+    condition = or_(
+        func.lower(Product.name).contains(term, autoescape=True),
+        func.lower(Product.description).contains(term, autoescape=True),
+    )
+    return condition, literal(0.0)
+
+
+@router.get(
+    path="/search",
+    status_code=status.HTTP_200_OK,
+    response_model=List[ProductDisplay],
+)
+async def search_products(
+    response: Response,
+    session: AsyncSession = ReadSession,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(default=50, ge=1, le=50),
+    cursor: Optional[str] = None,
+) -> Union[List[ProductDisplay], Response]:
+    """Search product names and descriptions, best matches first.
+
+    Results are ordered by rank and then id, and paged with the cursor in
+    the `X-Next-Cursor` header.
+    """
+    condition, rank = search_rank(session, q)
+    rank = rank.label("rank")
+    statement = (
+        select(Product, rank)
+        .options(joinedload(Product.category))
+        .where(condition)
+        .order_by(rank.desc(), Product.id)
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        values = decode_cursor(cursor, "rank")
+        if len(values) != 2:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor.",
+            )
+        last_rank, last_id = values
+        statement = statement.where(
+            or_(
+                rank < last_rank,
+                and_(rank == last_rank, Product.id > last_id),
+            )
+        )
+    result = await session.execute(statement)
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_product, last_rank = rows[-1]
+        next_cursor = encode_cursor("rank", [last_rank, last_product.id])
+
+    set_next_cursor(response, next_cursor)
+    products = [product for product, _ in rows]
+    if settings.FAST_JSON_RESPONSES:
+        return respond(encode(products, ProductDisplay), response)
+    return [ProductDisplay.from_orm(product) for product in products]
 
 
 @router.get(
@@ -35,9 +338,21 @@ async def get_all_products(
     response_model=ProductDisplay,
 )
 async def get_product(
-    session: AsyncSession = ActiveSession,
+    request: Request,
+    response: Response,
+    session: AsyncSession = ReadSession,
     product_id: int = Query(..., gt=0),
-) -> ProductDisplay:
+) -> Union[ProductDisplay, Response]:
+    cache_key = ("product", product_id)
+    cache_version = product_cache.version
+    cached = product_cache.get(cache_key)
+    if cached is not MISSING:
+        product_display, etag = cached
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+        return respond(product_display, response)
+
     result = await session.execute(
         select(Product).where(Product.id == product_id)
     )
@@ -47,7 +362,24 @@ async def get_product(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Product with id {product_id} does not exist.",
         )
-    return ProductDisplay(**product.dict())
+    etag = make_etag([product.id, product.updated_at])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    product_display: Union[ProductDisplay, bytes]
+    if settings.FAST_JSON_RESPONSES:
+        product_display = encode(product.dict(), ProductDisplay)
+    else:
+        product_display = ProductDisplay(**product.dict())
+    product_cache.set(
+        cache_key,
+        (product_display, etag),
+        tags=[product_tag(product_id)],
+        version=cache_version,
+        settle_time=replica_settle_time(session),
+    )
+    response.headers["ETag"] = etag
+    return respond(product_display, response)
 
 
 @router.post(
@@ -72,9 +404,169 @@ async def create_product(
     new_product: Product = Product(**product_create_payload.dict())
     session.add(new_product)
     await session.commit()
+    product_cache.invalidate_tags(
+        LISTING_TAIL_TAG, *sort_tags(paginator.sort_keys)
+    )
     return ProductDisplay(**new_product.dict())
 
 
+async def insert_product_chunk(
+    session: AsyncSession,
+    chunk: List[Tuple[ProductBulkRowResult, ProductCreate]],
+) -> None:
+    """Insert the rows of one bulk chunk and record the outcome per row.
+
+    One query finds the names that are already stored and one the unknown
+    categories; the remaining rows go in with a single executemany, and a
+    last query reads back their ids.
+    """
+    names = [payload.name for _, payload in chunk]
+    result = await session.execute(
+        select(Product.name).where(Product.name.in_(names))
+    )
+    existing: Set[str] = set(result.scalars().all())
+
+    category_ids = {
+        payload.category_id
+        for _, payload in chunk
+        if payload.category_id is not None
+    }
+    known_category_ids: Set[int] = set()
+    if category_ids:
+        result = await session.execute(
+            select(Category.id).where(Category.id.in_(category_ids))
+        )
+        known_category_ids = set(result.scalars().all())
+
+    rows: Dict[str, ProductBulkRowResult] = {}
+    values: List[Dict[str, Any]] = []
+    for row_result, payload in chunk:
+        if payload.name in existing:
+            row_result.status = BulkRowStatus.EXISTS
+        elif (
+            payload.category_id is not None
+            and payload.category_id not in known_category_ids
+        ):
+            row_result.status = BulkRowStatus.INVALID
+            row_result.errors = [
+                {
+                    "loc": ["category_id"],
+                    "msg": f"Category with id {payload.category_id} "
+                    f"does not exist.",
+                    "type": "value_error.missing",
+                }
+            ]
+        else:
+            rows[payload.name] = row_result
+            values.append(payload.dict())
+    if not values:
+        return
+
+    await session.execute(Product.__table__.insert(), values)
+    result = await session.execute(
+        select(Product.name, Product.id).where(Product.name.in_(list(rows)))
+    )
+    for name, product_id in result.all():
+        rows[name].id = product_id
+
+
+@router.post(
+    path="/bulk",
+    status_code=status.HTTP_200_OK,
+    response_model=ProductBulkResult,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": ProductCreate.schema(),
+                    }
+                },
+                "application/x-ndjson": {"schema": ProductCreate.schema()},
+            },
+        }
+    },
+)
+async def create_products_bulk(
+    request: Request,
+    session: AsyncSession = ActiveSession,
+) -> ProductBulkResult:
+    """Create many products from a JSON array or a streamed NDJSON body.
+
+    Rows are validated one by one, names are de-duplicated within the
+    payload and against the stored products, and the new rows are inserted
+    in chunks of `PRODUCT_BULK_CHUNK_SIZE` within a single transaction.
+    """
+    started_at = time.perf_counter()
+    results: List[ProductBulkRowResult] = []
+    seen_names: Set[str] = set()
+    chunk: List[Tuple[ProductBulkRowResult, ProductCreate]] = []
+
+    async for item, error in iter_json_items(request):
+        if len(results) >= settings.PRODUCT_BULK_MAX_ROWS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"At most {settings.PRODUCT_BULK_MAX_ROWS} "
+                f"products can be created at once.",
+            )
+        row_result = ProductBulkRowResult(
+            index=len(results), status=BulkRowStatus.INVALID
+        )
+        results.append(row_result)
+        if error is not None:
+            row_result.errors = [
+                {"loc": ["__root__"], "msg": error, "type": "value_error"}
+            ]
+            continue
+        try:
+            payload = ProductCreate.parse_obj(item)
+        except ValidationError as e:
+            row_result.errors = e.errors()
+            continue
+        if payload.name is None:
+            row_result.errors = [
+                {
+                    "loc": ["name"],
+                    "msg": "field required",
+                    "type": "value_error.missing",
+                }
+            ]
+            continue
+
+        row_result.name = payload.name
+        if payload.name in seen_names:
+            row_result.status = BulkRowStatus.DUPLICATE
+            continue
+        seen_names.add(payload.name)
+        row_result.status = BulkRowStatus.CREATED
+        chunk.append((row_result, payload))
+        if len(chunk) >= settings.PRODUCT_BULK_CHUNK_SIZE:
+            await insert_product_chunk(session, chunk)
+            chunk = []
+    if chunk:
+        await insert_product_chunk(session, chunk)
+
+    created = sum(r.status == BulkRowStatus.CREATED for r in results)
+    if created:
+        await session.commit()
+        product_cache.invalidate_tags(
+            LISTING_TAIL_TAG, *sort_tags(paginator.sort_keys)
+        )
+    invalid = sum(r.status == BulkRowStatus.INVALID for r in results)
+    elapsed = time.perf_counter() - started_at
+    return ProductBulkResult(
+        received=len(results),
+        created=created,
+        skipped=len(results) - created - invalid,
+        invalid=invalid,
+        elapsed=elapsed,
+        rows_per_second=len(results) / elapsed if elapsed else 0.0,
+        results=results,
+    )
+
+
 @router.delete(
     path="/{product_id}/",
     status_code=status.HTTP_204_NO_CONTENT,
@@ -94,6 +586,7 @@ async def delete_product(
         )
     await session.delete(product)
     await session.commit()
+    product_cache.invalidate_tags(product_tag(product_id), LISTING_OFFSET_TAG)
 
 
 @router.put(
@@ -124,4 +617,9 @@ async def update_product(
     session.add(product_exists)
 
     await session.commit()
+    product_cache.invalidate_tags(
+        product_tag(product_id),
+        *sort_tags(key for key in paginator.sort_keys if key in update_data),
+        *(product_filter_tag(key) for key in update_data),
+    )
     return ProductDisplay(**product_exists.dict())
@@ -1,28 +1,41 @@
-from typing import List, Optional
+from typing import List, Optional, Union
 
-from fastapi import APIRouter, HTTPException, Query, status
+from fastapi import APIRouter, HTTPException, Query, Response, status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import ActiveSession
+from app.db import ActiveSession, ReadSession
+from app.hashing import password_hasher
 from app.models.user import User, UserCreate, UserDisplay
+from app.pagination import KeysetPaginator, set_next_cursor
+from app.serialization import encode, json_response
+from app.settings import settings
 
 router = APIRouter(
     tags=[User.__tablename__.capitalize()],
     prefix=f"/{User.__tablename__}",
 )
 
+paginator = KeysetPaginator(model=User, sort_keys=("id", "name", "email"))
+
 
 @router.get(
     path="/", status_code=status.HTTP_200_OK, response_model=List[UserDisplay]
 )
 async def get_all_users(
-    session: AsyncSession = ActiveSession,
-    offset: int = 0,
-    limit: int = Query(default=50, lte=50),
-) -> List[UserDisplay]:
-    result = await session.execute(select(User).offset(offset).limit(limit))
-    users: List[UserDisplay] = result.scalars().all()
+    response: Response,
+    session: AsyncSession = ReadSession,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=50),
+    cursor: Optional[str] = None,
+    sort: str = "id",
+) -> Union[List[UserDisplay], Response]:
+    users, next_cursor = await paginator.fetch(
+        session, select(User), sort, cursor, offset, limit
+    )
+    set_next_cursor(response, next_cursor)
+    if settings.FAST_JSON_RESPONSES:
+        return json_response(encode(users, UserDisplay), response)
     return users
 
 
@@ -32,9 +45,9 @@ async def get_all_users(
     response_model=UserDisplay,
 )
 async def get_user(
-    session: AsyncSession = ActiveSession,
+    session: AsyncSession = ReadSession,
     user_id: int = Query(..., gt=0),
-) -> UserDisplay:
+) -> Union[UserDisplay, Response]:
     result = await session.execute(select(User).where(User.id == user_id))
     user: Optional[UserDisplay] = result.scalars().first()
     if user is None:
@@ -42,6 +55,8 @@ async def get_user(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User with id {user_id} does not exist.",
         )
+    if settings.FAST_JSON_RESPONSES:
+        return json_response(encode(user, UserDisplay))
     return UserDisplay(**user.dict())
 
 
@@ -52,10 +67,8 @@ async def create_user_registration(
     user_create_payload: UserCreate,
     session: AsyncSession = ActiveSession,
 ) -> UserDisplay:
-    user: User = User(**user_create_payload.dict())
-
     result = await session.execute(
-        select(User).where(User.email == user.email)
+        select(User).where(User.email == user_create_payload.email)
     )
     existing_user: Optional[UserDisplay] = result.scalars().first()
     if existing_user is not None:
@@ -63,6 +76,13 @@ async def create_user_registration(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"User with email {existing_user.email} already exists.",
         )
+
+    # Hash off the event loop, and only once the email is known to be free;
+    # the model validator keeps an existing hash.
+    user: User = User(
+        **user_create_payload.dict(exclude={"password"}),
+        password=await password_hasher.hash(user_create_payload.password),
+    )
     session.add(user)
     await session.commit()
     return UserDisplay(**user.dict())
@@ -0,0 +1,131 @@
+from decimal import Decimal
+from functools import lru_cache
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Type,
+)
+
+import orjson
+
+from fastapi import Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from app.settings import settings
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# (field name, nested model or None, whether the field is a list)
+FieldPlan = Tuple[str, Optional[Type[BaseModel]], bool]
+
+
+@lru_cache(maxsize=None)
+def _plan(model: Type[BaseModel]) -> Tuple[FieldPlan, ...]:
+    plan: List[FieldPlan] = []
+    for field in model.__fields__.values():
+        nested: Optional[Type[BaseModel]] = None
+        if isinstance(field.type_, type) and issubclass(
+            field.type_, BaseModel
+        ):
+            nested = field.type_
+        if field.shape not in (SHAPE_SINGLETON, SHAPE_LIST):
+            raise TypeError(  # pragma: no cover
+                f"{model.__name__}.{field.name} has an unsupported shape."
+            )
+        plan.append((field.name, nested, field.shape == SHAPE_LIST))
+    return tuple(plan)
+
+
+def to_jsonable(obj: Any, model: Type[BaseModel]) -> Dict[str, Any]:
+    """Read the fields of `model` straight off an ORM row or a mapping.
+
+    Unlike `model.from_orm(obj).dict()` nothing is validated: the rows come
+    from our own database, so they already have the declared types.
+    """
+    get = obj.get if isinstance(obj, Mapping) else obj.__getattribute__
+    content: Dict[str, Any] = {}
+    for name, nested, is_list in _plan(model):
+        value = get(name)
+        if nested is not None and value is not None:
+            if is_list:
+                value = [to_jsonable(item, nested) for item in value]
+            else:
+                value = to_jsonable(value, nested)
+        content[name] = value
+    return content
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError  # pragma: no cover
+
+
+def encode(obj: Any, model: Type[BaseModel]) -> bytes:
+    """Encode one row, or a list of rows, as `model` shaped JSON bytes."""
+    if isinstance(obj, (list, tuple)):
+        content: Any = [to_jsonable(item, model) for item in obj]
+    else:
+        content = to_jsonable(obj, model)
+    return orjson.dumps(content, default=_default)
+
+
+def respond(payload: Any, response: Response) -> Any:
+    """Return `payload` as is, or as a JSON response if it is pre-encoded."""
+    if isinstance(payload, bytes):
+        return json_response(payload, response)
+    return payload
+
+
+def json_response(
+    content: bytes,
+    response: Optional[Response] = None,
+    status_code: int = status.HTTP_200_OK,
+) -> Response:
+    """Wrap pre-encoded JSON, keeping headers set on the injected response."""
+    fast_response = Response(
+        content=content,
+        status_code=status_code,
+        media_type="application/json",
+    )
+    if response is not None:
+        for key, value in response.headers.items():
+            if key.lower() not in ("content-length", "content-type"):
+                fast_response.headers[key] = value
+    return fast_response
+
+
+async def ndjson_chunks(
+    session: AsyncSession, statement: Select
+) -> AsyncIterator[bytes]:
+    """Yield the rows of `statement` as NDJSON, one chunk per batch.
+
+    The rows come from a server-side cursor `EXPORT_BATCH_SIZE` rows at a
+    time, so memory does not grow with the size of the result.
+    """
+    result = await session.stream(
+        statement.execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+    )
+    async for rows in result.mappings().partitions():
+        yield b"".join(
+            orjson.dumps(
+                dict(row), default=_default, option=orjson.OPT_APPEND_NEWLINE
+            )
+            for row in rows
+        )
+
+
+def ndjson_response(session: AsyncSession, statement: Select) -> Response:
+    """Stream `statement` as NDJSON; the session is held until it is done."""
+    return StreamingResponse(
+        ndjson_chunks(session, statement), media_type=NDJSON_MEDIA_TYPE
+    )
@@ -0,0 +1,65 @@
+import os
+
+from typing import Any, Dict
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from app.settings import settings
+
+
+class Worker(UvicornWorker):
+    """Uvicorn worker on uvloop and httptools, bounded by the settings."""
+
+    CONFIG_KWARGS = {
+        "loop": "uvloop",
+        "http": "httptools",
+        "limit_concurrency": settings.SERVER_LIMIT_CONCURRENCY,
+    }
+
+
+class Server(BaseApplication):
+    """Gunicorn arbiter that preforks the workers and restarts dead ones.
+
+    Workers import the app after the fork, so each builds its own engine
+    and pools sized by `Settings.pool_limits`.
+    """
+
+    def __init__(self, options: Dict[str, Any]) -> None:
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self) -> Any:
+        from app.main import app
+
+        return app
+
+
+def server_options() -> Dict[str, Any]:
+    return {
+        "bind": f"{settings.SERVER_HOST}:{settings.SERVER_PORT}",
+        "workers": settings.SERVER_WORKERS,
+        "worker_class": "app.server.Worker",
+        "keepalive": settings.SERVER_KEEPALIVE,
+        "backlog": settings.SERVER_BACKLOG,
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT,
+    }
+
+
+def main() -> None:
+    # Forked workers inherit the settings, and with them the worker count
+    # that their share of the connection budget is based on.
+    settings.SERVER_WORKERS = settings.SERVER_WORKERS or os.cpu_count() or 1
+    try:
+        settings.pool_limits()
+    except ValueError as e:
+        raise SystemExit(str(e)) from e
+    Server(server_options()).run()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
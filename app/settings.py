@@ -1,19 +1,147 @@
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
 
-from pydantic import BaseConfig, BaseSettings, Field, PostgresDsn, validator
+from pydantic import (
+    AnyUrl,
+    BaseConfig,
+    BaseSettings,
+    Field,
+    PostgresDsn,
+    validator,
+)
+
+
+class SqliteDsn(AnyUrl):
+    allowed_schemes = {"sqlite+aiosqlite"}
+    host_required = False
 
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = Field(default="staket-api")
 
+    # `sqlite` keeps the data in the `SQLITE_PATH` file through aiosqlite,
+    # so the tests and benchmarks can run without a Postgres server. Search
+    # falls back to `LIKE` there, and write sessions lock the whole
+    # database where Postgres would lock rows.
+    DB_BACKEND: Literal["postgresql", "sqlite"] = Field(
+        default="postgresql", env="DB_BACKEND"
+    )
+    SQLITE_PATH: str = Field(default="staket.db", env="SQLITE_PATH")
+    # Seconds a connection waits for another one's write lock.
+    SQLITE_BUSY_TIMEOUT: float = Field(
+        default=30.0, gt=0, env="SQLITE_BUSY_TIMEOUT"
+    )
+
     POSTGRES_SERVER: str = Field(default="localhost", env="POSTGRES_SERVER")
-    POSTGRES_USER: str = Field(env="POSTGRES_USER")
-    POSTGRES_PASSWORD: str = Field(env="POSTGRES_PASSWORD")
-    POSTGRES_DB: str = Field(env="POSTGRES_DB")
+    POSTGRES_USER: Optional[str] = Field(default=None, env="POSTGRES_USER")
+    POSTGRES_PASSWORD: Optional[str] = Field(
+        default=None, env="POSTGRES_PASSWORD"
+    )
+    POSTGRES_DB: Optional[str] = Field(default=None, env="POSTGRES_DB")
     POSTGRES_PORT: str = Field(default=5432, env="POSTGRES_PORT")
 
-    SQLALCHEMY_DATABASE_URI: Optional[PostgresDsn] = None
+    SQLALCHEMY_DATABASE_URI: Optional[Union[PostgresDsn, SqliteDsn]] = None
+
+    # Connection pool of the async engine. Every worker process owns one
+    # pool, so `DB_POOL_SIZE + DB_MAX_OVERFLOW` multiplied by the number of
+    # workers has to stay under the `max_connections` of the database.
+    # Setting `DB_CONNECTION_BUDGET` to what the app may use of those
+    # shrinks each worker's pool to its share; see `pool_limits`.
+    DB_ECHO: bool = Field(default=False, env="DB_ECHO")
+    DB_POOL_SIZE: int = Field(default=5, ge=1, env="DB_POOL_SIZE")
+    DB_MAX_OVERFLOW: int = Field(default=10, ge=0, env="DB_MAX_OVERFLOW")
+    DB_CONNECTION_BUDGET: Optional[int] = Field(
+        default=None, ge=1, env="DB_CONNECTION_BUDGET"
+    )
+    DB_POOL_TIMEOUT: float = Field(default=30.0, gt=0, env="DB_POOL_TIMEOUT")
+    DB_POOL_RECYCLE: int = Field(default=1800, env="DB_POOL_RECYCLE")
+    DB_POOL_PRE_PING: bool = Field(default=True, env="DB_POOL_PRE_PING")
+    DB_STATEMENT_CACHE_SIZE: int = Field(
+        default=100, ge=0, env="DB_STATEMENT_CACHE_SIZE"
+    )
+
+    # Read replicas serving the GET endpoints, as a JSON list of DSNs; with
+    # none configured every read goes to the primary. After a write, the
+    # client's reads stick to the primary for `DB_READ_YOUR_WRITES_SECONDS`
+    # so that replication lag cannot hide its own changes.
+    DB_REPLICA_URIS: List[PostgresDsn] = Field(
+        default=[], env="DB_REPLICA_URIS"
+    )
+    DB_REPLICA_SELECTION: Literal["round_robin", "least_connections"] = Field(
+        default="round_robin", env="DB_REPLICA_SELECTION"
+    )
+    DB_READ_YOUR_WRITES_SECONDS: int = Field(
+        default=5, ge=0, env="DB_READ_YOUR_WRITES_SECONDS"
+    )
+
+    # PBKDF2 hashing runs in a process pool so it never blocks the event
+    # loop. At most `PASSWORD_HASHING_CONCURRENCY` hashes are in flight per
+    # worker; further callers wait for a free slot.
+    PASSWORD_HASHING_WORKERS: int = Field(
+        default=2, ge=1, env="PASSWORD_HASHING_WORKERS"
+    )
+    PASSWORD_HASHING_CONCURRENCY: int = Field(
+        default=4, ge=1, env="PASSWORD_HASHING_CONCURRENCY"
+    )
+
+    # Per-worker cache in front of the product catalog reads.
+    PRODUCT_CACHE_SIZE: int = Field(
+        default=1024, ge=0, env="PRODUCT_CACHE_SIZE"
+    )
+    PRODUCT_CACHE_TTL: float = Field(
+        default=60.0, gt=0, env="PRODUCT_CACHE_TTL"
+    )
+
+    # Per-worker cache of the responses stored for `Idempotency-Key`
+    # headers, so that retries are replayed without a database round trip.
+    # The idempotency_keys table stays the source of truth.
+    IDEMPOTENCY_CACHE_SIZE: int = Field(
+        default=4096, ge=0, env="IDEMPOTENCY_CACHE_SIZE"
+    )
+    IDEMPOTENCY_CACHE_TTL: float = Field(
+        default=3600.0, gt=0, env="IDEMPOTENCY_CACHE_TTL"
+    )
+
+    # Encode read responses straight from the ORM rows with orjson instead
+    # of building and re-validating the pydantic display models.
+    FAST_JSON_RESPONSES: bool = Field(default=False, env="FAST_JSON_RESPONSES")
+
+    # POST /products/bulk checks names and inserts in chunks of
+    # this many rows; every name of a chunk is a bind parameter.
+    PRODUCT_BULK_CHUNK_SIZE: int = Field(
+        default=1000, ge=1, le=10000, env="PRODUCT_BULK_CHUNK_SIZE"
+    )
+    PRODUCT_BULK_MAX_ROWS: int = Field(
+        default=50000, ge=1, env="PRODUCT_BULK_MAX_ROWS"
+    )
+
+    # Rows fetched per round trip by the streaming NDJSON exports.
+    EXPORT_BATCH_SIZE: int = Field(default=1000, ge=1, env="EXPORT_BATCH_SIZE")
+
+    # Request latency and per-request query counts and time, served at
+    # /metrics in the Prometheus text format. Every worker keeps its own.
+    METRICS_ENABLED: bool = Field(default=True, env="METRICS_ENABLED")
+
+    # `python -m app.server` preforks `SERVER_WORKERS` processes, one per
+    # CPU by default, each serving the app with uvicorn on uvloop and
+    # httptools.
+    SERVER_HOST: str = Field(default="0.0.0.0", env="SERVER_HOST")
+    SERVER_PORT: int = Field(default=8000, env="SERVER_PORT")
+    SERVER_WORKERS: Optional[int] = Field(
+        default=None, ge=1, env="SERVER_WORKERS"
+    )
+    # Seconds an idle keep-alive connection is held open.
+    SERVER_KEEPALIVE: int = Field(default=5, ge=0, env="SERVER_KEEPALIVE")
+    # Connections the kernel queues while every worker is busy.
+    SERVER_BACKLOG: int = Field(default=2048, ge=1, env="SERVER_BACKLOG")
+    # Connections and tasks a worker serves at once before it answers 503.
+    SERVER_LIMIT_CONCURRENCY: Optional[int] = Field(
+        default=None, ge=1, env="SERVER_LIMIT_CONCURRENCY"
+    )
+    # Seconds a stopping worker gives in-flight requests to finish.
+    SERVER_GRACEFUL_TIMEOUT: int = Field(
+        default=30, ge=0, env="SERVER_GRACEFUL_TIMEOUT"
+    )
 
     @validator("SQLALCHEMY_DATABASE_URI", pre=True)
     def assemble_db_connection(
@@ -21,6 +149,11 @@ class Settings(BaseSettings):
     ) -> Any:
         if isinstance(v, str):
             return v
+        if values.get("DB_BACKEND") == "sqlite":
+            return f"sqlite+aiosqlite:///{values.get('SQLITE_PATH')}"
+        for name in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB"):
+            if not values.get(name):
+                raise ValueError(f"{name} is required for Postgres.")
         return PostgresDsn.build(
             scheme="postgresql+asyncpg",
             user=values.get("POSTGRES_USER"),
@@ -30,6 +163,25 @@ class Settings(BaseSettings):
             port=values.get("POSTGRES_PORT"),
         )
 
+    def pool_limits(self) -> Tuple[int, int]:
+        """Pool size and max overflow of one worker's engine.
+
+        With a `DB_CONNECTION_BUDGET`, each of the `SERVER_WORKERS` gets an
+        equal share of it; the overflow is cut before the pool size.
+        """
+        pool_size, max_overflow = self.DB_POOL_SIZE, self.DB_MAX_OVERFLOW
+        if self.DB_CONNECTION_BUDGET is None:
+            return pool_size, max_overflow
+        workers = self.SERVER_WORKERS or 1
+        share = self.DB_CONNECTION_BUDGET // workers
+        if share < 1:
+            raise ValueError(
+                f"A budget of {self.DB_CONNECTION_BUDGET} connections "
+                f"cannot be shared by {workers} workers."
+            )
+        pool_size = min(pool_size, share)
+        return pool_size, min(max_overflow, share - pool_size)
+
     class Config(BaseConfig):
         case_sensitive = True
         parent_path = Path(__file__).parent
@@ -0,0 +1,365 @@
+"""HTTP load test of the API against a seeded database.
+
+Seeds the benchmark database (see ``bench.seed``), then runs each
+``--scenario`` for ``--duration`` seconds with ``--concurrency`` virtual
+users, after ``--warmup`` seconds whose requests are not recorded:
+
+- ``browse``: a product listing page in a random order or category, a
+  product, a search and the category listing,
+- ``add-to-cart``: adds a random product to the cart,
+- ``checkout``: adds two products and places the order.
+
+The API has no authentication yet, so every cart and order belongs to the
+demo user: concurrent checkouts queue up on that user's cart, and one that
+finds the cart already checked out by another virtual user gets a 404.
+Errors are therefore broken down by status code.
+
+Requests go to the ASGI app in this process through ``httpx.AsyncClient``
+(``--target asgi``) or to a ``uvicorn`` server started for the run
+(``--target uvicorn``). The report is JSON with RPS and p50/p95/p99
+latencies per scenario and endpoint, plus the commit it was measured on;
+``--baseline`` adds the change against an earlier report.
+
+    python -m bench.load --products 20000 --concurrency 32 --output run.json
+    python -m bench.load --baseline run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from httpx import AsyncClient, HTTPError
+from sqlalchemy.engine import make_url
+
+from bench.seed import (
+    Volumes,
+    add_arguments,
+    default_database_url,
+    seed,
+    volumes_from,
+)
+
+# (endpoint label, seconds, status code)
+Sample = Tuple[str, float, int]
+
+
+class VirtualUser:
+    """Runs scenario steps through one client and records every request."""
+
+    def __init__(
+        self, client: AsyncClient, volumes: Volumes, rng: random.Random
+    ) -> None:
+        self.client = client
+        self.volumes = volumes
+        self.rng = rng
+        self.samples: List[Sample] = []
+        self.iterations = 0
+        self.recording = False
+
+    async def request(
+        self, label: str, method: str, url: str, **kwargs: Any
+    ) -> None:
+        started_at = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            status_code = response.status_code
+        except HTTPError:
+            status_code = 599
+        if self.recording:
+            self.samples.append(
+                (label, time.perf_counter() - started_at, status_code)
+            )
+
+    def product_id(self) -> int:
+        return self.rng.randint(1, self.volumes.products)
+
+    async def browse(self) -> None:
+        params: Dict[str, Any] = {
+            "limit": 20,
+            "sort": self.rng.choice(["id", "name", "price", "-price"]),
+        }
+        if self.rng.random() < 0.5:
+            params["category_id"] = self.rng.randint(
+                1, self.volumes.categories
+            )
+        await self.request(
+            "GET /products/", "GET", "/products/", params=params
+        )
+        await self.request(
+            "GET /products/{product_id}/",
+            "GET",
+            f"/products/{self.product_id()}/",
+        )
+        await self.request(
+            "GET /products/search",
+            "GET",
+            "/products/search",
+            params={"q": self.rng.choice(SEARCH_TERMS)},
+        )
+        await self.request(
+            "GET /products/categories/", "GET", "/products/categories/"
+        )
+
+    async def add_to_cart(self) -> None:
+        await self.request(
+            "POST /carts/add",
+            "POST",
+            "/carts/add",
+            params={"product_id": self.product_id(), "quantity": 1},
+        )
+
+    async def checkout(self) -> None:
+        await self.add_to_cart()
+        await self.add_to_cart()
+        await self.request("POST /orders/", "POST", "/orders/")
+
+
+SEARCH_TERMS = ["chair", "steel", "wooden", "shirt", "gloves", "practical"]
+SCENARIOS: Dict[str, Callable[[VirtualUser], Awaitable[None]]] = {
+    "browse": VirtualUser.browse,
+    "add-to-cart": VirtualUser.add_to_cart,
+    "checkout": VirtualUser.checkout,
+}
+
+
+def percentile(ordered: List[float], percent: float) -> float:
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(seconds * 1000 for _, seconds, _ in samples)
+    if not latencies:
+        return {"requests": 0, "errors": 0, "rps": 0.0}
+    statuses = Counter(str(status) for _, _, status in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(status >= 400 for _, _, status in samples),
+        "statuses": dict(sorted(statuses.items())),
+        "rps": len(samples) / elapsed,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1],
+        },
+    }
+
+
+async def run_scenario(
+    client: AsyncClient,
+    name: str,
+    volumes: Volumes,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    seed: int,
+) -> Dict[str, Any]:
+    scenario = SCENARIOS[name]
+    users = [
+        VirtualUser(client, volumes, random.Random(f"{seed}:{name}:{i}"))
+        for i in range(concurrency)
+    ]
+    started_at = time.perf_counter()
+    recording_from = started_at + warmup
+    deadline = recording_from + duration
+
+    async def loop(user: VirtualUser) -> None:
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            user.recording = now >= recording_from
+            await scenario(user)
+            user.iterations += user.recording
+
+    await asyncio.gather(*(loop(user) for user in users))
+    elapsed = time.perf_counter() - recording_from
+    samples = [sample for user in users for sample in user.samples]
+    endpoints = sorted({label for label, _, _ in samples})
+    return {
+        **summarize(samples, elapsed),
+        "iterations_per_second": sum(u.iterations for u in users) / elapsed,
+        "endpoints": {
+            label: summarize(
+                [sample for sample in samples if sample[0] == label], elapsed
+            )
+            for label in endpoints
+        },
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+@asynccontextmanager
+async def asgi_client(database_url: str) -> AsyncIterator[AsyncClient]:
+    # The engine is built when app.db is imported, from these settings.
+    from app.settings import settings
+
+    settings.SQLALCHEMY_DATABASE_URI = database_url
+    from app.db import dispose_engines
+    from app.main import app
+
+    try:
+        async with AsyncClient(app=app, base_url="http://bench") as client:
+            yield client
+    finally:
+        # The client does not run the app's shutdown handlers.
+        await dispose_engines()
+
+
+@asynccontextmanager
+async def uvicorn_client(database_url: str) -> AsyncIterator[AsyncClient]:
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--no-access-log",
+        ],
+        env={**os.environ, "SQLALCHEMY_DATABASE_URI": database_url},
+    )
+    try:
+        async with AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            for _ in range(300):
+                if server.poll() is not None:
+                    raise SystemExit("uvicorn exited before it was ready.")
+                try:
+                    if (await client.get("/db_ready")).status_code == 200:
+                        break
+                except OSError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise SystemExit("uvicorn was not ready within 30 seconds.")
+            yield client
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def git_revision() -> Dict[str, Any]:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=False
+        ).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD") or None,
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def compare(
+    report: Dict[str, Any], baseline: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Relative change of RPS and latencies against `baseline`."""
+    changes: Dict[str, Any] = {"commit": baseline.get("commit")}
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or not before.get("requests"):
+            continue
+        change = {"rps": result["rps"] / before["rps"] - 1}
+        for key in ("p50", "p95", "p99"):
+            change[key] = (
+                result["latency_ms"][key] / before["latency_ms"][key] - 1
+            )
+        changes[name] = change
+    return changes
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    database_url = args.database_url or default_database_url()
+    volumes = volumes_from(args)
+    seeded: Optional[Dict[str, Any]] = None
+    if not args.skip_seed:
+        seeded = await seed(database_url, volumes)
+
+    client_factory = asgi_client if args.target == "asgi" else uvicorn_client
+    report: Dict[str, Any] = {
+        **git_revision(),
+        "started_at": datetime.utcnow().isoformat(),
+        "target": args.target,
+        "database": make_url(database_url).get_backend_name(),
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "seed": seeded or volumes.__dict__,
+        "scenarios": {},
+    }
+    async with client_factory(database_url) as client:
+        for name in args.scenario or list(SCENARIOS):
+            report["scenarios"][name] = await run_scenario(
+                client,
+                name,
+                volumes,
+                concurrency=args.concurrency,
+                duration=args.duration,
+                warmup=args.warmup,
+                seed=volumes.seed,
+            )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    add_arguments(parser)
+    parser.add_argument(
+        "--target", choices=("asgi", "uvicorn"), default="asgi"
+    )
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument(
+        "--skip-seed",
+        action="store_true",
+        help="Reuse the dataset of an earlier run with the same volumes.",
+    )
+    parser.add_argument("--baseline", type=argparse.FileType("r"))
+    parser.add_argument("--output", type=argparse.FileType("w"))
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.baseline is not None:
+        report["baseline"] = compare(report, json.load(args.baseline))
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
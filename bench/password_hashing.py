@@ -0,0 +1,100 @@
+"""Latency of an unrelated endpoint while passwords are being hashed.
+
+Fires a storm of password hashes and, at the same time, keeps requesting
+``GET /`` through the ASGI app. Hashing either runs inline on the event
+loop (what the user model validator does) or through the process pool
+backed ``password_hasher``. Prints p50/p95/p99 latencies as JSON.
+
+    python -m bench.password_hashing --hashes 50 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from typing import Any, Dict, List
+
+from httpx import AsyncClient
+
+import helpers
+
+from app.hashing import PasswordHasher
+from app.main import app
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+async def hash_inline(password: str) -> str:
+    return helpers.hash_password(password)
+
+
+async def measure(mode: str, hashes: int, requests: int) -> Dict[str, Any]:
+    hasher = PasswordHasher(max_workers=2, max_concurrency=4)
+    latencies: List[float] = []
+
+    async def signup(password: str) -> None:
+        if mode == "inline":
+            await hash_inline(password)
+        else:
+            await hasher.hash(password)
+
+    async def storm() -> None:
+        signups = []
+        for i in range(hashes):
+            signups.append(asyncio.create_task(signup(f"password-{i}")))
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*signups)
+
+    async def probe(client: AsyncClient) -> None:
+        # Requests are issued on a fixed schedule and timed from the moment
+        # they were due, so a stalled loop shows up as latency.
+        async def request(due_at: float) -> None:
+            await client.get("/")
+            latencies.append(time.perf_counter() - due_at)
+
+        probes = []
+        for _ in range(requests):
+            probes.append(
+                asyncio.create_task(request(due_at=time.perf_counter()))
+            )
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*probes)
+
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        started_at = time.perf_counter()
+        await asyncio.gather(storm(), probe(client))
+        elapsed = time.perf_counter() - started_at
+    hasher.shutdown()
+
+    return {
+        "mode": mode,
+        "hashes": hashes,
+        "requests": requests,
+        "elapsed": elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hashes", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(measure(mode, args.hashes, args.requests))
+        for mode in ("inline", "process_pool")
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
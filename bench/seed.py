@@ -0,0 +1,276 @@
+"""Seed a database with a reproducible catalog for the load harness.
+
+Drops and recreates every table, then inserts ``--users`` users,
+``--categories`` categories, ``--products`` products, a cart for each of
+``--carts`` users and ``--orders`` orders, all generated with
+``faker_commerce`` from ``--seed``. Rows get explicit ids, so the same
+arguments always produce the same dataset.
+
+The database is ``--database-url`` or, by default, the configured
+Postgres database or SQLite file with a ``_bench`` suffix, created when it
+is missing. The configured database itself is never touched.
+
+    python -m bench.seed --products 20000 --orders 5000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import faker_commerce
+
+from faker import Faker
+from sqlalchemy import Table, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlmodel import SQLModel
+
+import helpers
+
+from app.constants import OrderStatus
+from app.models.cart import Cart, CartItem
+from app.models.category import Category
+from app.models.order import Order, OrderDetails
+from app.models.product import Product
+from app.models.user import User
+from app.settings import settings
+
+BATCH_SIZE = 1000
+# Known to every seeded user, for scenarios that need to sign in.
+PASSWORD = "bench-password"
+
+
+@dataclass
+class Volumes:
+    users: int = 1000
+    categories: int = 50
+    products: int = 10000
+    carts: int = 200
+    orders: int = 2000
+    seed: int = 42
+
+
+def default_database_url() -> str:
+    url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+    if url.get_backend_name() == "sqlite":
+        path = Path(url.database)
+        bench_path = path.with_name(f"{path.stem}_bench{path.suffix}")
+        return str(url.set(database=str(bench_path)))
+    return str(url.set(database=f"{url.database}_bench"))
+
+
+async def create_database(database_url: str) -> None:
+    """Create the Postgres database of `database_url` unless it exists."""
+    url = make_url(database_url)
+    if url.get_backend_name() != "postgresql":
+        return
+    engine = create_async_engine(
+        url.set(database="postgres"), isolation_level="AUTOCOMMIT"
+    )
+    try:
+        async with engine.connect() as conn:
+            exists = await conn.scalar(
+                text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                {"name": url.database},
+            )
+            if not exists:
+                name = conn.dialect.identifier_preparer.quote(url.database)
+                await conn.execute(text(f"CREATE DATABASE {name}"))
+    finally:
+        await engine.dispose()
+
+
+async def insert_rows(
+    conn: AsyncConnection, table: Table, rows: Sequence[Dict[str, Any]]
+) -> None:
+    for start in range(0, len(rows), BATCH_SIZE):
+        await conn.execute(table.insert(), rows[start : start + BATCH_SIZE])
+
+
+async def reset_sequences(conn: AsyncConnection, tables: List[Table]) -> None:
+    """Move the id sequences past the explicit ids inserted."""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in tables:
+        await conn.execute(
+            text(
+                "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                f"coalesce(max(id), 0) + 1, false) FROM {table.name}"
+            ),
+            {"table": table.name},
+        )
+
+
+def build_rows(volumes: Volumes) -> Dict[Table, List[Dict[str, Any]]]:
+    fake = Faker()
+    fake.add_provider(faker_commerce.Provider)
+    fake.seed_instance(volumes.seed)
+    rng = random.Random(volumes.seed)
+    now = datetime(2022, 7, 1)
+    password = helpers.hash_password(PASSWORD)
+
+    users = [
+        {
+            "id": i,
+            "name": fake.name()[:50],
+            "email": f"user{i}@example.com",
+            "password": password,
+            "is_active": True,
+        }
+        for i in range(1, volumes.users + 1)
+    ]
+    categories = [
+        {
+            "id": i,
+            "name": f"{fake.ecommerce_category()} {i}",
+            "updated_at": now,
+        }
+        for i in range(1, volumes.categories + 1)
+    ]
+    products = [
+        {
+            "id": i,
+            "name": f"{fake.ecommerce_name()} {i}"[-50:],
+            "description": fake.text(max_nb_chars=200),
+            # Enough stock that checkouts are not turned down mid-run.
+            "quantity": rng.randint(1000, 100000),
+            "price": float(fake.ecommerce_price()),
+            "category_id": rng.randint(1, volumes.categories),
+            "updated_at": now,
+        }
+        for i in range(1, volumes.products + 1)
+    ]
+
+    carts = []
+    cart_items = []
+    for cart_id, user_id in enumerate(
+        rng.sample(range(1, volumes.users + 1), volumes.carts), start=1
+    ):
+        carts.append({"id": cart_id, "user_id": user_id, "created_date": now})
+        for product_id in rng.sample(
+            range(1, volumes.products + 1), rng.randint(1, 5)
+        ):
+            cart_items.append(
+                {
+                    "id": len(cart_items) + 1,
+                    "cart_id": cart_id,
+                    "product_id": product_id,
+                    "quantity": rng.randint(1, 3),
+                    "created_date": now,
+                }
+            )
+
+    orders = []
+    order_details = []
+    statuses = list(OrderStatus)
+    for order_id in range(1, volumes.orders + 1):
+        order_date = now - timedelta(minutes=rng.randint(0, 525600))
+        amount = 0.0
+        for product_id in rng.sample(
+            range(1, volumes.products + 1), rng.randint(1, 5)
+        ):
+            quantity = rng.randint(1, 3)
+            unit_price = products[product_id - 1]["price"]
+            amount += quantity * unit_price
+            order_details.append(
+                {
+                    "id": len(order_details) + 1,
+                    "order_id": order_id,
+                    "product_id": product_id,
+                    "quantity": quantity,
+                    "unit_price": unit_price,
+                    "created_date": order_date,
+                }
+            )
+        orders.append(
+            {
+                "id": order_id,
+                "customer_id": rng.randint(1, volumes.users),
+                "order_date": order_date,
+                "order_amount": round(amount, 2),
+                "status": rng.choice(statuses).value,
+                "shipping_address": fake.street_address()[:50],
+            }
+        )
+
+    return {
+        User.__table__: users,
+        Category.__table__: categories,
+        Product.__table__: products,
+        Cart.__table__: carts,
+        CartItem.__table__: cart_items,
+        Order.__table__: orders,
+        OrderDetails.__table__: order_details,
+    }
+
+
+async def seed(database_url: str, volumes: Volumes) -> Dict[str, Any]:
+    """Recreate the schema of `database_url` and fill it; returns counts."""
+    if volumes.users < 1 or volumes.categories < 1 or volumes.products < 1:
+        raise ValueError("At least one user, category and product needed.")
+    if volumes.carts > volumes.users:
+        raise ValueError("Every cart belongs to a different user.")
+
+    started_at = time.perf_counter()
+    rows = build_rows(volumes)
+    await create_database(database_url)
+    engine = create_async_engine(database_url)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+            await conn.run_sync(SQLModel.metadata.create_all)
+            for table, table_rows in rows.items():
+                await insert_rows(conn, table, table_rows)
+            await reset_sequences(conn, list(rows))
+            await conn.execute(text("ANALYZE"))
+    finally:
+        await engine.dispose()
+
+    return {
+        **asdict(volumes),
+        "rows": {
+            table.name: len(table_rows) for table, table_rows in rows.items()
+        },
+        "elapsed": time.perf_counter() - started_at,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = Volumes()
+    parser.add_argument("--database-url", default=None)
+    for name in ("users", "categories", "products", "carts", "orders", "seed"):
+        parser.add_argument(
+            f"--{name}", type=int, default=getattr(defaults, name)
+        )
+
+
+def volumes_from(args: argparse.Namespace) -> Volumes:
+    return Volumes(
+        users=args.users,
+        categories=args.categories,
+        products=args.products,
+        carts=args.carts,
+        orders=args.orders,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+    database_url = args.database_url or default_database_url()
+    summary = asyncio.run(seed(database_url, volumes_from(args)))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
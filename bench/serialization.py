@@ -0,0 +1,134 @@
+"""Throughput of rendering large order lists.
+
+Builds ``--orders`` orders with ``--details`` lines each (with their user,
+products and categories, the tree ``GET /orders/{id}`` renders) and
+renders the list the two ways the order endpoints can:
+
+- ``pydantic``: ``OrderDisplay.from_orm`` per order, then FastAPI's own
+  response validation, ``jsonable_encoder`` and ``JSONResponse``,
+- ``fast``: ``app.serialization.encode``, i.e. ``FAST_JSON_RESPONSES``.
+
+Prints the best of ``--repeat`` runs per mode as JSON.
+
+    python -m bench.serialization --orders 500 --details 10
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from datetime import datetime
+from typing import Any, Dict, List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.models.cart import CartItem  # noqa: F401 (Product relates to it)
+from app.models.category import Category
+from app.models.order import Order, OrderDetails, OrderDisplay
+from app.models.product import Product
+from app.models.user import User
+from app.serialization import encode
+
+
+def build_orders(orders: int, details: int) -> List[Order]:
+    user = User(id=1, name="Jane Doe", email="jane@example.com", password="")
+    categories = [
+        Category(id=i, name=f"Category {i}", updated_at=datetime.utcnow())
+        for i in range(1, 11)
+    ]
+    products = []
+    for i in range(1, 101):
+        product = Product(
+            id=i,
+            name=f"Product {i}",
+            description="Lorem ipsum dolor sit amet, consectetur adipiscing.",
+            price=i * 1.25,
+            quantity=i,
+            category_id=categories[i % 10].id,
+        )
+        product.category = categories[i % 10]
+        products.append(product)
+
+    result = []
+    for order_id in range(1, orders + 1):
+        order = Order(
+            id=order_id,
+            order_date=datetime.utcnow(),
+            order_amount=100.0,
+            shipping_address="123 Main St, Anytown, CA 12345",
+            customer_id=user.id,
+        )
+        order.user_info = user
+        order_details = []
+        for line in range(details):
+            product = products[(order_id + line) % len(products)]
+            order_detail = OrderDetails(
+                id=order_id * details + line,
+                order_id=order_id,
+                product_id=product.id,
+                created_date=datetime.utcnow(),
+            )
+            order_detail.product = product
+            order_details.append(order_detail)
+        order.order_details = order_details
+        result.append(order)
+    return result
+
+
+def render_pydantic(orders: List[Order]) -> bytes:
+    field = create_response_field(
+        name="Response_get_all_orders", type_=List[OrderDisplay]
+    )
+    content = asyncio.run(
+        serialize_response(
+            field=field,
+            response_content=[OrderDisplay.from_orm(o) for o in orders],
+        )
+    )
+    return JSONResponse(content=content).body
+
+
+def render_fast(orders: List[Order]) -> bytes:
+    return encode(orders, OrderDisplay)
+
+
+def measure(mode: str, orders: List[Order], repeat: int) -> Dict[str, Any]:
+    render = render_fast if mode == "fast" else render_pydantic
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        body = render(orders)
+        timings.append(time.perf_counter() - started_at)
+    best = min(timings)
+    return {
+        "mode": mode,
+        "orders": len(orders),
+        "bytes": len(body),
+        "best_ms": best * 1000,
+        "orders_per_second": len(orders) / best,
+        "mb_per_second": len(body) / best / 1_000_000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--details", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    orders = build_orders(args.orders, args.details)
+    if json.loads(render_fast(orders)) != json.loads(render_pydantic(orders)):
+        raise SystemExit("The two modes rendered different documents.")
+
+    results = [
+        measure(mode, orders, args.repeat) for mode in ("pydantic", "fast")
+    ]
+    results[1]["speedup"] = results[0]["best_ms"] / results[1]["best_ms"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Added indexes on lookup columns.
+
+Revision ID: 07941769898b
+Revises: 41cfea466ba9
+Create Date: 2026-10-18 13:05:48.662017
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "07941769898b"  # pragma: allowlist secret
+down_revision = "41cfea466ba9"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+# carts.user_id and users.email are already covered by their unique keys.
+INDEXES = (
+    ("ix_products_name", "products", ["name"]),
+    ("ix_categories_name", "categories", ["name"]),
+    ("ix_orders_customer_id_id", "orders", ["customer_id", "id"]),
+    ("ix_order_details_order_id", "order_details", ["order_id"]),
+    ("ix_cart_items_product_id", "cart_items", ["product_id"]),
+)
+
+
+def upgrade() -> None:
+    # A failed concurrent build leaves an INVALID index behind; drop it
+    # before running the upgrade again.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,33 @@
+"""Added index on products.category_id.
+
+Revision ID: 0c77f5743494
+Revises: 32d9815bd8cf
+Create Date: 2026-10-18 11:20:37.842561
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0c77f5743494"  # pragma: allowlist secret
+down_revision = "32d9815bd8cf"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built without locking the products table against writes.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_products_category_id",
+            "products",
+            ["category_id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_products_category_id",
+            table_name="products",
+            postgresql_concurrently=True,
+        )
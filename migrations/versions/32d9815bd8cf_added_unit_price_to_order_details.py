@@ -0,0 +1,32 @@
+"""Added unit_price to order details.
+
+Revision ID: 32d9815bd8cf
+Revises: 6d9619824c50
+Create Date: 2026-10-18 10:41:55.271930
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "32d9815bd8cf"  # pragma: allowlist secret
+down_revision = "6d9619824c50"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "order_details", sa.Column("unit_price", sa.Float(), nullable=True)
+    )
+    # Existing lines were never priced; the current price is the best guess.
+    op.execute(
+        """
+        UPDATE order_details SET unit_price = products.price
+        FROM products WHERE products.id = order_details.product_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("order_details", "unit_price")
@@ -0,0 +1,33 @@
+"""Added updated_at to products and categories.
+
+Revision ID: 34fd6cfe744b
+Revises: 3701fd619c16
+Create Date: 2026-10-18 09:12:40.318204
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "34fd6cfe744b"  # pragma: allowlist secret
+down_revision = "3701fd619c16"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    for table_name in ("products", "categories"):
+        op.add_column(
+            table_name,
+            sa.Column(
+                "updated_at",
+                sa.DateTime(),
+                server_default=sa.text("now()"),
+                nullable=False,
+            ),
+        )
+
+
+def downgrade() -> None:
+    for table_name in ("products", "categories"):
+        op.drop_column(table_name, "updated_at")
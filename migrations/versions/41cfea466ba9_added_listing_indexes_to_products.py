@@ -0,0 +1,57 @@
+"""Added listing indexes to products.
+
+Revision ID: 41cfea466ba9
+Revises: 45f4b158a1dd
+Create Date: 2026-10-18 12:36:12.507193
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "41cfea466ba9"  # pragma: allowlist secret
+down_revision = "45f4b158a1dd"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_products_price_id",
+            "products",
+            ["price", "id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_products_price_desc_id_desc",
+            "products",
+            [sa.text("price DESC NULLS LAST"), sa.text("id DESC")],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_products_category_id_price_id",
+            "products",
+            ["category_id", "price", "id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_products_in_stock_price_id",
+            "products",
+            ["price", "id"],
+            postgresql_where=sa.text("quantity > 0"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name in (
+            "ix_products_in_stock_price_id",
+            "ix_products_category_id_price_id",
+            "ix_products_price_desc_id_desc",
+            "ix_products_price_id",
+        ):
+            op.drop_index(
+                name, table_name="products", postgresql_concurrently=True
+            )
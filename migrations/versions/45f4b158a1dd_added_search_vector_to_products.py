@@ -0,0 +1,51 @@
+"""Added search_vector to products.
+
+Revision ID: 45f4b158a1dd
+Revises: 0c77f5743494
+Create Date: 2026-10-18 11:58:04.190338
+"""
+import sqlalchemy as sa
+
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "45f4b158a1dd"  # pragma: allowlist secret
+down_revision = "0c77f5743494"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Generated columns are stored, so this rewrites the products table.
+    op.add_column(
+        "products",
+        sa.Column(
+            "search_vector",
+            postgresql.TSVECTOR(),
+            sa.Computed(
+                "setweight(to_tsvector('english', coalesce(name, '')), 'A') "
+                "|| setweight(to_tsvector('english', "
+                "coalesce(description, '')), 'B')",
+                persisted=True,
+            ),
+        ),
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_products_search_vector",
+            "products",
+            ["search_vector"],
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_products_search_vector",
+            table_name="products",
+            postgresql_concurrently=True,
+        )
+    op.drop_column("products", "search_vector")
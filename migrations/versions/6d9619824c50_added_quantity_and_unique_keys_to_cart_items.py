@@ -0,0 +1,78 @@
+"""Added quantity and unique keys to cart items.
+
+Revision ID: 6d9619824c50
+Revises: 34fd6cfe744b
+Create Date: 2026-10-18 10:02:11.504817
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6d9619824c50"  # pragma: allowlist secret
+down_revision = "34fd6cfe744b"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "cart_items",
+        sa.Column(
+            "quantity", sa.Integer(), server_default="1", nullable=False
+        ),
+    )
+
+    # Fold every user's extra carts into their oldest one.
+    op.execute(
+        """
+        UPDATE cart_items SET cart_id = keeper.id
+        FROM carts, (
+            SELECT DISTINCT ON (user_id) user_id, id
+            FROM carts ORDER BY user_id, id
+        ) AS keeper
+        WHERE cart_items.cart_id = carts.id
+            AND carts.user_id = keeper.user_id
+            AND carts.id <> keeper.id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM carts USING carts AS keeper
+        WHERE carts.user_id = keeper.user_id AND carts.id > keeper.id
+        """
+    )
+    # One row per product and cart, counting the clicks it replaces.
+    op.execute(
+        """
+        UPDATE cart_items SET quantity = counts.quantity
+        FROM (
+            SELECT min(id) AS id, count(*) AS quantity
+            FROM cart_items GROUP BY cart_id, product_id
+        ) AS counts
+        WHERE cart_items.id = counts.id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM cart_items USING cart_items AS keeper
+        WHERE cart_items.cart_id = keeper.cart_id
+            AND cart_items.product_id = keeper.product_id
+            AND cart_items.id > keeper.id
+        """
+    )
+
+    op.create_unique_constraint("carts_user_id_key", "carts", ["user_id"])
+    op.create_unique_constraint(
+        "cart_items_cart_id_product_id_key",
+        "cart_items",
+        ["cart_id", "product_id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint(
+        "cart_items_cart_id_product_id_key", "cart_items", type_="unique"
+    )
+    op.drop_constraint("carts_user_id_key", "carts", type_="unique")
+    op.drop_column("cart_items", "quantity")
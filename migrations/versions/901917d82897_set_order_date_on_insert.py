@@ -0,0 +1,35 @@
+"""Set order_date on insert.
+
+Revision ID: 901917d82897
+Revises: 9000927a09fc
+Create Date: 2026-10-18 17:05:21.503127
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "901917d82897"  # pragma: allowlist secret
+down_revision = "9000927a09fc"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column(
+        "orders",
+        "order_date",
+        existing_type=sa.DateTime(),
+        server_default=sa.text("statement_timestamp()"),
+        nullable=False,
+    )
+
+
+def downgrade() -> None:
+    op.alter_column(
+        "orders",
+        "order_date",
+        existing_type=sa.DateTime(),
+        server_default=None,
+        nullable=True,
+    )
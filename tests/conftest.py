@@ -1,3 +1,7 @@
+import asyncio
+import os
+
+from pathlib import Path
 from typing import AsyncGenerator, Generator, List
 
 import faker_commerce
@@ -5,53 +9,145 @@ import pytest
 
 from faker import Faker
 from fastapi.testclient import TestClient
-from sqlalchemy import select
-from sqlalchemy.engine import Engine
+from sqlalchemy import event, select, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import (
     AsyncConnection,
     AsyncEngine,
     AsyncSession,
     create_async_engine,
 )
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import joinedload, sessionmaker
 from sqlmodel import SQLModel
 
 from app import db
+from app.cache import product_cache
+from app.idempotency import idempotency_cache
+from app.models.cart import Cart, CartItem  # noqa
 from app.models.category import Category, CategoryCreate
+from app.models.idempotency import IdempotencyKey  # noqa
+from app.models.order import Order, OrderDetails  # noqa
 
 # Source: https://gist.github.com/kampikd/513f67b0aa757da766b8ad3c795281ee#file-pytest_transactions_full-py  # noqa
 from app.models.product import Product, ProductCreate
 from app.models.user import User, UserCreate, UserDisplay  # noqa
 from app.settings import settings
+from tests.query_budgets import (
+    QueryBudgetMiddleware,
+    is_savepoint,
+    record_statement,
+)
 
+# For tests of Postgres features that the SQLite backend falls back from.
+postgres_only = pytest.mark.skipif(
+    settings.DB_BACKEND != "postgresql", reason="Needs Postgres."
+)
 
-@pytest.fixture()
-async def connection() -> AsyncGenerator[AsyncConnection, None]:
-    engine: AsyncEngine = create_async_engine(
-        url=settings.SQLALCHEMY_DATABASE_URI,  # TODO: Replace it with TEST_DB_URL  # noqa
-        echo=True,
-        future=True,
-    )
 
+# Set by pytest-xdist in each of its worker processes.
+WORKER = os.environ.get("PYTEST_XDIST_WORKER", "main")
+
+
+@pytest.fixture(scope="session")
+def event_loop() -> Generator[asyncio.AbstractEventLoop, None, None]:
+    """One loop for the whole run, which the shared engine is bound to."""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+async def engine() -> AsyncGenerator[AsyncEngine, None]:
+    """Engine of this worker's database, with the schema created once.
+
+    Every xdist worker gets a Postgres schema of its own, through the
+    search path, or a SQLite file of its own.
+    """
+    url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+    schema = f"test_{WORKER}"
+    if url.get_backend_name() == "sqlite":
+        path = Path(url.database)
+        url = url.set(
+            database=str(path.with_name(f"{path.stem}_{schema}{path.suffix}"))
+        )
+        test_engine = create_async_engine(url=url, future=True)
+        db.configure_sqlite(test_engine.sync_engine)
+    else:
+        test_engine = create_async_engine(
+            url=url,
+            future=True,
+            connect_args={"server_settings": {"search_path": schema}},
+        )
+
+    async with test_engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+            await conn.execute(text(f"CREATE SCHEMA {schema}"))
+        else:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+    yield test_engine
+    async with test_engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+    await test_engine.dispose()
+    if url.get_backend_name() == "sqlite":
+        Path(url.database).unlink()
+
+
+@pytest.fixture()
+async def connection(
+    engine: AsyncEngine,
+) -> AsyncGenerator[AsyncConnection, None]:
+    """Connection in a transaction that is rolled back after the test."""
     async with engine.connect() as conn:
+        transaction = await conn.begin()
+        if conn.dialect.name == "postgresql":
+            # Sequences ignore rollbacks; tests expect ids to start at 1.
+            await conn.execute(
+                text(
+                    "SELECT setval(oid, 1, false) FROM pg_class "
+                    "WHERE relkind = 'S' "
+                    "AND relnamespace = CAST(current_schema() AS regnamespace)"
+                )
+            )
         yield conn
+        if transaction.is_active:
+            await transaction.rollback()
 
 
 @pytest.fixture()
-async def setup_database(connection: AsyncConnection) -> None:
-    from app.models.category import Category  # noqa
-    from app.models.product import Product  # noqa
-    from app.models.user import User  # noqa
-
-    await connection.run_sync(SQLModel.metadata.create_all)
+def captured_queries(
+    connection: AsyncConnection,
+) -> Generator[List[str], None, None]:
+    """Collect every SQL statement sent through the test connection."""
+    statements: List[str] = []
+
+    def before_cursor_execute(  # type: ignore
+        conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        if not is_savepoint(statement):
+            statements.append(statement)
+
+    event.listen(
+        connection.sync_engine, "before_cursor_execute", before_cursor_execute
+    )
+    yield statements
+    event.remove(
+        connection.sync_engine, "before_cursor_execute", before_cursor_execute
+    )
 
 
 @pytest.fixture
 async def session(
-    setup_database: None, connection: Engine
-) -> AsyncGenerator[Session, None]:
-    """Override the get_session function to return a scoped session."""
-    transaction = connection.begin()
+    connection: AsyncConnection,
+) -> AsyncGenerator[AsyncSession, None]:
+    """Session for the test and the app, isolated by a savepoint.
+
+    A commit releases the savepoint and a rollback returns to it; either
+    way a new one is started, and the test's transaction is rolled back.
+    """
+    await connection.begin_nested()
     session_local = sessionmaker(
         bind=connection,
         class_=AsyncSession,
@@ -61,17 +157,52 @@ async def session(
     )
 
     async with session_local() as session:
-        session.begin_nested()
+
+        @event.listens_for(session.sync_session, "after_transaction_end")
+        def restart_savepoint(  # type: ignore
+            sync_session, transaction
+        ) -> None:
+            sync_connection = connection.sync_connection
+            if (
+                sync_connection is not None
+                and not sync_connection.closed
+                and not sync_connection.in_nested_transaction()
+            ):
+                sync_connection.begin_nested()
+
         yield session
-        await session.rollback()
-    transaction.rollback()
 
 
 @pytest.fixture()
-def client(session: Session) -> Generator[TestClient, None, None]:
+def query_budget(
+    connection: AsyncConnection,
+) -> Generator[None, None, None]:
+    """Hold every request made through the app to its route's budget."""
+    from app.main import app
+
+    event.listen(
+        connection.sync_engine, "before_cursor_execute", record_statement
+    )
+    middleware_stack = app.middleware_stack
+    app.middleware_stack = QueryBudgetMiddleware(middleware_stack)
+    yield
+    app.middleware_stack = middleware_stack
+    event.remove(
+        connection.sync_engine, "before_cursor_execute", record_statement
+    )
+
+
+@pytest.fixture()
+def client(
+    session: AsyncSession, query_budget: None
+) -> Generator[TestClient, None, None]:
     from app.main import app
 
     app.dependency_overrides[db.get_session] = lambda: session
+    app.dependency_overrides[db.get_read_session] = lambda: session
+    # Every test starts from an empty database, so ids are reused.
+    product_cache.clear()
+    idempotency_cache.clear()
 
     with TestClient(app) as client:
         try:
@@ -188,7 +319,9 @@ async def insert_products(
         await session.execute(
             Product.__table__.insert().values(**product_create_payload.dict())
         )
-    result = await session.execute(select(Product))
+    result = await session.execute(
+        select(Product).options(joinedload(Product.category))
+    )
     await session.commit()
     products = result.scalars().all()
 
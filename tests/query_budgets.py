@@ -0,0 +1,122 @@
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.metrics import route_template
+from app.settings import settings
+
+# Most statements a single request may run, per method and route template.
+# Budgets cover the worst case the tests exercise, e.g. the first cart add
+# that also creates the demo user, not only the common path.
+QUERY_BUDGETS: Dict[Tuple[str, str], int] = {
+    ("GET", "/"): 0,
+    ("GET", "/cache_stats"): 0,
+    ("GET", "/db_pool"): 0,
+    ("GET", "/db_ready"): 0,
+    ("GET", "/metrics"): 0,
+    # A listing sorted by a nullable column reads the NULL rows with a
+    # second query once the seek runs past the last value.
+    ("GET", "/users/"): 2,
+    ("GET", "/users/{user_id}"): 1,
+    ("POST", "/users/"): 2,
+    ("DELETE", "/users/{user_id}"): 2,
+    ("GET", "/products/categories/"): 2,
+    ("GET", "/products/categories/{category_id}"): 1,
+    ("POST", "/products/categories/"): 2,
+    ("PUT", "/products/categories/{category_id}"): 3,
+    ("DELETE", "/products/categories/{category_id}"): 2,
+    ("GET", "/products/"): 2,
+    ("GET", "/products/search"): 1,
+    ("GET", "/products/export"): 1,
+    ("GET", "/products/{product_id}/"): 1,
+    ("POST", "/products/"): 2,
+    ("PUT", "/products/{product_id}/"): 2,
+    ("DELETE", "/products/{product_id}/"): 2,
+    # Up to four queries per chunk: names, categories, the insert and the
+    # id read-back. The tests send at most three chunks without categories.
+    ("POST", "/products/bulk"): 9,
+    ("GET", "/carts/"): 3,
+    # Both writes that take an Idempotency-Key claim it first and store
+    # the response last, two queries on top of their own.
+    ("POST", "/carts/add"): 7,
+    ("DELETE", "/carts/{cart_item_id}"): 6,
+    ("GET", "/orders/"): 2,
+    ("GET", "/orders/export"): 1,
+    ("GET", "/orders/{order_id}"): 2,
+    # Checkout locks, decrements, writes the order and re-reads it.
+    ("POST", "/orders/"): 12,
+}
+
+if settings.DB_BACKEND == "sqlite":
+    # Without RETURNING the cart id is read back with a query of its own.
+    QUERY_BUDGETS[("POST", "/carts/add")] += 1
+
+current_statements: ContextVar[Optional[List[str]]] = ContextVar(
+    "current_statements", default=None
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def is_savepoint(statement: str) -> bool:
+    """Savepoints isolate the tests; they are not queries of the app."""
+    return statement.startswith(
+        ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+    )
+
+
+def record_statement(  # type: ignore
+    conn, cursor, statement, parameters, context, executemany
+) -> None:
+    statements = current_statements.get()
+    if statements is not None and not is_savepoint(statement):
+        statements.append(statement)
+
+
+def check_budget(method: str, route: str, statements: List[str]) -> None:
+    budget = QUERY_BUDGETS.get((method, route))
+    if budget is None:
+        raise QueryBudgetExceeded(
+            f"{method} {route} has no query budget; add one to "
+            f"tests/query_budgets.py."
+        )
+    if len(statements) > budget:
+        listing = "\n".join(
+            f"  {i}. {' '.join(statement.split())}"
+            for i, statement in enumerate(statements, start=1)
+        )
+        raise QueryBudgetExceeded(
+            f"{method} {route} ran {len(statements)} queries, "
+            f"its budget is {budget}:\n{listing}"
+        )
+
+
+class QueryBudgetMiddleware:
+    """Fail a request that runs more statements than its route's budget.
+
+    Only statements sent while the request is handled count, so fixtures
+    that seed the database around it do not.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        statements: List[str] = []
+        token = current_statements.set(statements)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_statements.reset(token)
+        route = route_template(scope)
+        if route != "unmatched":
+            check_budget(scope["method"], route, statements)
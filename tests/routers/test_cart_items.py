@@ -1,20 +1,27 @@
 from random import randint
-from typing import Optional
+from typing import List, Optional
 
 import faker_commerce
 import pytest
 
 from faker import Faker
 from httpx import AsyncClient, Response
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.testclient import TestClient
 
+from app.idempotency import (
+    IDEMPOTENCY_KEY_HEADER,
+    IDEMPOTENT_REPLAYED_HEADER,
+    idempotency_cache,
+)
 from app.models.cart import CartDisplay
 from app.models.category import Category
-from app.models.product import Product
+from app.models.product import Product, ProductDisplay
 from app.routers.cart import router as cart_router
+from app.settings import settings
+from tests.conftest import insert_products
 
 
 @pytest.mark.asyncio
@@ -169,7 +176,8 @@ async def test_listing_all_cart_items_in_cart(
     )
     session.add(category)
     await session.commit()
-    for _ in range(randint(2, 10)):
+    add_count = randint(2, 10)
+    for _ in range(add_count):
         async with AsyncClient(app=client.app, base_url="http://test") as ac:
             response: Response = await ac.post(
                 url=f"{cart_router.prefix}/add?product_id=1",
@@ -184,7 +192,11 @@ async def test_listing_all_cart_items_in_cart(
     cart = CartDisplay(**response.json())
     assert cart.id is not None, "Cart id is not set"
     assert cart.cart_items is not None, "Cart items is not set"
-    assert len(cart.cart_items) > 1, "Cart items is not set"
+    assert len(cart.cart_items) == 1, "Adds should share one cart item"
+    assert cart.cart_items[0].quantity == add_count
+    product = response.json()["cart_items"][0]["product"]
+    assert set(product) == set(ProductDisplay.__fields__)
+    assert product["category"]["name"] == category.name
 
 
 @pytest.mark.asyncio
@@ -242,3 +254,135 @@ async def test_removing_cart_item_from_cart(
     assert (
         len(cart.cart_items) == cart_item_count - 1
     ), "Cart item was not removed"
+
+
+@pytest.mark.asyncio
+async def test_listing_cart_items_query_count(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=5, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for product in products:
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={product.id}",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+
+        captured_queries.clear()
+        response = await ac.get(url=f"{cart_router.prefix}/")
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()["cart_items"]) == len(products)
+    # demo user, cart, cart items joined with their products
+    assert len(captured_queries) == 3, captured_queries
+
+
+@pytest.mark.asyncio
+async def test_adding_product_into_cart_query_count(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=2, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        # The first add also creates the demo user.
+        response: Response = await ac.post(
+            url=f"{cart_router.prefix}/add?product_id={products[0].id}",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+        captured_queries.clear()
+        for product in products:
+            response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={product.id}"
+                f"&quantity=3",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+        # cart upsert and cart item upsert per add, and reading the cart
+        # id back where the upsert cannot return it
+        per_add = 2 if settings.DB_BACKEND == "postgresql" else 3
+        assert len(captured_queries) == per_add * len(
+            products
+        ), captured_queries
+
+        response = await ac.get(url=f"{cart_router.prefix}/")
+    quantities = {
+        item["product"]["id"]: item["quantity"]
+        for item in response.json()["cart_items"]
+    }
+    assert quantities == {products[0].id: 4, products[1].id: 3}
+
+
+@pytest.mark.asyncio
+async def test_adding_product_into_cart_with_idempotency_key(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=2, fake=faker
+    )
+    url = f"{cart_router.prefix}/add?product_id={products[0].id}&quantity=2"
+    headers = {IDEMPOTENCY_KEY_HEADER: faker.uuid4()}
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        first: Response = await ac.post(url=url, headers=headers)
+        assert first.status_code == status.HTTP_201_CREATED
+        assert IDEMPOTENT_REPLAYED_HEADER not in first.headers
+
+        # Replayed from the worker's cache, then from the database.
+        captured_queries.clear()
+        cached: Response = await ac.post(url=url, headers=headers)
+        assert captured_queries == []
+        idempotency_cache.clear()
+        stored: Response = await ac.post(url=url, headers=headers)
+        # the key insert that conflicts and reading the response
+        assert len(captured_queries) == 2, captured_queries
+
+        other: Response = await ac.post(
+            url=f"{cart_router.prefix}/add?product_id={products[1].id}",
+            headers=headers,
+        )
+        response: Response = await ac.get(url=f"{cart_router.prefix}/")
+
+    for replayed in (cached, stored):
+        assert replayed.status_code == first.status_code
+        assert replayed.content == first.content
+        assert replayed.headers[IDEMPOTENT_REPLAYED_HEADER] == "true"
+    assert other.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert [
+        (item["product"]["id"], item["quantity"])
+        for item in response.json()["cart_items"]
+    ] == [(products[0].id, 2)]
+
+
+@pytest.mark.asyncio
+async def test_failed_add_does_not_keep_idempotency_key(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    await session.execute(update(Product).values(quantity=0))
+    await session.commit()
+    url = f"{cart_router.prefix}/add?product_id={products[0].id}"
+    headers = {IDEMPOTENCY_KEY_HEADER: faker.uuid4()}
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.post(url=url, headers=headers)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+        await session.execute(update(Product).values(quantity=1))
+        await session.commit()
+        response = await ac.post(url=url, headers=headers)
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert IDEMPOTENT_REPLAYED_HEADER not in response.headers
@@ -6,13 +6,16 @@ import pytest
 
 from faker import Faker
 from httpx import AsyncClient, Response
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.testclient import TestClient
 
 from app.models.category import Category, CategoryCreate, CategoryDisplay
+from app.models.product import Product
+from app.pagination import NEXT_CURSOR_HEADER
 from app.routers.category import router as category_router
-from tests.conftest import insert_categories
+from tests.conftest import insert_categories, insert_products
 
 
 @pytest.mark.asyncio
@@ -56,7 +59,7 @@ async def test_get_all_categories(
     session: AsyncSession,
     faker: Faker,
 ) -> None:
-    category_count = randint(3, 82)
+    category_count = randint(3, 49)
     categories_in_db: List[Category] = await insert_categories(
         session=session, count=category_count, fake=faker
     )
@@ -107,6 +110,31 @@ async def test_get_all_categories(
         assert response_json["id"] is not None, "Id should be present"
 
 
+@pytest.mark.asyncio
+async def test_get_all_categories_with_cursor(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    categories_in_db: List[Category] = await insert_categories(
+        session=session, count=randint(5, 30), fake=faker
+    )
+
+    page_ids: List[int] = []
+    url = f"{category_router.prefix}/?limit=3&sort=name"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.get(url=url)
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            page_ids.extend(c["id"] for c in response.json())
+            next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if next_cursor is None:
+                break
+            response = await ac.get(url=f"{url}&cursor={next_cursor}")
+
+    assert sorted(page_ids) == sorted(c.id for c in categories_in_db)
+
+
 @pytest.mark.asyncio
 async def test_category_create(
     client: TestClient,
@@ -186,6 +214,30 @@ async def test_category_delete(
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
 
+@pytest.mark.asyncio
+async def test_category_delete_keeps_its_products(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products = await insert_products(session=session, count=5, fake=faker)
+    category_id = products[0].category_id
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.delete(
+            url=f"{category_router.prefix}/{category_id}",
+        )
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    result = await session.execute(
+        select(Product.id, Product.category_id).order_by(Product.id)
+    )
+    assert result.all() == sorted((p.id, None) for p in products)
+    result = await session.execute(
+        select(Category).where(Category.id == category_id)
+    )
+    assert result.scalars().first() is None
+
+
 @pytest.mark.asyncio
 async def test_category_delete_non_existing(
     client: TestClient,
@@ -211,3 +263,84 @@ async def test_category_update_non_existing(
             json={"name": faker.ecommerce_category()},
         )
     assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_get_all_categories_query_count(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    await insert_products(session=session, count=10, fake=faker)
+
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        captured_queries.clear()
+        response: Response = await ac.get(url=f"{category_router.prefix}/")
+        assert response.status_code == status.HTTP_200_OK
+        assert len(captured_queries) == 1, captured_queries
+
+        captured_queries.clear()
+        response = await ac.get(
+            url=f"{category_router.prefix}/{response.json()[0]['id']}"
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert len(captured_queries) == 1, captured_queries
+
+
+@pytest.mark.asyncio
+async def test_category_conditional_requests(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    categories: List[Category] = await insert_categories(
+        session=session, count=2, fake=faker
+    )
+    listing_url = f"{category_router.prefix}/"
+    detail_url = f"{category_router.prefix}/{categories[0].id}"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        etags = {}
+        for url in (listing_url, detail_url):
+            response: Response = await ac.get(url=url)
+            etags[url] = response.headers["ETag"]
+            response = await ac.get(
+                url=url, headers={"If-None-Match": etags[url]}
+            )
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        await ac.put(url=detail_url, json={"name": "Renamed category"})
+
+        for url in (listing_url, detail_url):
+            response = await ac.get(
+                url=url, headers={"If-None-Match": etags[url]}
+            )
+            assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_get_all_categories_with_counts(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    products = await insert_products(session=session, count=5, fake=faker)
+    category_id = products[0].category_id
+
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.get(url=f"{category_router.prefix}/")
+        assert all("product_count" not in c for c in response.json())
+
+        captured_queries.clear()
+        response = await ac.get(
+            url=f"{category_router.prefix}/", params={"with_counts": True}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert len(captured_queries) == 1, captured_queries
+        assert "GROUP BY" in captured_queries[0]
+
+    counts = {c["id"]: c["product_count"] for c in response.json()}
+    assert len(counts) == 5
+    assert counts.pop(category_id) == 5
+    assert set(counts.values()) == {0}
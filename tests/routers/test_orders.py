@@ -1,21 +1,42 @@
+import asyncio
+import json
+import random
+import time
+
+from datetime import datetime
 from random import randint
-from typing import List
+from typing import Any, Dict, List
 
 import faker_commerce
 import pytest
 
 from faker import Faker
+from fastapi import HTTPException
 from httpx import AsyncClient, Response
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
 from starlette import status
 from starlette.testclient import TestClient
 
 from app.constants import OrderStatus
+from app.idempotency import IDEMPOTENCY_KEY_HEADER, IDEMPOTENT_REPLAYED_HEADER
+from app.models.cart import Cart, CartItem
 from app.models.category import Category
-from app.models.order import OrderDisplay
+from app.models.order import (
+    Order,
+    OrderDetails,
+    OrderDisplay,
+    OrderSummary,
+)
 from app.models.product import Product
+from app.models.user import User
+from app.pagination import NEXT_CURSOR_HEADER, encode_cursor
 from app.routers.cart import router as cart_router
-from app.routers.order import router as order_router
+from app.routers.order import checkout_cart, router as order_router
+from app.settings import settings
+from tests.conftest import insert_products, postgres_only
 
 
 @pytest.mark.asyncio
@@ -36,7 +57,7 @@ async def test_initiate_order_processing(
                 price=faker.pydecimal(
                     left_digits=4, right_digits=2, positive=True
                 ),
-                quantity=faker.random_int(min=1, max=10),
+                quantity=faker.random_int(min=10, max=20),
             )
         ],
     )
@@ -89,14 +110,15 @@ async def test_get_all_orders(
                 price=faker.pydecimal(
                     left_digits=4, right_digits=2, positive=True
                 ),
-                quantity=faker.random_int(min=1, max=10),
+                quantity=faker.random_int(min=10, max=20),
             )
         ],
     )
     session.add(category)
     await session.commit()
     await session.refresh(category)
-    for _ in range(randint(1, 10)):
+    add_count = randint(1, 10)
+    for _ in range(add_count):
         async with AsyncClient(app=client.app, base_url="http://test") as ac:
             response: Response = await ac.post(
                 url=f"{cart_router.prefix}/add?product_id=1",
@@ -121,7 +143,638 @@ async def test_get_all_orders(
         )
 
     assert response.status_code == status.HTTP_200_OK
-    orders: List[OrderDisplay] = [
-        OrderDisplay(**order) for order in response.json()
+    orders: List[OrderSummary] = [
+        OrderSummary(**order) for order in response.json()
     ]
     assert len(orders) == 1
+    assert orders[0].item_count == add_count
+
+
+@pytest.mark.asyncio
+async def test_get_all_orders_query_count(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=5, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for _ in range(2):
+            for product in products:
+                response: Response = await ac.post(
+                    url=f"{cart_router.prefix}/add?product_id={product.id}",
+                )
+                assert response.status_code == status.HTTP_201_CREATED
+            response = await ac.post(url=f"{order_router.prefix}/")
+            assert response.status_code == status.HTTP_201_CREATED
+
+        captured_queries.clear()
+        response = await ac.get(url=f"{order_router.prefix}/")
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()) == 2
+    # demo user, orders aggregated over their lines
+    assert len(captured_queries) == 2, captured_queries
+
+    order_id = response.json()[0]["id"]
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        captured_queries.clear()
+        response = await ac.get(url=f"{order_router.prefix}/{order_id}")
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()["order_details"]) == len(products)
+    # order joined with its user, order details joined with their products
+    # and categories
+    assert len(captured_queries) == 2, captured_queries
+
+
+@pytest.mark.asyncio
+async def test_order_decrements_stock_and_clears_cart(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=2, fake=faker
+    )
+    stock = {product.id: product.quantity for product in products}
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for product in products:
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={product.id}"
+                f"&quantity=1",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+        response = await ac.post(url=f"{order_router.prefix}/")
+        assert response.status_code == status.HTTP_201_CREATED
+        order = OrderDisplay(**response.json())
+        cart = await ac.get(url=f"{cart_router.prefix}/")
+
+    assert cart.json()["cart_items"] == []
+    assert order.order_amount == pytest.approx(
+        sum(product.price for product in products)
+    )
+    assert {d.product_id: d.quantity for d in order.order_details} == {
+        product.id: 1 for product in products
+    }
+    result = await session.execute(
+        select(Product.id, Product.quantity).execution_options(
+            populate_existing=True
+        )
+    )
+    assert dict(result.all()) == {
+        product_id: quantity - 1 for product_id, quantity in stock.items()
+    }
+
+
+@pytest.mark.asyncio
+async def test_order_lines_keep_price_snapshot(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=2, fake=faker
+    )
+    prices = {product.id: product.price for product in products}
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for product in products:
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={product.id}"
+                f"&quantity=2",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+        captured_queries.clear()
+        response = await ac.post(url=f"{order_router.prefix}/")
+        assert response.status_code == status.HTTP_201_CREATED
+        checkout_queries = [
+            query
+            for query in captured_queries
+            if query.startswith("INSERT INTO order")
+        ]
+
+        order_id = response.json()["id"]
+
+        await session.execute(update(Product).values(price=Product.price * 3))
+        await session.commit()
+        response = await ac.get(url=f"{order_router.prefix}/{order_id}")
+
+    # The order and all of its lines are written by one statement each.
+    assert len(checkout_queries) == 2, checkout_queries
+    order = OrderDisplay(**response.json())
+    assert order.order_amount == pytest.approx(2 * sum(prices.values()))
+    assert {d.product_id: d.unit_price for d in order.order_details} == (
+        pytest.approx(prices)
+    )
+
+
+@pytest.mark.asyncio
+async def test_order_with_out_of_stock_items(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=2, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for product in products:
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={product.id}",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+        # Someone else buys the last units of the second product.
+        await session.execute(
+            update(Product)
+            .where(Product.id == products[1].id)
+            .values(quantity=0)
+        )
+        await session.commit()
+
+        response = await ac.post(url=f"{order_router.prefix}/")
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.json() == {
+            "detail": f"Products with ids [{products[1].id}] "
+            f"are out of stock.",
+        }
+        cart = await ac.get(url=f"{cart_router.prefix}/")
+    assert len(cart.json()["cart_items"]) == 2
+
+    result = await session.execute(select(func.count(Order.id)))
+    assert result.scalar_one() == 0
+
+
+@pytest.mark.asyncio
+async def test_order_with_more_in_cart_than_in_stock(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=2, fake=faker
+    )
+    await session.execute(update(Product).values(quantity=5))
+    await session.commit()
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for product in products:
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={product.id}"
+                f"&quantity=3",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+        # Only two of the three units in the cart are left.
+        await session.execute(
+            update(Product)
+            .where(Product.id == products[0].id)
+            .values(quantity=2)
+        )
+        await session.commit()
+
+        response = await ac.post(url=f"{order_router.prefix}/")
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json() == {
+        "detail": f"Products with ids [{products[0].id}] are out of stock.",
+    }
+    result = await session.execute(
+        select(Product.id, Product.quantity).execution_options(
+            populate_existing=True
+        )
+    )
+    assert dict(result.all()) == {products[0].id: 2, products[1].id: 5}
+    result = await session.execute(select(func.count(Order.id)))
+    assert result.scalar_one() == 0
+
+
+@pytest.mark.asyncio
+async def test_order_with_empty_cart(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    await session.execute(update(Product).values(quantity=5))
+    await session.commit()
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.post(
+            url=f"{cart_router.prefix}/add?product_id={products[0].id}",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        first: Response = await ac.post(url=f"{order_router.prefix}/")
+        second: Response = await ac.post(url=f"{order_router.prefix}/")
+
+    assert first.status_code == status.HTTP_201_CREATED
+    assert second.status_code == status.HTTP_404_NOT_FOUND
+    assert second.json() == {"detail": "Cart is empty."}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_orders_with_idempotency_key_are_placed_once(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    await session.execute(update(Product).values(quantity=10))
+    await session.commit()
+    headers = {IDEMPOTENCY_KEY_HEADER: faker.uuid4()}
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.post(
+            url=f"{cart_router.prefix}/add?product_id={products[0].id}"
+            f"&quantity=3",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+        # A client retrying before the first attempt has been answered.
+        responses: List[Response] = await asyncio.gather(
+            *(
+                ac.post(url=f"{order_router.prefix}/", headers=headers)
+                for _ in range(3)
+            )
+        )
+
+    assert [r.status_code for r in responses] == [status.HTTP_201_CREATED] * 3
+    assert len({r.content for r in responses}) == 1
+    assert sorted(
+        r.headers.get(IDEMPOTENT_REPLAYED_HEADER, "") for r in responses
+    ) == ["", "true", "true"]
+    result = await session.execute(select(func.count(Order.id)))
+    assert result.scalar_one() == 1
+    result = await session.execute(
+        select(Product.quantity).execution_options(populate_existing=True)
+    )
+    assert result.scalar_one() == 7
+
+
+@postgres_only
+@pytest.mark.asyncio
+async def test_concurrent_checkouts_never_oversell() -> None:
+    """Hundreds of checkouts race for a few products on real connections."""
+    schema = "test_concurrent_checkouts"
+    checkouts, product_count, initial_stock = 300, 5, 40
+    admin_engine = create_async_engine(settings.SQLALCHEMY_DATABASE_URI)
+    async with admin_engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {schema}"))
+    engine = create_async_engine(
+        settings.SQLALCHEMY_DATABASE_URI,
+        pool_size=20,
+        max_overflow=0,
+        connect_args={"server_settings": {"search_path": schema}},
+    )
+    try:
+        rng = random.Random(42)
+        wanted: Dict[int, Dict[int, int]] = {
+            user_id: {
+                product_id: rng.randint(1, 3)
+                for product_id in rng.sample(
+                    range(1, product_count + 1), rng.randint(1, 3)
+                )
+            }
+            for user_id in range(1, checkouts + 1)
+        }
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+            await conn.execute(
+                Product.__table__.insert(),
+                [
+                    dict(
+                        id=i,
+                        name=f"Product {i}",
+                        price=2.5,
+                        quantity=initial_stock,
+                    )
+                    for i in range(1, product_count + 1)
+                ],
+            )
+            await conn.execute(
+                User.__table__.insert(),
+                [
+                    dict(
+                        id=user_id,
+                        name=f"User {user_id}",
+                        email=f"user{user_id}@example.com",
+                        password="",
+                        is_active=True,
+                    )
+                    for user_id in wanted
+                ],
+            )
+            await conn.execute(
+                Cart.__table__.insert(),
+                [dict(id=user_id, user_id=user_id) for user_id in wanted],
+            )
+            await conn.execute(
+                CartItem.__table__.insert(),
+                [
+                    dict(cart_id=user_id, product_id=pid, quantity=quantity)
+                    for user_id, items in wanted.items()
+                    for pid, quantity in items.items()
+                ],
+            )
+
+        session_local = sessionmaker(
+            bind=engine, class_=AsyncSession, expire_on_commit=False
+        )
+        outcomes: List[int] = []
+
+        async def checkout(user_id: int) -> None:
+            async with session_local() as session:
+                try:
+                    await checkout_cart(session, user_id)
+                    await session.commit()
+                except HTTPException as e:
+                    outcomes.append(e.status_code)
+                else:
+                    outcomes.append(status.HTTP_201_CREATED)
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(checkout(user_id) for user_id in wanted))
+        elapsed = time.perf_counter() - started_at
+
+        async with engine.connect() as conn:
+            stock = dict(
+                (
+                    await conn.execute(select(Product.id, Product.quantity))
+                ).all()
+            )
+            sold = dict(
+                (
+                    await conn.execute(
+                        select(
+                            OrderDetails.product_id,
+                            func.sum(OrderDetails.quantity),
+                        ).group_by(OrderDetails.product_id)
+                    )
+                ).all()
+            )
+            order_count = (
+                await conn.execute(select(func.count(Order.id)))
+            ).scalar_one()
+    finally:
+        await engine.dispose()
+        async with admin_engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        await admin_engine.dispose()
+
+    succeeded = outcomes.count(status.HTTP_201_CREATED)
+    assert len(outcomes) == checkouts
+    assert set(outcomes) <= {status.HTTP_201_CREATED, status.HTTP_409_CONFLICT}
+    assert order_count == succeeded > 0
+    for product_id, quantity in stock.items():
+        assert quantity >= 0
+        assert quantity + sold.get(product_id, 0) == initial_stock
+    print(
+        json.dumps(
+            {
+                "checkouts": checkouts,
+                "succeeded": succeeded,
+                "out_of_stock": checkouts - succeeded,
+                "elapsed": elapsed,
+                "checkouts_per_second": checkouts / elapsed,
+            }
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_all_orders_with_cursor(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for _ in range(5):
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={products[0].id}",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            response = await ac.post(url=f"{order_router.prefix}/")
+            assert response.status_code == status.HTTP_201_CREATED
+
+        order_ids: List[int] = []
+        cursor = None
+        while True:
+            params = (
+                {"limit": 2}
+                if cursor is None
+                else {"limit": 2, "cursor": cursor}
+            )
+            response = await ac.get(
+                url=f"{order_router.prefix}/", params=params
+            )
+            assert response.status_code == status.HTTP_200_OK
+            order_ids.extend(order["id"] for order in response.json())
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if cursor is None:
+                break
+
+    # Newest orders come first.
+    assert order_ids == sorted(order_ids, reverse=True)
+    assert len(order_ids) == 5
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sort", ["order_date", "-order_date"])
+async def test_get_all_orders_by_order_date_with_cursor(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    sort: str,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    await session.execute(update(Product).values(quantity=10))
+    await session.commit()
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for _ in range(4):
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={products[0].id}",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            response = await ac.post(url=f"{order_router.prefix}/")
+            assert response.status_code == status.HTTP_201_CREATED
+
+        # Out of id order, with a tie that the id has to break.
+        order_dates = {
+            1: datetime(2022, 7, 3, 12, 0, 0, 250000),
+            2: datetime(2022, 7, 1, 9, 30),
+            3: datetime(2022, 7, 3, 12, 0, 0, 250000),
+            4: datetime(2022, 7, 2, 18, 45),
+        }
+        for order_id, order_date in order_dates.items():
+            await session.execute(
+                update(Order)
+                .where(Order.id == order_id)
+                .values(order_date=order_date)
+            )
+        await session.commit()
+
+        pages: List[List[int]] = []
+        params: Dict[str, Any] = {"limit": 2, "sort": sort}
+        while True:
+            response = await ac.get(
+                url=f"{order_router.prefix}/", params=params
+            )
+            assert response.status_code == status.HTTP_200_OK
+            pages.append([order["id"] for order in response.json()])
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if cursor is None:
+                break
+            params = {"limit": 2, "sort": sort, "cursor": cursor}
+
+        invalid = await ac.get(
+            url=f"{order_router.prefix}/",
+            params={
+                "sort": sort,
+                "cursor": encode_cursor(sort, ["not a date", 1]),
+            },
+        )
+
+    expected = sorted(order_dates, key=lambda i: (order_dates[i], i))
+    if sort.startswith("-"):
+        expected.reverse()
+    assert pages == [expected[:2], expected[2:]]
+    assert invalid.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_orders_are_dated_when_placed(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    await session.execute(update(Product).values(quantity=10))
+    await session.commit()
+    order_ids: List[int] = []
+    order_dates: List[datetime] = []
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for _ in range(3):
+            await asyncio.sleep(0.01)
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={products[0].id}",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            response = await ac.post(url=f"{order_router.prefix}/")
+            assert response.status_code == status.HTTP_201_CREATED
+            order = OrderDisplay(**response.json())
+            order_ids.append(order.id)
+            order_dates.append(order.order_date)
+
+        listing: Response = await ac.get(
+            url=f"{order_router.prefix}/", params={"sort": "-order_date"}
+        )
+
+    # The requests of a test share its transaction, so the dates also
+    # have to differ from when that started.
+    assert order_dates == sorted(set(order_dates))
+    assert [order["id"] for order in listing.json()] == order_ids[::-1]
+
+
+@pytest.mark.asyncio
+async def test_get_non_existing_order(
+    client: TestClient,
+    session: AsyncSession,
+) -> None:
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.get(url=f"{order_router.prefix}/1")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "Order with id 1 does not exist."}
+
+
+@pytest.mark.asyncio
+async def test_export_orders(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for _ in range(3):
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={products[0].id}",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            response = await ac.post(url=f"{order_router.prefix}/")
+            assert response.status_code == status.HTTP_201_CREATED
+        shipped_id = response.json()["id"]
+        await session.execute(
+            update(Order)
+            .where(Order.id == shipped_id)
+            .values(status=OrderStatus.SHIPPED)
+        )
+        await session.commit()
+
+        url = f"{order_router.prefix}/export"
+        everything = await ac.get(url=url)
+        shipped = await ac.get(url=url, params={"status": "shipped"})
+
+    assert everything.status_code == status.HTTP_200_OK
+    assert everything.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in everything.text.splitlines()]
+    assert len(rows) == 3
+    assert {row["customer_id"] for row in rows} == {1}
+    assert [json.loads(line) for line in shipped.text.splitlines()] == [
+        row for row in rows if row["id"] == shipped_id
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_orders_in_date_windows(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    await session.execute(update(Product).values(quantity=10))
+    await session.commit()
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for _ in range(3):
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={products[0].id}",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            response = await ac.post(url=f"{order_router.prefix}/")
+            assert response.status_code == status.HTTP_201_CREATED
+        for order_id, day in ((1, 1), (2, 2), (3, 3)):
+            await session.execute(
+                update(Order)
+                .where(Order.id == order_id)
+                .values(order_date=datetime(2022, 7, day))
+            )
+        await session.commit()
+
+        async def export_ids(**params: str) -> List[int]:
+            response = await ac.get(
+                url=f"{order_router.prefix}/export", params=params
+            )
+            assert response.status_code == status.HTTP_200_OK
+            return [
+                json.loads(line)["id"] for line in response.text.splitlines()
+            ]
+
+        # Consecutive windows pick up every order exactly once.
+        first = await export_ids(until="2022-07-02T00:00:00")
+        second = await export_ids(
+            since="2022-07-02T00:00:00", until="2022-07-03T00:00:00"
+        )
+        third = await export_ids(since="2022-07-03T00:00:00")
+
+    assert (first, second, third) == ([1], [2], [3])
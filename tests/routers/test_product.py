@@ -1,18 +1,26 @@
+import json
+
+from datetime import datetime
 from random import randint
-from typing import List
+from typing import Any, Dict, List, Tuple
 
 import pytest
 
 from faker import Faker
 from httpx import AsyncClient, Response
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import event, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
 from starlette import status
 from starlette.testclient import TestClient
 
+from app.cache import product_cache
+from app.constants import BulkRowStatus
 from app.models.category import Category
 from app.models.product import Product, ProductCreate, ProductDisplay
+from app.pagination import NEXT_CURSOR_HEADER, encode_cursor
 from app.routers.product import router as product_router
-from tests.conftest import insert_categories, insert_products
+from app.settings import settings
+from tests.conftest import insert_categories, insert_products, postgres_only
 
 
 @pytest.mark.asyncio
@@ -56,7 +64,7 @@ async def test_get_all_products(
     session: AsyncSession,
     faker: Faker,
 ) -> None:
-    product_count = randint(3, 82)
+    product_count = randint(3, 49)
     products_in_db: List[Product] = await insert_products(
         session=session, count=product_count, fake=faker
     )
@@ -159,3 +167,868 @@ async def test_updating_product(
     assert updated_product.name == product_update_payload.name
     assert updated_product.description == product_update_payload.description
     assert updated_product.price == product_update_payload.price
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sort", ["id", "name", "-name"])
+async def test_get_all_products_with_cursor(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    sort: str,
+) -> None:
+    product_count = randint(5, 30)
+    products_in_db: List[Product] = await insert_products(
+        session=session, count=product_count, fake=faker
+    )
+
+    page_ids: List[int] = []
+    url = f"{product_router.prefix}/?limit=4&sort={sort}"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        single_page: Response = await ac.get(
+            url=f"{product_router.prefix}/?limit={product_count}&sort={sort}"
+        )
+        response: Response = await ac.get(url=url)
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            page_ids.extend(p["id"] for p in response.json())
+            next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if next_cursor is None:
+                break
+            response = await ac.get(url=f"{url}&cursor={next_cursor}")
+
+    assert sorted(page_ids) == sorted(p.id for p in products_in_db)
+    assert page_ids == [p["id"] for p in single_page.json()]
+    if sort == "id":
+        assert page_ids == sorted(page_ids)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sort", ["price", "-price"])
+@pytest.mark.parametrize("limit", [3, 4])
+async def test_get_all_products_with_cursor_past_null_prices(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    sort: str,
+    limit: int,
+) -> None:
+    products_in_db: List[Product] = await insert_products(
+        session=session, count=7, fake=faker
+    )
+    # With a limit of 4 the last priced product ends the first page.
+    unpriced_ids = [p.id for p in products_in_db[4:]]
+    await session.execute(
+        update(Product).where(Product.id.in_(unpriced_ids)).values(price=None)
+    )
+
+    pages: List[List[Dict[str, Any]]] = []
+    url = f"{product_router.prefix}/?limit={limit}&sort={sort}"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.get(url=url)
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            pages.append(response.json())
+            next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if next_cursor is None:
+                break
+            response = await ac.get(url=f"{url}&cursor={next_cursor}")
+
+    assert [len(page) for page in pages[:-1]] == [limit] * (len(pages) - 1)
+    listed = [p for page in pages for p in page]
+    prices = [p["price"] for p in listed[:4]]
+    assert prices == sorted(prices, reverse=sort.startswith("-"))
+    null_ids = [p["id"] for p in listed[4:] if p["price"] is None]
+    assert null_ids == sorted(unpriced_ids, reverse=sort.startswith("-"))
+    assert len(listed) == len(products_in_db)
+
+
+@pytest.mark.asyncio
+async def test_get_all_products_with_offset(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products_in_db: List[Product] = await insert_products(
+        session=session, count=7, fake=faker
+    )
+
+    page_ids: List[int] = []
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for offset in range(0, 10, 3):
+            response: Response = await ac.get(
+                url=f"{product_router.prefix}/?limit=3&offset={offset}"
+            )
+            assert response.status_code == status.HTTP_200_OK
+            page_ids.extend(p["id"] for p in response.json())
+
+    assert page_ids == sorted(p.id for p in products_in_db)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/products/?limit=0",
+        "/products/?offset=-1",
+        "/users/?limit=0",
+        "/products/categories/?limit=0",
+    ],
+)
+async def test_listings_reject_empty_pages(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    url: str,
+) -> None:
+    await insert_products(session=session, count=2, fake=faker)
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.get(url=url)
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_get_all_products_with_invalid_cursor(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        invalid_cursor: Response = await ac.get(
+            url=f"{product_router.prefix}/?cursor=not-a-cursor"
+        )
+        mismatched_cursor: Response = await ac.get(
+            url=f"{product_router.prefix}/?sort=name"
+            f"&cursor={encode_cursor('id', [1])}"
+        )
+        invalid_sort: Response = await ac.get(
+            url=f"{product_router.prefix}/?sort=description"
+        )
+
+    assert invalid_cursor.status_code == status.HTTP_400_BAD_REQUEST
+    assert mismatched_cursor.status_code == status.HTTP_400_BAD_REQUEST
+    assert invalid_sort.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_get_all_products_query_count(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=10, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for product in products[:3]:
+            response: Response = await ac.post(
+                url=f"/carts/add?product_id={product.id}"
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+
+        captured_queries.clear()
+        response = await ac.get(url=f"{product_router.prefix}/")
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) == len(products)
+        assert len(captured_queries) == 1, captured_queries
+
+        captured_queries.clear()
+        response = await ac.get(
+            url=f"{product_router.prefix}/{products[0].id}/"
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert len(captured_queries) == 1, captured_queries
+
+
+@pytest.mark.asyncio
+async def test_product_reads_are_cached(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=3, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        first_listing: Response = await ac.get(url=f"{product_router.prefix}/")
+        first_detail: Response = await ac.get(
+            url=f"{product_router.prefix}/{products[0].id}/"
+        )
+
+        captured_queries.clear()
+        second_listing: Response = await ac.get(
+            url=f"{product_router.prefix}/"
+        )
+        second_detail: Response = await ac.get(
+            url=f"{product_router.prefix}/{products[0].id}/"
+        )
+        assert captured_queries == [], "Cached reads should not hit the db"
+        assert second_listing.json() == first_listing.json()
+        assert second_detail.json() == first_detail.json()
+
+        stats: Response = await ac.get(url="/cache_stats")
+        assert stats.json()["products"]["hits"] >= 2
+
+
+@pytest.mark.asyncio
+async def test_product_writes_invalidate_cache(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    categories: List[Category] = await insert_categories(
+        session=session, count=1, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        created: Response = await ac.post(
+            url=f"{product_router.prefix}/",
+            json=ProductCreate(
+                name=faker.name(),
+                price=10,
+                category_id=categories[0].id,
+            ).dict(),
+        )
+        product_id = created.json()["id"]
+        listing: Response = await ac.get(url=f"{product_router.prefix}/")
+        assert [p["id"] for p in listing.json()] == [product_id]
+        await ac.get(url=f"{product_router.prefix}/{product_id}/")
+
+        # Creating a product refreshes the last page of the listing.
+        another: Response = await ac.post(
+            url=f"{product_router.prefix}/",
+            json=ProductCreate(name=faker.name(), price=20).dict(),
+        )
+        listing = await ac.get(url=f"{product_router.prefix}/")
+        assert [p["id"] for p in listing.json()] == [
+            product_id,
+            another.json()["id"],
+        ]
+
+        # Updating a product refreshes its detail and the listings with it.
+        new_name = faker.name()
+        await ac.put(
+            url=f"{product_router.prefix}/{product_id}/",
+            json={"name": new_name, "price": 15},
+        )
+        detail: Response = await ac.get(
+            url=f"{product_router.prefix}/{product_id}/"
+        )
+        listing = await ac.get(url=f"{product_router.prefix}/")
+        assert detail.json()["name"] == new_name
+        assert listing.json()[0]["name"] == new_name
+
+        # Renaming the category refreshes the listings that embed it.
+        await ac.put(
+            url=f"/products/categories/{categories[0].id}",
+            json={"name": "Renamed category"},
+        )
+        listing = await ac.get(url=f"{product_router.prefix}/")
+        assert listing.json()[0]["category"]["name"] == "Renamed category"
+
+        # Deleting a product drops it from the cached reads.
+        await ac.delete(url=f"{product_router.prefix}/{product_id}/")
+        detail = await ac.get(url=f"{product_router.prefix}/{product_id}/")
+        listing = await ac.get(url=f"{product_router.prefix}/")
+        assert detail.status_code == status.HTTP_404_NOT_FOUND
+        assert [p["id"] for p in listing.json()] == [another.json()["id"]]
+
+
+@pytest.mark.asyncio
+async def test_product_conditional_requests(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=3, fake=faker
+    )
+    detail_url = f"{product_router.prefix}/{products[0].id}/"
+    listing_url = f"{product_router.prefix}/"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for url in (detail_url, listing_url):
+            response: Response = await ac.get(url=url)
+            etag = response.headers["ETag"]
+
+            response = await ac.get(url=url, headers={"If-None-Match": etag})
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+            assert response.headers["ETag"] == etag
+            assert response.content == b""
+
+        listing_etag = (await ac.get(url=listing_url)).headers["ETag"]
+        detail_etag = (await ac.get(url=detail_url)).headers["ETag"]
+        await ac.put(url=detail_url, json={"name": faker.name()})
+
+        for url, etag in (
+            (detail_url, detail_etag),
+            (listing_url, listing_etag),
+        ):
+            response = await ac.get(url=url, headers={"If-None-Match": etag})
+            assert response.status_code == status.HTTP_200_OK
+            assert response.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_replica_reads_are_not_cached_after_writes(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        created: Response = await ac.post(
+            url=f"{product_router.prefix}/",
+            json=ProductCreate(name=faker.name(), price=10).dict(),
+        )
+        url = f"{product_router.prefix}/{created.json()['id']}/"
+
+        # A lagging replica may still return what the write replaced.
+        monkeypatch.setitem(session.info, "replica", True)
+        await ac.get(url=url)
+        captured_queries.clear()
+        await ac.get(url=url)
+        assert len(captured_queries) == 1
+
+        monkeypatch.delitem(session.info, "replica")
+        await ac.get(url=url)
+        captured_queries.clear()
+        await ac.get(url=url)
+        assert captured_queries == []
+
+
+@pytest.mark.asyncio
+async def test_product_conditional_requests_without_cache(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = await insert_products(
+        session=session, count=3, fake=faker
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for url in (
+            f"{product_router.prefix}/{products[0].id}/",
+            f"{product_router.prefix}/",
+        ):
+            response: Response = await ac.get(url=url)
+            etag = response.headers["ETag"]
+
+            # Evicted, so the ETag is built from the rows read again.
+            product_cache.clear()
+            response = await ac.get(url=url, headers={"If-None-Match": etag})
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+            assert response.headers["ETag"] == etag
+            assert response.content == b""
+
+
+@pytest.mark.asyncio
+async def test_create_products_bulk(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    existing: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    category_id = existing[0].category_id
+    payloads = [
+        {"name": "Lamp", "price": 9.5, "quantity": 2, "description": "Lit"},
+        {"name": "Chair", "price": 40, "category_id": category_id},
+        {"name": "Lamp", "price": 10},
+        {"name": existing[0].name, "price": 1},
+        {"name": "x" * 51},
+        {"name": "Table", "category_id": 10_000},
+        {"price": 3},
+    ]
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.post(
+            url=f"{product_router.prefix}/bulk", json=payloads
+        )
+        listing = await ac.get(url=f"{product_router.prefix}/")
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert [row["status"] for row in body["results"]] == [
+        BulkRowStatus.CREATED,
+        BulkRowStatus.CREATED,
+        BulkRowStatus.DUPLICATE,
+        BulkRowStatus.EXISTS,
+        BulkRowStatus.INVALID,
+        BulkRowStatus.INVALID,
+        BulkRowStatus.INVALID,
+    ]
+    assert (body["received"], body["created"]) == (7, 2)
+    assert (body["skipped"], body["invalid"]) == (2, 3)
+    assert body["rows_per_second"] > 0
+    assert body["results"][4]["errors"][0]["loc"] == ["name"]
+    assert body["results"][5]["errors"][0]["loc"] == ["category_id"]
+
+    stored = {product["name"]: product for product in listing.json()}
+    assert set(stored) == {existing[0].name, "Lamp", "Chair"}
+    assert stored["Lamp"]["id"] == body["results"][0]["id"]
+    assert stored["Lamp"]["price"] == 9.5
+    assert stored["Chair"]["category"]["id"] == category_id
+
+
+@pytest.mark.asyncio
+async def test_create_products_bulk_without_new_rows(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    existing: List[Product] = await insert_products(
+        session=session, count=1, fake=faker
+    )
+    payloads = [
+        {"name": existing[0].name, "price": 1},
+        {"name": existing[0].name, "price": 2},
+        {"name": "Table", "category_id": 10_000},
+    ]
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        captured_queries.clear()
+        response: Response = await ac.post(
+            url=f"{product_router.prefix}/bulk", json=payloads
+        )
+        bulk_queries = list(captured_queries)
+        malformed: Response = await ac.post(
+            url=f"{product_router.prefix}/bulk",
+            content=b'[{"name": "Lamp"',
+            headers={"Content-Type": "application/json"},
+        )
+        listing = await ac.get(url=f"{product_router.prefix}/")
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert [row["status"] for row in body["results"]] == [
+        BulkRowStatus.EXISTS,
+        BulkRowStatus.DUPLICATE,
+        BulkRowStatus.INVALID,
+    ]
+    assert [row["id"] for row in body["results"]] == [None, None, None]
+    assert (body["created"], body["skipped"], body["invalid"]) == (0, 2, 1)
+    # The names and the categories are checked; nothing is inserted.
+    assert not any(q.startswith("INSERT") for q in bulk_queries)
+    assert malformed.status_code == status.HTTP_400_BAD_REQUEST
+    assert malformed.json()["detail"].startswith("Invalid JSON")
+    assert [p["id"] for p in listing.json()] == [existing[0].id]
+
+
+@pytest.mark.asyncio
+async def test_create_products_bulk_ndjson_in_chunks(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "PRODUCT_BULK_CHUNK_SIZE", 4)
+    lines = [
+        json.dumps({"name": f"Product {i}", "price": i, "quantity": i})
+        for i in range(10)
+    ]
+    lines.insert(3, "{not json")
+    body = "\n".join(lines).encode()
+
+    async def stream():  # type: ignore
+        for start in range(0, len(body), 7):
+            yield body[start : start + 7]
+
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        captured_queries.clear()
+        response: Response = await ac.post(
+            url=f"{product_router.prefix}/bulk",
+            content=stream(),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert (body["received"], body["created"], body["invalid"]) == (11, 10, 1)
+    assert body["results"][3]["status"] == BulkRowStatus.INVALID
+    ids = [row["id"] for row in body["results"] if row["id"] is not None]
+    assert len(set(ids)) == 10
+    # Three chunks of names check, insert and id lookup, no per-row queries.
+    inserts = [q for q in captured_queries if q.startswith("INSERT")]
+    assert len(inserts) == 3, captured_queries
+    assert len(captured_queries) == 9, captured_queries
+
+
+@pytest.mark.asyncio
+async def test_create_products_bulk_limits(
+    client: TestClient,
+    session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "PRODUCT_BULK_MAX_ROWS", 2)
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        too_many: Response = await ac.post(
+            url=f"{product_router.prefix}/bulk",
+            json=[{"name": f"Product {i}"} for i in range(3)],
+        )
+        not_a_list: Response = await ac.post(
+            url=f"{product_router.prefix}/bulk", json={"name": "Lamp"}
+        )
+        listing: Response = await ac.get(url=f"{product_router.prefix}/")
+
+    assert too_many.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert not_a_list.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert listing.json() == []
+
+
+@pytest.mark.asyncio
+async def test_export_products(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = sorted(
+        await insert_products(session=session, count=5, fake=faker),
+        key=lambda product: product.id,
+    )
+    await session.execute(
+        update(Product).where(Product.id == products[0].id).values(quantity=0)
+    )
+    await session.commit()
+    url = f"{product_router.prefix}/export"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        everything: Response = await ac.get(url=url)
+        in_stock: Response = await ac.get(url=url, params={"in_stock": True})
+        none: Response = await ac.get(
+            url=url, params={"since": "2999-01-01T00:00:00"}
+        )
+
+    assert everything.status_code == status.HTTP_200_OK
+    assert everything.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in everything.text.splitlines()]
+    assert [row["id"] for row in rows] == [p.id for p in products]
+    assert rows[1]["name"] == products[1].name
+    assert rows[1]["price"] == products[1].price
+    assert [json.loads(line)["id"] for line in in_stock.text.splitlines()] == [
+        product.id for product in products[1:]
+    ]
+    assert none.text == ""
+
+
+@pytest.mark.asyncio
+async def test_export_products_in_date_windows(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    products: List[Product] = sorted(
+        await insert_products(session=session, count=3, fake=faker),
+        key=lambda product: product.id,
+    )
+    for day, product in enumerate(products, start=1):
+        await session.execute(
+            update(Product)
+            .where(Product.id == product.id)
+            .values(updated_at=datetime(2022, 7, day))
+        )
+    await session.commit()
+
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+
+        async def export_ids(**params: str) -> List[int]:
+            response = await ac.get(
+                url=f"{product_router.prefix}/export", params=params
+            )
+            assert response.status_code == status.HTTP_200_OK
+            return [
+                json.loads(line)["id"] for line in response.text.splitlines()
+            ]
+
+        # `since` is inclusive and `until` exclusive, so windows that
+        # follow each other pick up every change exactly once.
+        first = await export_ids(until="2022-07-02T00:00:00")
+        second = await export_ids(
+            since="2022-07-02T00:00:00", until="2022-07-03T00:00:00"
+        )
+        third = await export_ids(since="2022-07-03T00:00:00")
+
+    assert (first, second, third) == (
+        [products[0].id],
+        [products[1].id],
+        [products[2].id],
+    )
+
+
+@pytest.mark.asyncio
+async def test_search_products(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    categories: List[Category] = await insert_categories(
+        session=session, count=1, fake=faker
+    )
+    payloads = [
+        ("Walnut desk", "Solid wood, oiled."),
+        ("Desk lamp", "Warm light for a walnut desk."),
+        ("Oak shelf", "Fits next to any walnut furniture."),
+        ("Steel chair", "Stackable."),
+    ]
+    for name, description in payloads:
+        session.add(
+            Product(
+                name=name,
+                description=description,
+                quantity=1,
+                price=10.0,
+                category_id=categories[0].id,
+            )
+        )
+    await session.commit()
+
+    url = f"{product_router.prefix}/search"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.get(url=url, params={"q": "walnut"})
+        assert response.status_code == status.HTTP_200_OK
+        names = [product["name"] for product in response.json()]
+        # A match in the name outranks matches in the description.
+        assert names[0] == "Walnut desk"
+        assert set(names) == {"Walnut desk", "Desk lamp", "Oak shelf"}
+        assert response.json()[0]["category"]["id"] == categories[0].id
+
+        paged: List[str] = []
+        cursor = None
+        while True:
+            params = {"q": "walnut", "limit": 1}
+            if cursor is not None:
+                params["cursor"] = cursor
+            response = await ac.get(url=url, params=params)
+            assert response.status_code == status.HTTP_200_OK
+            paged.extend(product["name"] for product in response.json())
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if cursor is None:
+                break
+        assert paged == names
+
+        response = await ac.get(url=url, params={"q": "walnut -lamp"})
+        assert "Desk lamp" not in {p["name"] for p in response.json()}
+
+        response = await ac.get(url=url, params={"q": "marble"})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == []
+        assert NEXT_CURSOR_HEADER not in response.headers
+
+        response = await ac.get(
+            url=url, params={"q": "walnut", "cursor": "not-a-cursor"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_search_products_pages_through_ties(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    categories: List[Category] = await insert_categories(
+        session=session, count=1, fake=faker
+    )
+    # Groups of equally ranked matches, so pages end inside a tie.
+    for i in range(7):
+        session.add(
+            Product(
+                name=f"Walnut stool {i}" if i % 3 else f"Stool {i}",
+                description="Walnut legs." if i % 2 else "Walnut top.",
+                quantity=1,
+                price=10.0,
+                category_id=categories[0].id,
+            )
+        )
+    await session.commit()
+
+    url = f"{product_router.prefix}/search"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        single_page: Response = await ac.get(url=url, params={"q": "walnut"})
+        paged: List[int] = []
+        params: Dict[str, Any] = {"q": "walnut", "limit": 2}
+        while True:
+            response: Response = await ac.get(url=url, params=params)
+            assert response.status_code == status.HTTP_200_OK
+            assert 0 < len(response.json()) <= 2
+            paged.extend(product["id"] for product in response.json())
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if cursor is None:
+                break
+            params = {"q": "walnut", "limit": 2, "cursor": cursor}
+
+        empty_page: Response = await ac.get(
+            url=url, params={"q": "walnut", "limit": 0}
+        )
+        short_cursor: Response = await ac.get(
+            url=url,
+            params={"q": "walnut", "cursor": encode_cursor("rank", [1])},
+        )
+
+    assert len(paged) == 7
+    assert paged == [product["id"] for product in single_page.json()]
+    assert empty_page.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert short_cursor.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@postgres_only
+@pytest.mark.asyncio
+async def test_search_products_uses_gin_index(
+    session: AsyncSession,
+) -> None:
+    await session.execute(text("SET LOCAL enable_seqscan = off"))
+    result = await session.execute(
+        text(
+            "EXPLAIN SELECT id FROM products WHERE search_vector "
+            "@@ websearch_to_tsquery('english', 'walnut')"
+        )
+    )
+    plan = "\n".join(result.scalars().all())
+    assert "ix_products_search_vector" in plan, plan
+
+
+@pytest.mark.asyncio
+async def test_get_all_products_filtered(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    categories: List[Category] = await insert_categories(
+        session=session, count=2, fake=faker
+    )
+    for i, (price, quantity) in enumerate(
+        [(5.0, 0), (10.0, 3), (15.0, 1), (20.0, 0), (25.0, 7)]
+    ):
+        session.add(
+            Product(
+                name=f"Product {i}",
+                description=faker.text(),
+                quantity=quantity,
+                price=price,
+                category_id=categories[i % 2].id,
+            )
+        )
+    await session.commit()
+
+    url = f"{product_router.prefix}/"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+
+        async def prices(**params: Any) -> List[float]:
+            response: Response = await ac.get(url=url, params=params)
+            assert response.status_code == status.HTTP_200_OK
+            return [product["price"] for product in response.json()]
+
+        assert await prices(sort="-price") == [25.0, 20.0, 15.0, 10.0, 5.0]
+        assert await prices(category_id=categories[0].id, sort="price") == [
+            5.0,
+            15.0,
+            25.0,
+        ]
+        assert await prices(min_price=10, max_price=20, sort="price") == [
+            10.0,
+            15.0,
+            20.0,
+        ]
+        assert await prices(in_stock=True, sort="price") == [10.0, 15.0, 25.0]
+        assert await prices(in_stock=False, sort="price") == [5.0, 20.0]
+
+        # Restocking a product moves it into cached in-stock listings.
+        sold_out = await ac.get(url=url, params={"in_stock": False})
+        await ac.put(
+            url=f"{product_router.prefix}/{sold_out.json()[0]['id']}/",
+            json={"quantity": 4},
+        )
+        assert await prices(in_stock=True, sort="price") == [
+            5.0,
+            10.0,
+            15.0,
+            25.0,
+        ]
+
+        response = await ac.get(url=url, params={"min_price": -1})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@postgres_only
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"sort": "price"},
+        {"sort": "-price"},
+        {"category_id": 3},
+        {"category_id": 3, "sort": "price"},
+        {"min_price": 40, "max_price": 41, "sort": "price"},
+        {"in_stock": True, "sort": "price"},
+        {"in_stock": True, "min_price": 90, "sort": "price"},
+    ],
+)
+async def test_get_all_products_filtered_uses_indexes(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    connection: AsyncConnection,
+    params: Dict[str, Any],
+) -> None:
+    await insert_categories(session=session, count=20, fake=faker)
+    await session.execute(
+        text(
+            """
+            INSERT INTO products (name, description, quantity, price,
+                                  category_id)
+            SELECT 'Product ' || i, 'Seeded product', i % 5,
+                   (i * 37 % 10000) / 100.0,
+                   (SELECT min(id) FROM categories) + i % 20
+            FROM generate_series(1, 20000) AS i
+            """
+        )
+    )
+    await session.execute(text("ANALYZE products"))
+
+    statements: List[Tuple[str, Any]] = []
+
+    def before_cursor_execute(  # type: ignore
+        conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        if statement.lstrip().startswith("SELECT products."):
+            statements.append((statement, parameters))
+
+    event.listen(
+        connection.sync_engine, "before_cursor_execute", before_cursor_execute
+    )
+    try:
+        async with AsyncClient(app=client.app, base_url="http://test") as ac:
+            response: Response = await ac.get(
+                url=f"{product_router.prefix}/", params=params
+            )
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()
+            cursor = response.headers[NEXT_CURSOR_HEADER]
+            response = await ac.get(
+                url=f"{product_router.prefix}/",
+                params={**params, "cursor": cursor},
+            )
+            assert response.status_code == status.HTTP_200_OK
+    finally:
+        event.remove(
+            connection.sync_engine,
+            "before_cursor_execute",
+            before_cursor_execute,
+        )
+
+    assert len(statements) == 2
+    for statement, parameters in statements:
+        result = await connection.exec_driver_sql(
+            f"EXPLAIN {statement}", parameters
+        )
+        plan = "\n".join(row[0] for row in result)
+        assert "Seq Scan on products" not in plan, plan
+
+    # The seek bounds the index scan itself instead of filtering its rows.
+    lines = plan.splitlines()
+    scan = next(i for i, line in enumerate(lines) if "on products" in line)
+    seek = "ROW(price, id) " if "sort" in params else "(id > "
+    assert "Index Cond:" in lines[scan + 1], plan
+    assert seek in lines[scan + 1], plan
@@ -11,8 +11,11 @@ from requests import Response
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.hashing import password_hasher
 from app.models.user import User, UserCreate, UserDisplay
+from app.pagination import NEXT_CURSOR_HEADER
 from app.routers.user import router as user_router
+from helpers import is_hash
 from tests.conftest import insert_users
 
 
@@ -43,12 +46,43 @@ async def test_user_creation(
     assert response_json["id"] is not None
 
 
+@pytest.mark.asyncio
+async def test_user_creation_stores_password_hash(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    user_create_payload: UserCreate = UserCreate(
+        name=faker.name(),
+        email=faker.email(),
+        password=faker.password(),
+        is_active=faker.pybool(),
+    )
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.post(
+            url=f"{user_router.prefix}/",
+            json=user_create_payload.dict(),
+        )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    result = await session.execute(
+        select(User).where(User.id == response.json()["id"])
+    )
+    user: User = result.scalar_one()
+    assert is_hash(user.password), "Password should be stored hashed"
+    assert await user.check_password_async(user_create_payload.password)
+
+
 @pytest.mark.asyncio
 async def test_user_creation_with_existing_email(
     client: TestClient,
     session: AsyncSession,
     faker: Faker,
+    monkeypatch: pytest.MonkeyPatch,
 ) -> None:
+    async def hash_password(password: str) -> str:
+        raise AssertionError("A duplicate email should not be hashed")
+
     users: List[User] = await insert_users(
         session=session, count=1, fake=faker
     )
@@ -58,6 +92,7 @@ async def test_user_creation_with_existing_email(
         password=faker.password(),
         is_active=faker.pybool(),
     )
+    monkeypatch.setattr(password_hasher, "hash", hash_password)
     async with AsyncClient(app=client.app, base_url="http://test") as ac:
         response: Response = await ac.post(
             url=f"{user_router.prefix}/",
@@ -98,6 +133,31 @@ async def test_get_all_users(
         ), "User in response should match with the user in the database"
 
 
+@pytest.mark.asyncio
+async def test_get_all_users_with_cursor(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    users: List[User] = await insert_users(
+        session=session, count=randint(5, 20), fake=faker
+    )
+
+    page_ids: List[int] = []
+    url = f"{user_router.prefix}/?limit=3&sort=-email"
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.get(url=url)
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            page_ids.extend(u["id"] for u in response.json())
+            next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if next_cursor is None:
+                break
+            response = await ac.get(url=f"{url}&cursor={next_cursor}")
+
+    assert sorted(page_ids) == sorted(user.id for user in users)
+
+
 @pytest.mark.asyncio
 async def test_get_user(
     client: TestClient,
@@ -169,3 +229,26 @@ async def test_delete_non_existing_user(
         )
 
     assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_get_all_users_query_count(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    captured_queries: List[str],
+) -> None:
+    await insert_users(session=session, count=10, fake=faker)
+
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        captured_queries.clear()
+        response: Response = await ac.get(url=f"{user_router.prefix}/")
+        assert response.status_code == status.HTTP_200_OK
+        assert len(captured_queries) == 1, captured_queries
+
+        captured_queries.clear()
+        response = await ac.get(
+            url=f"{user_router.prefix}/{response.json()[0]['id']}"
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert len(captured_queries) == 1, captured_queries
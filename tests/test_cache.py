@@ -0,0 +1,99 @@
+from app.cache import MISSING, TTLCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cache_hit_and_miss() -> None:
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    assert cache.get("a") is MISSING
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 1
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING, "Least recently used entry is kept"
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_entries_expire() -> None:
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is MISSING
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_cache_invalidates_tagged_entries() -> None:
+    cache = TTLCache(maxsize=10, ttl=10)
+    cache.set("product", 1, tags=["product:1"])
+    cache.set("listing", [1, 2], tags=["product:1", "product:2"])
+    cache.set("other", [3], tags=["product:3"])
+
+    cache.invalidate_tags("product:1")
+
+    assert cache.get("product") is MISSING
+    assert cache.get("listing") is MISSING
+    assert cache.get("other") == [3]
+    assert cache.stats()["invalidations"] == 2
+
+    cache.invalidate("other")
+    assert cache.get("other") is MISSING
+
+
+def test_cache_skips_values_read_before_a_write() -> None:
+    cache = TTLCache(maxsize=10, ttl=10)
+    version = cache.version
+    cache.invalidate_tags("product:1")
+
+    cache.set("product", "stale", tags=["product:1"], version=version)
+    assert cache.get("product") is MISSING
+
+    cache.set("product", "fresh", tags=["product:1"], version=cache.version)
+    assert cache.get("product") == "fresh"
+
+
+def test_disabled_cache_stores_nothing() -> None:
+    cache = TTLCache(maxsize=0, ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") is MISSING
+
+
+def test_cache_skips_replica_values_right_after_a_write() -> None:
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1, settle_time=5)
+    assert cache.get("a") == 1, "Nothing was invalidated yet"
+
+    cache.invalidate("a")
+    clock.now = 3
+    cache.set("a", 2, settle_time=5)
+    assert cache.get("a") is MISSING, "A replica may still lag behind"
+
+    clock.now = 6
+    cache.set("a", 3, settle_time=5)
+    assert cache.get("a") == 3
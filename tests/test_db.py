@@ -0,0 +1,144 @@
+from types import SimpleNamespace
+from typing import Any, List
+
+import pytest
+
+from httpx import AsyncClient, Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from starlette import status
+from starlette.requests import Request
+from starlette.testclient import TestClient
+
+from app import db
+from app.routers.category import router as category_router
+from tests.conftest import postgres_only
+
+
+def fake_engine(checked_out: int) -> Any:
+    pool = SimpleNamespace(checkedout=lambda: checked_out)
+    return SimpleNamespace(sync_engine=SimpleNamespace(pool=pool))
+
+
+def make_request(headers: List[Any]) -> Request:
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+
+@pytest.fixture()
+def replica_engines(monkeypatch: pytest.MonkeyPatch) -> List[AsyncEngine]:
+    engines = [
+        db.build_engine(db.settings.SQLALCHEMY_DATABASE_URI) for _ in range(2)
+    ]
+    monkeypatch.setattr(db, "replicas", db.ReplicaSet(engines))
+    return engines
+
+
+def test_replica_set_round_robin() -> None:
+    engines = [fake_engine(0), fake_engine(0), fake_engine(0)]
+    replicas = db.ReplicaSet(engines, selection="round_robin")
+
+    assert [replicas.choose() for _ in range(4)] == [
+        engines[0],
+        engines[1],
+        engines[2],
+        engines[0],
+    ]
+
+
+def test_replica_set_least_connections() -> None:
+    engines = [fake_engine(3), fake_engine(1), fake_engine(1)]
+    replicas = db.ReplicaSet(engines, selection="least_connections")
+
+    # The idlest replicas take turns.
+    assert [replicas.choose() for _ in range(4)] == [
+        engines[1],
+        engines[1],
+        engines[2],
+        engines[1],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_read_session_routing(
+    replica_engines: List[AsyncEngine],
+) -> None:
+    async def bind_for(request: Request) -> Any:
+        sessions = db.get_read_session(request)
+        session: AsyncSession = await sessions.__anext__()
+        bind = session.bind
+        await sessions.aclose()
+        return bind
+
+    assert await bind_for(make_request([])) is replica_engines[0]
+    assert await bind_for(make_request([])) is replica_engines[1]
+    assert (
+        await bind_for(make_request([(b"x-read-primary", b"1")])) is db.engine
+    )
+    assert (
+        await bind_for(make_request([(b"cookie", b"read_primary=1")]))
+        is db.engine
+    )
+
+
+@pytest.mark.asyncio
+async def test_writes_pin_reads_to_primary(
+    client: TestClient,
+    session: AsyncSession,
+    replica_engines: List[AsyncEngine],
+) -> None:
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        read: Response = await ac.get(url=f"{category_router.prefix}/")
+        write: Response = await ac.post(
+            url=f"{category_router.prefix}/", json={"name": "Books"}
+        )
+
+    assert read.status_code == status.HTTP_200_OK
+    assert "set-cookie" not in read.headers
+    assert write.status_code == status.HTTP_201_CREATED
+    assert write.cookies[db.READ_PRIMARY_COOKIE] == "1"
+    assert "Max-Age=5" in write.headers["set-cookie"]
+
+
+@pytest.mark.asyncio
+async def test_writes_do_not_pin_without_replicas(
+    client: TestClient,
+    session: AsyncSession,
+) -> None:
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        write: Response = await ac.post(
+            url=f"{category_router.prefix}/", json={"name": "Books"}
+        )
+
+    assert write.status_code == status.HTTP_201_CREATED
+    assert "set-cookie" not in write.headers
+
+
+@postgres_only
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "table, column",
+    [
+        ("products", "name"),
+        ("categories", "name"),
+        ("users", "email"),
+        ("carts", "user_id"),
+        ("cart_items", "cart_id"),
+        ("cart_items", "product_id"),
+        ("orders", "customer_id"),
+        ("order_details", "order_id"),
+    ],
+)
+async def test_lookup_columns_lead_an_index(
+    session: AsyncSession, table: str, column: str
+) -> None:
+    result = await session.execute(
+        text(
+            """
+            SELECT count(*) FROM pg_index
+            JOIN pg_attribute ON attrelid = indrelid AND attnum = indkey[0]
+            WHERE indrelid = CAST(:table AS regclass) AND attname = :column
+            """
+        ),
+        {"table": table, "column": column},
+    )
+    assert result.scalar_one() > 0
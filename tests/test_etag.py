@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from starlette.requests import Request
+
+from app.etag import etag_matches, make_etag
+
+
+def request_with(if_none_match: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [(b"if-none-match", if_none_match.encode("latin-1"))],
+        }
+    )
+
+
+def test_make_etag_changes_with_row_versions() -> None:
+    updated_at = datetime(2022, 6, 6, 23, 8, 51)
+    etag = make_etag([1, updated_at])
+
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag([1, updated_at])
+    assert etag != make_etag([1, datetime(2022, 6, 6, 23, 8, 52)])
+    assert etag != make_etag([2, updated_at])
+
+
+def test_etag_matches() -> None:
+    etag = make_etag([1])
+
+    assert etag_matches(request_with(etag), etag)
+    assert etag_matches(request_with(f'"other", W/{etag}'), etag)
+    assert etag_matches(request_with("*"), etag)
+    assert not etag_matches(request_with('"other"'), etag)
+    assert not etag_matches(Request({"type": "http", "headers": []}), etag)
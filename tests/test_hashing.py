@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from faker import Faker
+
+from app.hashing import PasswordHasher
+from helpers import is_hash
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_password(faker: Faker) -> None:
+    hasher = PasswordHasher(max_workers=1, max_concurrency=1)
+    password: str = faker.password()
+    try:
+        hashed_passwords = await asyncio.gather(
+            hasher.hash(password), hasher.hash(password)
+        )
+        for hashed_password in hashed_passwords:
+            assert is_hash(hashed_password)
+            assert await hasher.verify(hashed_password, password)
+            assert not await hasher.verify(hashed_password, faker.password())
+        assert hashed_passwords[0] != hashed_passwords[1], "Salt is reused"
+    finally:
+        hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hashing_does_not_block_event_loop(faker: Faker) -> None:
+    hasher = PasswordHasher(max_workers=1, max_concurrency=2)
+    ticks: int = 0
+
+    async def tick() -> None:
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0)
+
+    ticker = asyncio.create_task(tick())
+    try:
+        await asyncio.gather(
+            *(hasher.hash(faker.password()) for _ in range(4))
+        )
+    finally:
+        ticker.cancel()
+        hasher.shutdown()
+    assert ticks > 100, "Event loop was blocked while hashing"
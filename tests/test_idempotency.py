@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from starlette import status
+from starlette.requests import Request
+
+from app.idempotency import (
+    IDEMPOTENT_REPLAYED_HEADER,
+    Claim,
+    insert_or_fetch,
+    replay,
+    request_fingerprint,
+)
+from app.models.idempotency import IdempotencyKey
+from tests.conftest import postgres_only
+
+
+def make_request(method: str, path: str, query: str = "") -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": query.encode("latin-1"),
+            "headers": [],
+        }
+    )
+
+
+def test_request_fingerprint() -> None:
+    fingerprint = request_fingerprint(
+        make_request("POST", "/carts/add", "product_id=1&quantity=2")
+    )
+
+    assert fingerprint == request_fingerprint(
+        make_request("POST", "/carts/add", "quantity=2&product_id=1")
+    )
+    assert fingerprint != request_fingerprint(
+        make_request("POST", "/carts/add", "product_id=1&quantity=3")
+    )
+    assert fingerprint != request_fingerprint(
+        make_request("POST", "/orders/", "product_id=1&quantity=2")
+    )
+
+
+def test_replay() -> None:
+    response = replay(("abc", 201, '{"id":1}'), "abc")
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.body == b'{"id":1}'
+    assert response.headers[IDEMPOTENT_REPLAYED_HEADER] == "true"
+    with pytest.raises(HTTPException) as error:
+        replay(("abc", 201, '{"id":1}'), "other")
+    assert error.value.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@postgres_only
+@pytest.mark.asyncio
+async def test_duplicate_waits_for_the_first_transaction(
+    engine: AsyncEngine,
+) -> None:
+    """A duplicate on another connection waits for the first to commit."""
+    key = "test-duplicate-waits"
+    async with AsyncSession(engine) as first, AsyncSession(engine) as second:
+        try:
+            assert await insert_or_fetch(first, key, "abc") is None
+            duplicate = asyncio.create_task(
+                insert_or_fetch(second, key, "abc")
+            )
+            await asyncio.sleep(0.2)
+            assert not duplicate.done()
+
+            await Claim(first, key, "abc").save(201, {"id": 1})
+            await first.commit()
+
+            assert await duplicate == ("abc", 201, '{"id":1}')
+        finally:
+            await second.rollback()
+            await first.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.key == key)
+            )
+            await first.commit()
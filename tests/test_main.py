@@ -43,3 +43,26 @@ async def test_db_ready(
         )
     assert response.status_code == status.HTTP_200_OK
     assert response.content == b"Database is ready."
+
+
+@pytest.mark.asyncio
+async def test_db_pool_stats(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+) -> None:
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        response: Response = await ac.get(
+            url="/db_pool",
+        )
+    assert response.status_code == status.HTTP_200_OK
+    pool_stats = response.json()
+    for key in (
+        "pool_size",
+        "checked_out",
+        "overflow",
+        "checkouts",
+        "wait_time_total",
+        "wait_time_max",
+    ):
+        assert key in pool_stats, f"{key} is missing in pool stats"
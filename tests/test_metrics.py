@@ -0,0 +1,144 @@
+import re
+
+from typing import Dict, List
+
+import pytest
+
+from faker import Faker
+from httpx import AsyncClient, Response
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from starlette import status
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app import metrics
+from app.middleware import MetricsMiddleware
+from app.models.product import Product
+from app.routers.product import router as product_router
+from tests.conftest import insert_products
+
+SAMPLE = re.compile(r"^(\w+)(?:\{(.*)\})? (\S+)$")
+
+
+def parse(text: str) -> Dict[str, float]:
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, labels, value = match.groups()
+        samples[f"{name}{{{labels or ''}}}"] = float(value)
+    return samples
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    histogram = metrics.Histogram(
+        "test_seconds", "Test histogram.", ("route",), buckets=(0.1, 1.0)
+    )
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, '/a"b')
+
+    assert histogram.render() == [
+        "# HELP test_seconds Test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{route="/a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{route="/a\\"b",le="1.0"} 3',
+        'test_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{route="/a\\"b"} 3.65',
+        'test_seconds_count{route="/a\\"b"} 4',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_per_route_template(
+    client: TestClient,
+    session: AsyncSession,
+    connection: AsyncConnection,
+    faker: Faker,
+) -> None:
+    metrics.instrument_engine(connection.sync_engine)
+    metrics.reset()
+    products: List[Product] = await insert_products(
+        session=session, count=3, fake=faker
+    )
+
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for product in products:
+            response: Response = await ac.get(
+                url=f"{product_router.prefix}/{product.id}/"
+            )
+            assert response.status_code == status.HTTP_200_OK
+        response = await ac.get(url=f"{product_router.prefix}/999999/")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        response = await ac.get(url="/no/such/path")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+        response = await ac.get(url="/metrics")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == (
+        "text/plain; version=0.0.4; charset=utf-8"
+    )
+    samples = parse(response.text)
+    route = 'method="GET",route="/products/{product_id}/"'
+    assert samples[
+        f'http_request_duration_seconds_count{{{route},status="200"}}'
+    ] == len(products)
+    assert (
+        samples[f'http_request_duration_seconds_count{{{route},status="404"}}']
+        == 1
+    )
+    assert (
+        samples[
+            "http_request_duration_seconds_count"
+            '{method="GET",route="unmatched",status="404"}'
+        ]
+        == 1
+    )
+    # Every product read is one query; unrouted requests run none.
+    assert (
+        samples[f"http_request_db_queries_sum{{{route}}}"] == len(products) + 1
+    )
+    assert (
+        samples[
+            "http_request_db_queries_bucket"
+            '{method="GET",route="unmatched",le="0"}'
+        ]
+        == 1
+    )
+    assert samples[f"http_request_db_duration_seconds_sum{{{route}}}"] > 0
+    assert not any(f"/{product.id}/" in name for name in samples)
+
+
+def test_metrics_of_failing_requests() -> None:
+    async def fail(request: Request) -> PlainTextResponse:
+        raise RuntimeError(request.path_params["name"])
+
+    # Plain Starlette routes leave no `route` in the scope.
+    app = Starlette(routes=[Route("/fail/{name}", fail)])
+    app.add_middleware(MetricsMiddleware)
+    metrics.reset()
+
+    # Entering the client runs the lifespan, which is passed through.
+    with TestClient(app, raise_server_exceptions=False) as client:
+        for name in ("a", "b"):
+            response = client.get(f"/fail/{name}")
+            assert (
+                response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    samples = parse(metrics.render().decode("utf-8"))
+    route = 'method="GET",route="/fail/{name}"'
+    assert (
+        samples[f'http_request_duration_seconds_count{{{route},status="500"}}']
+        == 2
+    )
+    assert (
+        samples[f'http_request_duration_seconds_sum{{{route},status="500"}}']
+        > 0
+    )
+    assert samples[f"http_request_db_queries_sum{{{route}}}"] == 0
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from starlette import status
+
+from app.models.user import User
+from app.pagination import KeysetPaginator, encode_cursor
+
+paginator = KeysetPaginator(model=User, sort_keys=("id", "name"))
+
+
+def test_page_without_rows_has_no_cursor() -> None:
+    rows = [SimpleNamespace(id=1, name="a")]
+
+    assert paginator.page([], "id", 0) == ([], None)
+    assert paginator.page(rows, "id", 0) == ([], None)
+    assert paginator.page(rows, "id", 1) == (rows, None)
+
+
+def test_cursor_after_null_sort_value_stays_among_nulls() -> None:
+    statement = paginator.apply(
+        select(User), "name", encode_cursor("name", [None, 3]), 0, 10
+    )
+
+    where = str(statement.whereclause.compile())
+    assert where == "users.name IS NULL AND users.id > :id_1"
+
+
+def test_cursor_with_wrong_number_of_values() -> None:
+    with pytest.raises(HTTPException) as error:
+        paginator.apply(
+            select(User), "name", encode_cursor("name", [3]), 0, 10
+        )
+
+    assert error.value.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_cursor_seeks_with_one_row_comparison() -> None:
+    statement = paginator.apply(
+        select(User), "-name", encode_cursor("-name", ["b", 3]), 0, 10
+    )
+
+    where = str(statement.whereclause.compile())
+    assert where == "(users.name, users.id) < (:param_1, :param_2)"
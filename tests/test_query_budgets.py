@@ -0,0 +1,42 @@
+import pytest
+
+from faker import Faker
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.testclient import TestClient
+
+from app.routers.product import router as product_router
+from tests.conftest import insert_products
+from tests.query_budgets import QUERY_BUDGETS, QueryBudgetExceeded
+
+
+@pytest.mark.asyncio
+async def test_query_budget_lists_the_offending_sql(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    await insert_products(session=session, count=2, fake=faker)
+    monkeypatch.setitem(QUERY_BUDGETS, ("GET", "/products/"), 0)
+
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        with pytest.raises(QueryBudgetExceeded) as exc_info:
+            await ac.get(url=f"{product_router.prefix}/")
+
+    message = str(exc_info.value)
+    assert message.startswith("GET /products/ ran 1 queries, its budget is 0:")
+    assert "1. SELECT products.updated_at" in message
+
+
+@pytest.mark.asyncio
+async def test_routes_without_a_budget_fail(
+    client: TestClient,
+    session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.delitem(QUERY_BUDGETS, ("GET", "/products/"))
+
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        with pytest.raises(QueryBudgetExceeded, match="has no query budget"):
+            await ac.get(url=f"{product_router.prefix}/")
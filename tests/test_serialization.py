@@ -0,0 +1,148 @@
+import json
+
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+import pytest
+
+from faker import Faker
+from httpx import AsyncClient, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+from starlette.testclient import TestClient
+
+from app.cache import product_cache
+from app.models.category import Category
+from app.models.order import Order, OrderDetails, OrderDisplay
+from app.models.product import Product, ProductDisplay
+from app.models.user import User
+from app.routers.cart import router as cart_router
+from app.routers.category import router as category_router
+from app.routers.order import router as order_router
+from app.routers.product import router as product_router
+from app.routers.user import router as user_router
+from app.serialization import encode, ndjson_chunks
+from app.settings import settings
+from tests.conftest import insert_products, insert_users
+
+
+def test_encode_matches_pydantic() -> None:
+    category = Category(id=3, name="Books", updated_at=datetime.utcnow())
+    product = Product(
+        id=7,
+        name="Novel",
+        description="A long story.",
+        price=12.5,
+        quantity=3,
+        category_id=3,
+    )
+    product.category = category
+    user = User(id=1, name="Jane", email="jane@example.com", password="x")
+    order = Order(
+        id=11,
+        order_date=datetime(2022, 7, 1, 12, 30, 15, 120),
+        order_amount=25.0,
+        shipping_address="123 Main St",
+        customer_id=1,
+    )
+    order.user_info = user
+    order.order_details = [
+        OrderDetails(
+            id=1, order_id=11, product_id=7, created_date=datetime.utcnow()
+        )
+    ]
+    order.order_details[0].product = product
+
+    assert json.loads(encode([order], OrderDisplay)) == [
+        json.loads(OrderDisplay.from_orm(order).json())
+    ]
+
+
+def test_encode_reads_mappings() -> None:
+    row = {
+        "id": 1,
+        "name": "Lamp",
+        "description": "Bright.",
+        "price": Decimal("9.99"),
+        "quantity": 2,
+    }
+
+    assert json.loads(encode(row, ProductDisplay)) == {
+        **row,
+        "price": 9.99,
+        "category": None,
+    }
+
+
+@pytest.mark.asyncio
+async def test_fast_json_responses_match_default_responses(
+    client: TestClient,
+    session: AsyncSession,
+    faker: Faker,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    await insert_users(session=session, count=3, fake=faker)
+    products: List[Product] = await insert_products(
+        session=session, count=3, fake=faker
+    )
+    urls = [
+        f"{product_router.prefix}/?limit=2",
+        f"{product_router.prefix}/{products[0].id}/",
+        f"{product_router.prefix}/search?q={products[0].name}",
+        f"{category_router.prefix}/?limit=2",
+        f"{category_router.prefix}/{products[0].category_id}",
+        f"{user_router.prefix}/?limit=2",
+        f"{user_router.prefix}/1",
+        f"{order_router.prefix}/",
+        f"{order_router.prefix}/1",
+    ]
+    async with AsyncClient(app=client.app, base_url="http://test") as ac:
+        for product in products:
+            response: Response = await ac.post(
+                url=f"{cart_router.prefix}/add?product_id={product.id}",
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+        response = await ac.post(url=f"{order_router.prefix}/")
+        assert response.status_code == status.HTTP_201_CREATED
+
+        for fast in (False, True):
+            monkeypatch.setattr(settings, "FAST_JSON_RESPONSES", fast)
+            product_cache.clear()
+            responses = [await ac.get(url=url) for url in urls]
+            if not fast:
+                expected = responses
+                continue
+            for url, default, response in zip(urls, expected, responses):
+                assert response.status_code == status.HTTP_200_OK, url
+                assert response.json() == default.json(), url
+                assert response.headers["content-type"] == "application/json"
+                for header in ("etag", "x-next-cursor"):
+                    assert response.headers.get(header) == (
+                        default.headers.get(header)
+                    ), url
+
+
+@pytest.mark.asyncio
+async def test_ndjson_chunks_are_batched(
+    session: AsyncSession,
+    faker: Faker,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    users: List[User] = await insert_users(
+        session=session, count=5, fake=faker
+    )
+    monkeypatch.setattr(settings, "EXPORT_BATCH_SIZE", 2)
+
+    chunks = [
+        chunk
+        async for chunk in ndjson_chunks(
+            session, select(User.id, User.email).order_by(User.id)
+        )
+    ]
+
+    assert len(chunks) == 3
+    assert [json.loads(line) for line in b"".join(chunks).splitlines()] == [
+        {"id": user.id, "email": user.email} for user in users
+    ]
@@ -0,0 +1,85 @@
+from typing import Optional, Tuple
+
+import pytest
+
+from app.main import app
+from app.server import Server, main, server_options
+from app.settings import Settings, settings
+
+
+@pytest.mark.parametrize(
+    "budget, workers, limits",
+    [
+        (None, 8, (5, 10)),
+        (100, 4, (5, 10)),
+        (40, 4, (5, 5)),
+        (12, 4, (3, 0)),
+        (12, None, (5, 7)),
+    ],
+)
+def test_pool_limits_share_the_connection_budget(
+    budget: Optional[int], workers: Optional[int], limits: Tuple[int, int]
+) -> None:
+    worker_settings = Settings(
+        DB_POOL_SIZE=5,
+        DB_MAX_OVERFLOW=10,
+        DB_CONNECTION_BUDGET=budget,
+        SERVER_WORKERS=workers,
+    )
+    assert worker_settings.pool_limits() == limits
+
+
+def test_pool_limits_reject_a_budget_below_one_per_worker() -> None:
+    with pytest.raises(ValueError, match="cannot be shared by 4 workers"):
+        Settings(DB_CONNECTION_BUDGET=3, SERVER_WORKERS=4).pool_limits()
+
+
+def test_server_options_come_from_settings(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "SERVER_HOST", "127.0.0.1")
+    monkeypatch.setattr(settings, "SERVER_PORT", 8080)
+    monkeypatch.setattr(settings, "SERVER_WORKERS", 3)
+    monkeypatch.setattr(settings, "SERVER_GRACEFUL_TIMEOUT", 10)
+
+    options = server_options()
+
+    assert options["bind"] == "127.0.0.1:8080"
+    assert options["workers"] == 3
+    assert options["graceful_timeout"] == 10
+    assert options["worker_class"] == "app.server.Worker"
+
+
+def test_server_loads_the_app_with_the_options() -> None:
+    server = Server({**server_options(), "workers": 2})
+
+    assert server.cfg.workers == 2
+    assert server.cfg.worker_class_str == "app.server.Worker"
+    assert server.load() is app
+
+
+def test_main_sizes_the_workers_before_running(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    ran_with = []
+    monkeypatch.setattr(settings, "SERVER_WORKERS", None)
+    monkeypatch.setattr(settings, "DB_CONNECTION_BUDGET", None)
+    monkeypatch.setattr(
+        Server, "run", lambda server: ran_with.append(server.cfg.workers)
+    )
+
+    main()
+
+    assert settings.SERVER_WORKERS is not None
+    assert ran_with == [settings.SERVER_WORKERS]
+
+
+def test_main_exits_when_the_budget_is_too_small(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "SERVER_WORKERS", 4)
+    monkeypatch.setattr(settings, "DB_CONNECTION_BUDGET", 3)
+    monkeypatch.setattr(Server, "run", lambda server: None)
+
+    with pytest.raises(SystemExit, match="cannot be shared by 4 workers"):
+        main()